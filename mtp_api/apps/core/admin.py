@@ -109,6 +109,13 @@ class FileDownloadAdmin(admin.ModelAdmin):
 site.register(core_models.FileDownload, FileDownloadAdmin)
 
 
+class BatchCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_pk', 'modified',)
+
+
+site.register(core_models.BatchCheckpoint, BatchCheckpointAdmin)
+
+
 class FormFilter(admin.FieldListFilter):
     template = 'core/admin-form-filter.html'
 
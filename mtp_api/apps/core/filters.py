@@ -1,10 +1,11 @@
+import datetime
 import re
 from functools import reduce
 from operator import or_
 
 from django import forms
 from django.db.models import Q
-from django.utils import six
+from django.utils import six, timezone
 from django.utils.dateparse import parse_datetime
 from django.utils.formats import get_format
 from django.utils.functional import lazy
@@ -91,14 +92,17 @@ class SplitTextInMultipleFieldsFilter(django_filters.CharFilter):
     Filters using a text search.
     Works by splitting the input into words and matches any object
     that have *all* of these words in *any* of the fields in "field_names".
+    If "indexed_field_name" is given, it must be an indexed field whose value contains
+    the values of all fields in "field_names"; it is searched first to narrow down matches.
     """
-    def __init__(self, *args, field_names=(), **kwargs):
+    def __init__(self, *args, field_names=(), indexed_field_name=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         if not field_names:
             raise ValueError('The field_names keyword argument must be specified')
 
         self.field_names = field_names
+        self.indexed_field_name = indexed_field_name
 
     def filter(self, qs, value):
         if value in EMPTY_VALUES:
@@ -115,7 +119,10 @@ class SplitTextInMultipleFieldsFilter(django_filters.CharFilter):
                 })
                 for field in self.field_names
             ]
-            filters.append(reduce(or_, word_qs))
+            word_q = reduce(or_, word_qs)
+            if self.indexed_field_name:
+                word_q = Q(**{f'{self.indexed_field_name}__{self.lookup_expr}': word}) & word_q
+            filters.append(word_q)
         return self.get_method(qs)(*filters)
 
 
@@ -145,10 +152,10 @@ class IsoDateTimeField(forms.DateTimeField):
 
     def strptime(self, value, format):
         if format == 'iso8601':
-            datetime = parse_datetime(value)
-            if datetime is None:
+            parsed = parse_datetime(value)
+            if parsed is None:
                 raise ValueError
-            return datetime
+            return parsed
         return super().strptime(value, format)
 
 
@@ -156,6 +163,24 @@ class IsoDateTimeFilter(django_filters.DateTimeFilter):
     field_class = IsoDateTimeField
 
 
+class UtcDateFromIsoDateTimeFilter(IsoDateTimeFilter):
+    """
+    Filters a date field holding UTC dates using a date-time bound, comparing it to the start of each UTC date;
+    the bound is converted to UTC and rounded up to the next whole date rather than taking its local date
+    """
+
+    def filter(self, qs, value):
+        if value:
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            value = value.astimezone(timezone.utc)
+            date = value.date()
+            if value.time() != datetime.time.min:
+                date += datetime.timedelta(days=1)
+            value = date
+        return super().filter(qs, value)
+
+
 class SafeOrderingFilter(OrderingFilter):
     def get_ordering(self, request, queryset, view):
         ordering = super().get_ordering(request, queryset, view)
@@ -0,0 +1,89 @@
+from anymail.exceptions import AnymailRequestsAPIError
+from django.core.mail import get_connection
+from mtp_common.tasks import default_from_address, is_test_email, prepare_context, prepare_email, send_email
+
+
+class EmailBatch:
+    """
+    Collects templated emails and sends them in batches of at most `batch_size`, each batch over one
+    email backend connection, rather than as one spooled task and connection per email.
+    Emails are prepared by `mtp_common.tasks.prepare_email` and any that need `mtp_common.tasks.send_email`'s
+    special handling are passed on to it: emails only to test addresses (which it does not send outside production)
+    and emails rejected by the email service (which it logs and skips if they are invalid or otherwise raises).
+    Use as a context manager so that the final partial batch is sent:
+
+        with EmailBatch() as emails:
+            emails.add('user@example.com', 'app/email.txt', 'Subject', context={...})
+
+    Emails are only queued when added so anything that should only happen once an email is sent,
+    like recording that it was, should be passed as an `on_sent` callback.
+    """
+
+    def __init__(self, batch_size=100, backend=None):
+        """
+        :param batch_size: maximum number of emails sent over one connection
+        :param backend: dotted path of the email backend; defaults to settings.EMAIL_BACKEND
+        """
+        self.batch_size = batch_size
+        self.backend = backend
+        self.pending_emails = []
+        self.sent_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.send()
+
+    def add(self, to, text_template, subject, context=None, html_template=None, from_address=None,
+            anymail_tags=(), on_sent=None):
+        """
+        Queues an email to be sent with the current batch
+        :param on_sent: optional function called without arguments once the email is sent
+            or has been handled by `mtp_common.tasks.send_email`
+        """
+        if not isinstance(to, (list, tuple)):
+            to = [to]
+        email_kwargs = dict(
+            to=to, text_template=text_template, subject=subject, context=context, html_template=html_template,
+            from_address=from_address, anymail_tags=anymail_tags,
+        )
+        if all(is_test_email(recipient) for recipient in to):
+            self.send_individually(email_kwargs, on_sent)
+            return
+
+        email = prepare_email(
+            from_address or default_from_address(), to, subject,
+            text_template, html_template, prepare_context(context), anymail_tags,
+        )
+        self.pending_emails.append((email, email_kwargs, on_sent))
+        if len(self.pending_emails) >= self.batch_size:
+            self.send()
+
+    def send(self):
+        """
+        Sends pending emails over one connection, calling each email's `on_sent` callback once it is sent
+        """
+        if not self.pending_emails:
+            return
+        emails, self.pending_emails = self.pending_emails, []
+        connection = get_connection(backend=self.backend)
+        connection.open()
+        try:
+            for email, email_kwargs, on_sent in emails:
+                try:
+                    sent_count = connection.send_messages([email]) or 0
+                except AnymailRequestsAPIError:
+                    self.send_individually(email_kwargs, on_sent)
+                    continue
+                self.sent_count += sent_count
+                if sent_count and on_sent:
+                    on_sent()
+        finally:
+            connection.close()
+
+    def send_individually(self, email_kwargs, on_sent):
+        send_email(**email_kwargs)
+        if on_sent:
+            on_sent()
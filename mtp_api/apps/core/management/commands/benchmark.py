@@ -0,0 +1,291 @@
+import datetime
+import itertools
+import json
+import math
+import random
+import textwrap
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from faker import Faker
+import openpyxl
+from rest_framework.test import APIClient
+
+from core.mail import EmailBatch
+from credit.models import Credit
+from disbursement.models import Disbursement
+from mtp_auth.tests.utils import AuthTestCaseMixin
+from notification.management.commands.send_notification_report import generate_report
+from notification.models import Event
+from notification.rules import RULES
+from prison.models import PrisonerLocation
+from security.models import Check, PrisonerProfile, SenderProfile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Times and counts SQL queries for the API's busiest endpoints and commands, printing results as JSON
+    so that runs can be compared across commits.
+    With --seed-data, first replaces all data with a fixed-seed production-scale dataset;
+    only use this on a local database.
+    Changes made while benchmarking are rolled back.
+    """
+    help = textwrap.dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--seed-data', action='store_true', help='Replace all data with a generated dataset')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for generated data and requests')
+        parser.add_argument('--number-of-prisoners', type=int, default=20000, help='Number of prisoners to create')
+        parser.add_argument('--number-of-transactions', type=int, default=30000,
+                            help='Number of bank transfer transactions to create')
+        parser.add_argument('--number-of-payments', type=int, default=300000, help='Number of payments to create')
+        parser.add_argument('--number-of-disbursements', type=int, default=20000,
+                            help='Number of disbursements to create')
+        parser.add_argument('--number-of-checks', type=int, default=10000, help='Number of security checks to create')
+        parser.add_argument('--days-of-history', type=int, default=365, help='Number of days of historical credits')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times to run each benchmark')
+        parser.add_argument('--benchmarks', nargs='*', help='Only run these benchmarks')
+        parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if settings.ENVIRONMENT == 'prod':
+            raise CommandError('Benchmarks cannot be run in production')
+        repeat = options['repeat']
+        if repeat < 1:
+            raise CommandError('Benchmarks must be run at least once')
+        benchmarks = self.get_benchmarks()
+        if options['benchmarks']:
+            unknown_benchmarks = set(options['benchmarks']) - set(benchmarks)
+            if unknown_benchmarks:
+                raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown_benchmarks))}')
+            benchmarks = {name: benchmarks[name] for name in options['benchmarks']}
+
+        if options['seed_data']:
+            self.seed_data(**options)
+        if not Credit.objects.exists():
+            raise CommandError('There are no credits to benchmark; use --seed-data on a local database')
+
+        random.seed(options['seed'])
+        self.users = {
+            'security': User.objects.filter(groups__name='Security').exclude(groups__name='FIU')
+            .order_by('pk').first(),
+            'send_money': User.objects.filter(groups__name='SendMoney').order_by('pk').first(),
+            'prisoner_location_admin': User.objects.filter(groups__name='PrisonerLocationAdmin')
+            .order_by('pk').first(),
+        }
+        results = {
+            name: self.run_benchmark(benchmark, repeat)
+            for name, benchmark in benchmarks.items()
+        }
+        output = json.dumps({
+            'git_commit': settings.APP_GIT_COMMIT,
+            'seed': options['seed'],
+            'repeat': repeat,
+            'dataset': {
+                'credits': Credit.objects_all.count(),
+                'disbursements': Disbursement.objects.count(),
+                'sender_profiles': SenderProfile.objects.count(),
+                'prisoner_profiles': PrisonerProfile.objects.count(),
+                'checks': Check.objects.count(),
+                'events': Event.objects.count(),
+            },
+            'results': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def seed_data(self, **options):
+        verbosity = options['verbosity']
+        random.seed(options['seed'])
+        Faker().seed(options['seed'])
+        call_command(
+            'load_test_data',
+            prisons=['sample'], prisoners=['sample'], credits='random',
+            number_of_prisoners=options['number_of_prisoners'],
+            number_of_transactions=options['number_of_transactions'],
+            number_of_payments=options['number_of_payments'],
+            number_of_disbursements=options['number_of_disbursements'],
+            number_of_checks=options['number_of_checks'],
+            days_of_history=options['days_of_history'],
+            verbosity=verbosity,
+        )
+
+        if verbosity:
+            self.stdout.write('Generating notification events for monitored prisoners')
+        rule = RULES['MONP']
+        prisoner_profiles = PrisonerProfile.objects.order_by('pk')
+        prisoner_profiles = prisoner_profiles[:max(1, prisoner_profiles.count() // 50)]
+        for user in User.objects.filter(groups__name='Security'):
+            for prisoner_profile in prisoner_profiles:
+                prisoner_profile.monitoring_users.add(user)
+        for prisoner_profile in prisoner_profiles:
+            for credit in prisoner_profile.credits.all():
+                rule.create_events(credit)
+
+    def get_benchmarks(self):
+        """
+        Each benchmark prepares anything it needs, like access tokens, and returns the function to measure
+        """
+        return {
+            'credit_list': lambda: self.get('security', 'credit-list', limit=100),
+            'sender_profile_list': lambda: self.get('security', 'senderprofile-list', limit=20),
+            'sender_profile_detail': lambda: self.get(
+                'security', 'senderprofile-detail', args=[self.random_pk(SenderProfile.objects.all())],
+            ),
+            'prisoner_profile_list': lambda: self.get('security', 'prisonerprofile-list', limit=20),
+            'prisoner_profile_detail': lambda: self.get(
+                'security', 'prisonerprofile-detail', args=[self.random_pk(PrisonerProfile.objects.all())],
+            ),
+            'event_list': lambda: self.get('security', 'event-list', limit=25),
+            'check_list': lambda: self.get('security', 'security-check-list', limit=20, status='pending'),
+            'payment_create': self.create_payment,
+            'payment_update': self.update_payment,
+            'update_security_profiles': lambda: lambda: call_command('update_security_profiles', verbosity=0),
+            'notification_report': lambda: self.generate_notification_report,
+            'notification_emails': lambda: self.send_notification_emails,
+            'prisoner_location_upload': self.upload_prisoner_locations,
+        }
+
+    def run_benchmark(self, benchmark, repeat):
+        timings = []
+        query_counts = []
+        for _ in range(repeat):
+            with transaction.atomic():
+                run = benchmark()
+                with CaptureQueriesContext(connection) as captured_queries:
+                    start = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - start)
+                query_counts.append(len(captured_queries))
+                transaction.set_rollback(True)
+        timings = sorted(timings)
+
+        def percentile(p):
+            return round(timings[max(math.ceil(p / 100 * len(timings)) - 1, 0)] * 1000, 1)
+
+        return {
+            'queries': max(query_counts),
+            'min_ms': percentile(0),
+            'median_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'max_ms': percentile(100),
+        }
+
+    def get_client(self, user_type):
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(
+            HTTP_AUTHORIZATION=AuthTestCaseMixin().get_http_authorization_for_user(self.users[user_type])
+        )
+        return client
+
+    def get(self, user_type, url_name, args=None, **params):
+        client = self.get_client(user_type)
+        url = reverse(url_name, args=args)
+
+        def run():
+            response = client.get(url, params, format='json')
+            if response.status_code != 200:
+                raise CommandError(f'{url_name} responded with {response.status_code}')
+
+        return run
+
+    def random_pk(self, queryset):
+        return queryset.order_by('pk')[random.randrange(queryset.count())].pk
+
+    def create_payment(self, client=None):
+        client = client or self.get_client('send_money')
+        prisoner_location = PrisonerLocation.objects.get(
+            pk=self.random_pk(PrisonerLocation.objects.filter(active=True))
+        )
+        payment = {
+            'amount': random.randint(100, 20000),
+            'service_charge': 0,
+            'recipient_name': prisoner_location.prisoner_name,
+            'prisoner_number': prisoner_location.prisoner_number,
+            'prisoner_dob': prisoner_location.prisoner_dob.isoformat(),
+            'ip_address': '127.0.0.1',
+        }
+
+        def run():
+            response = client.post(reverse('payment-list'), data=payment, format='json')
+            if response.status_code != 201:
+                raise CommandError(f'Payment could not be created: {response.content}')
+            return response.json()['uuid']
+
+        return run
+
+    def update_payment(self):
+        client = self.get_client('send_money')
+        payment_uuid = self.create_payment(client)()
+        # a small pool of cards means that some senders will match counting rules
+        payment_update = {
+            'email': 'sender@outside.local',
+            'worldpay_id': get_random_string(),
+            'cardholder_name': 'Sender',
+            'card_number_first_digits': '111122',
+            'card_number_last_digits': '%04d' % random.randint(0, 50),
+            'card_expiry_date': '10/29',
+            'card_brand': 'Visa',
+            'billing_address': {
+                'line1': '62 Petty France',
+                'city': 'London',
+                'country': 'UK',
+                'postcode': 'SW1H 9EU',
+            },
+        }
+
+        def run():
+            response = client.patch(reverse('payment-detail', args=[payment_uuid]), data=payment_update, format='json')
+            if response.status_code != 200:
+                raise CommandError(f'Payment could not be updated: {response.content}')
+
+        return run
+
+    def upload_prisoner_locations(self, location_count=10000):
+        # re-uploads existing locations as the nightly NOMIS upload would, cycling them to reach the row count
+        client = self.get_client('prisoner_location_admin')
+        locations = PrisonerLocation.objects.filter(active=True).order_by('pk') \
+            .values('prisoner_name', 'prisoner_number', 'prisoner_dob', 'prison')
+        locations = [
+            dict(location, prisoner_dob=location['prisoner_dob'].isoformat())
+            for location in itertools.islice(itertools.cycle(locations), location_count)
+        ]
+
+        def run():
+            response = client.post(reverse('prisonerlocation-list'), data=locations, format='json')
+            if response.status_code != 201:
+                raise CommandError(f'Prisoner locations could not be uploaded: {response.content}')
+
+        return run
+
+    def send_notification_emails(self, email_count=100):
+        # emails are rendered and sent to an in-memory backend to measure dispatch throughput
+        users = User.objects.filter(groups__name='Security').order_by('pk')
+        users = itertools.islice(itertools.cycle(users), email_count)
+        with EmailBatch(backend='django.core.mail.backends.locmem.EmailBackend') as emails:
+            for user in users:
+                emails.add(
+                    f'{user.username}@example.com', 'notification/not-monitoring.txt',
+                    'New helpful ways to get the best from the intelligence tool',
+                    context={'user': user, 'staff_email': True},
+                    html_template='notification/not-monitoring.html',
+                )
+
+    def generate_notification_report(self):
+        period_end = timezone.make_aware(datetime.datetime.combine(timezone.localdate(), datetime.time.min))
+        period_start = period_end - datetime.timedelta(days=7)
+        workbook = openpyxl.Workbook(write_only=True)
+        generate_report(workbook, period_start, period_end, list(RULES.values()))
@@ -242,8 +242,8 @@ class Command(BaseCommand):
 
         if credits == 'random':
             print_message('Generating random credits')
-            generate_transactions(transaction_batch=number_of_transactions)
-            generate_payments(payment_batch=number_of_payments)
+            generate_transactions(transaction_batch=number_of_transactions, days_of_history=days_of_history)
+            generate_payments(payment_batch=number_of_payments, days_of_history=days_of_history)
         elif credits == 'nomis':
             print_message('Generating test NOMIS credits')
             generate_transactions(
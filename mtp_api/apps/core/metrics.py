@@ -0,0 +1,38 @@
+import os
+
+from django.apps import apps
+from prometheus_client import Histogram, multiprocess
+
+
+def get_metric_registry():
+    """
+    Returns the registry that request metrics should be registered in.
+    uWSGI runs several processes (c.f. `api.ini`) so when `prometheus_multiproc_dir` is set,
+    samples are shared between processes through files in that directory instead
+    and collected from there when metrics are requested.
+    """
+    registry = apps.get_app_config('metrics').metric_registry
+    if os.environ.get('prometheus_multiproc_dir'):
+        multiprocess.MultiProcessCollector(registry)
+        return None
+    return registry
+
+
+metric_registry = get_metric_registry()
+
+request_duration = Histogram(
+    'mtp_api_request_duration_seconds', 'Time taken to respond to requests',
+    labelnames=['view', 'method'],
+    registry=metric_registry,
+)
+request_sql_queries = Histogram(
+    'mtp_api_request_sql_queries', 'Number of SQL queries made to respond to requests',
+    labelnames=['view', 'method'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf')),
+    registry=metric_registry,
+)
+request_sql_duration = Histogram(
+    'mtp_api_request_sql_duration_seconds', 'Time spent in SQL queries to respond to requests',
+    labelnames=['view', 'method'],
+    registry=metric_registry,
+)
@@ -0,0 +1,76 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from core.metrics import request_duration, request_sql_duration, request_sql_queries
+
+logger = logging.getLogger('mtp')
+
+
+class QueryTimer:
+    """
+    Database execute wrapper that counts and times queries made on one connection
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the number of SQL queries, the time spent in them and the total time taken to respond to each request
+    as histograms labelled with the view name, c.f. `core.metrics`.
+    Database connections are per-thread so only queries made by the request's thread are counted.
+    Set REQUEST_METRICS_LOGGING to also log a line for every request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(query_timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view = self.get_view_name(request)
+        method = request.method
+        request_duration.labels(view, method).observe(duration)
+        request_sql_queries.labels(view, method).observe(query_timer.count)
+        request_sql_duration.labels(view, method).observe(query_timer.duration)
+        if settings.REQUEST_METRICS_LOGGING:
+            logger.info(
+                '%s %s took %0.3fs with %d SQL queries taking %0.3fs',
+                method, view, duration, query_timer.count, query_timer.duration,
+                extra={'elk_fields': {
+                    '@fields.view': view,
+                    '@fields.method': method,
+                    '@fields.status': response.status_code,
+                    '@fields.response_time': duration,
+                    '@fields.sql_queries': query_timer.count,
+                    '@fields.sql_time': query_timer.duration,
+                }}
+            )
+        return response
+
+    def get_view_name(self, request):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if not resolver_match:
+            return 'unresolved'
+        # rest framework viewsets only set `cls`
+        view_class = getattr(resolver_match.func, 'cls', None) or getattr(resolver_match.func, 'view_class', None)
+        if view_class:
+            return view_class.__name__
+        return resolver_match.view_name or resolver_match.func.__name__
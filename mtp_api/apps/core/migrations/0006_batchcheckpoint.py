@@ -0,0 +1,23 @@
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0005_delete_token'),
+    ]
+    operations = [
+        migrations.CreateModel(
+            name='BatchCheckpoint',
+            fields=[
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('last_pk', models.BigIntegerField()),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+    ]
@@ -6,7 +6,9 @@ from crontab import CronTab
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.management import call_command, get_commands
-from django.db import models
+from django.core.signals import setting_changed
+from django.db import connections, models
+from django.db.backends.signals import connection_created
 from django.db.models.functions.datetime import TruncBase
 from django.dispatch import receiver
 from django.utils import timezone
@@ -98,9 +100,77 @@ models.DateTimeField.register_lookup(TruncUtcDate)
 models.DateTimeField.register_lookup(TruncLocalDate)
 
 
+def set_database_time_zone(connection):
+    # database functions that save local dates read the time zone from this session setting
+    # so that it is not fixed when they are created
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT set_config(%s, %s, false)', ['mtp.time_zone', settings.TIME_ZONE])
+
+
+@receiver(connection_created)
+def set_time_zone_on_connection(connection, **kwargs):
+    if connection.vendor == 'postgresql':
+        set_database_time_zone(connection)
+
+
+@receiver(setting_changed)
+def set_time_zone_on_setting_change(setting, **kwargs):
+    if setting != 'TIME_ZONE':
+        return
+    for connection in connections.all():
+        if connection.vendor == 'postgresql' and connection.connection is not None:
+            set_database_time_zone(connection)
+
+
 class FileDownload(TimeStampedModel):
     label = models.CharField(max_length=255, db_index=True)
     date = models.DateField(db_index=True)
 
     class Meta:
         unique_together = ('label', 'date')
+
+
+class BatchCheckpointManager(models.Manager):
+    def iterate(self, queryset, batch_size, name=None):
+        """
+        Yields successive lists of up to `batch_size` primary keys from `queryset` in ascending order.
+        Each batch is found by seeking past the last primary key rather than by offset so the cost does not grow
+        with progress and rows leaving the queryset as earlier batches are processed cannot cause others to be skipped.
+        If named, a checkpoint is saved once each batch has been processed so that an interrupted run resumes
+        where it stopped; the checkpoint is removed once all batches are done
+        """
+        last_pk = None
+        if name:
+            checkpoint = self.filter(name=name).first()
+            if checkpoint:
+                last_pk = checkpoint.last_pk
+
+        queryset = queryset.order_by('pk').values_list('pk', flat=True).distinct()
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            yield batch
+            last_pk = batch[-1]
+            if name:
+                self.update_or_create(name=name, defaults={'last_pk': last_pk})
+
+        if name:
+            self.filter(name=name).delete()
+
+
+class BatchCheckpoint(TimeStampedModel):
+    """
+    Progress of an interrupted batch job, see `BatchCheckpointManager.iterate`
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    last_pk = models.BigIntegerField()
+
+    objects = BatchCheckpointManager()
+
+    class Meta:
+        ordering = ('name',)
+
+    def __str__(self):
+        return '%s after %s' % (self.name, self.last_pk)
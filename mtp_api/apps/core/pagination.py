@@ -0,0 +1,163 @@
+import base64
+import binascii
+from collections import OrderedDict
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def get_approximate_count(queryset):
+    """
+    Estimates the number of rows a queryset would return using the query planner's statistics
+    rather than counting them
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class LimitOffsetOrCursorPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination which can instead page through results by keyset when a `cursor` parameter is provided
+    (empty for the first page). This avoids counting all results and scanning past skipped rows, but only
+    supports ordering by one of the view's `cursor_ordering_fields` (either direction) followed by ascending id
+    or by id alone so that an index can be used.
+    Only a `next` link is returned; an estimated `count` is included if `count=approximate` is requested.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.cursor_mode = False
+            return super().paginate_queryset(queryset, request, view=view)
+
+        self.cursor_mode = True
+        self.request = request
+        self.model = queryset.model
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            self.limit = self.default_limit or self.max_limit
+        self.ordering = self.get_ordering(queryset, view)
+
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.count = get_approximate_count(queryset)
+        else:
+            self.count = None
+
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            page = []
+            for position_filter in self.get_position_filters(self.decode_cursor(cursor)):
+                page.extend(queryset.filter(position_filter)[:self.limit + 1 - len(page)])
+                if len(page) > self.limit:
+                    break
+        else:
+            page = list(queryset[:self.limit + 1])
+        if len(page) > self.limit:
+            page = page[:self.limit]
+            self.next_position = [getattr(page[-1], field) for field, _ in self.ordering]
+        else:
+            self.next_position = None
+        return page
+
+    def get_ordering(self, queryset, view):
+        query = queryset.query
+        ordering = list(query.order_by or (query.default_ordering and queryset.model._meta.ordering) or [])
+        if not all(isinstance(field, str) for field in ordering):
+            ordering = []
+        ordering = [
+            (field.lstrip('-'), field.startswith('-'))
+            for field in ordering
+        ]
+        ordering = [
+            ('id', descending) if field == 'pk' else (field, descending)
+            for field, descending in ordering
+        ]
+        supported_fields = getattr(view, 'cursor_ordering_fields', ())
+        if ordering in ([('id', False)], [('id', True)]):
+            return ordering
+        if len(ordering) == 2 and ordering[0][0] in supported_fields and ordering[1] == ('id', False):
+            return ordering
+        raise ValidationError({
+            self.cursor_query_param: 'Cursor pagination does not support this ordering'
+        })
+
+    def get_position_filters(self, position):
+        """
+        Returns filters selecting rows after `position` in `self.ordering`, in the order that they should be queried.
+        Each filter bounds the leading ordering field so that an index range can be scanned;
+        rows where it is null (which PostgreSQL sorts as if they were the largest value) are selected separately
+        """
+        if len(self.ordering) == 1:
+            (_, descending), = self.ordering
+            return [Q(**{'id__lt' if descending else 'id__gt': position[0]})]
+
+        (field, descending), _ = self.ordering
+        value, last_pk = position
+        if value is None:
+            nulls_after = Q(**{f'{field}__isnull': True, 'id__gt': last_pk})
+            if descending:
+                return [nulls_after, Q(**{f'{field}__isnull': False})]
+            return [nulls_after]
+
+        lookup = 'lt' if descending else 'gt'
+        position_filters = [
+            Q(**{f'{field}__{lookup}e': value}) & (
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, 'id__gt': last_pk})
+            )
+        ]
+        if not descending and self.model._meta.get_field(field).null:
+            position_filters.append(Q(**{f'{field}__isnull': True}))
+        return position_filters
+
+    def encode_cursor(self, position):
+        # dates are encoded in full as DjangoJSONEncoder truncates microseconds
+        cursor = json.dumps(position, default=lambda value: value.isoformat())
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            return [
+                None if value is None else self.model._meta.get_field(field).to_python(value)
+                for (field, _), value in zip(self.ordering, position)
+            ]
+        except (binascii.Error, UnicodeDecodeError, ValueError, DjangoValidationError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_html_context(self):
+        if not self.cursor_mode:
+            return super().get_html_context()
+        return {'previous_url': None, 'next_url': self.get_next_link()}
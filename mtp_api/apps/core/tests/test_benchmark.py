@@ -0,0 +1,40 @@
+import json
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import captured_stdout
+
+from core.tests.utils import make_test_users
+from payment.models import Payment
+from payment.tests.utils import generate_payments
+from prison.tests.utils import load_random_prisoner_locations
+
+
+class BenchmarkTestCase(TestCase):
+    fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
+
+    def test_benchmark_results(self):
+        make_test_users(clerks_per_prison=1)
+        load_random_prisoner_locations(number_of_prisoners=5)
+        generate_payments(payment_batch=20)
+        call_command('update_security_profiles', verbosity=0)
+        payment_count = Payment.objects.count()
+
+        with captured_stdout() as stdout:
+            call_command('benchmark', repeat=2)
+        results = json.loads(stdout.getvalue())
+
+        self.assertEqual(results['repeat'], 2)
+        self.assertSetEqual(set(results['results']), {
+            'credit_list',
+            'sender_profile_list', 'sender_profile_detail',
+            'prisoner_profile_list', 'prisoner_profile_detail',
+            'event_list', 'check_list',
+            'payment_create', 'payment_update',
+            'update_security_profiles', 'notification_report', 'notification_emails',
+            'prisoner_location_upload',
+        })
+        for result in results['results'].values():
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['min_ms'], result['p95_ms'])
+        self.assertEqual(Payment.objects.count(), payment_count)
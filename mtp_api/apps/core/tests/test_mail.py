@@ -0,0 +1,85 @@
+from unittest import mock
+
+from anymail.exceptions import AnymailRequestsAPIError
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend as LocMemEmailBackend
+from django.test import SimpleTestCase, override_settings
+
+from core.mail import EmailBatch
+
+
+@override_settings(ENVIRONMENT='prod')
+class EmailBatchTestCase(SimpleTestCase):
+    def add_emails(self, emails, count, on_sent=None):
+        for number in range(count):
+            emails.add(
+                f'user{number}@example.com', 'mtp_auth/new_account_requests.txt', f'Email {number}',
+                context={'service_name': 'cashbook', 'names': ['Mary Halls'], 'login_url': 'http://localhost/'},
+                html_template='mtp_auth/new_account_requests.html',
+                anymail_tags=['new-account-requests'],
+                on_sent=on_sent and (lambda number=number: on_sent(number)),
+            )
+
+    def test_emails_sent_in_bounded_batches(self):
+        with mock.patch('core.mail.get_connection', wraps=get_connection) as mocked_get_connection:
+            with EmailBatch(batch_size=2) as emails:
+                self.add_emails(emails, 5)
+                self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(mocked_get_connection.call_count, 3)
+        self.assertEqual(emails.sent_count, 5)
+        self.assertListEqual([email.subject for email in mail.outbox], [f'Email {number}' for number in range(5)])
+        self.assertListEqual(mail.outbox[0].to, ['user0@example.com'])
+        self.assertIn('cashbook', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertListEqual(mail.outbox[0].tags, ['new-account-requests'])
+
+    def test_nothing_sent_after_error(self):
+        with self.assertRaises(ValueError):
+            with EmailBatch() as emails:
+                self.add_emails(emails, 2)
+                raise ValueError
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_on_sent_only_called_for_sent_batches(self):
+        sent_numbers = []
+        send_messages = LocMemEmailBackend.send_messages
+
+        def fail_third_email(backend, messages):
+            if messages[0].subject == 'Email 2':
+                raise AnymailRequestsAPIError(status_code=500)
+            return send_messages(backend, messages)
+
+        with mock.patch.object(LocMemEmailBackend, 'send_messages', fail_third_email):
+            with self.assertRaises(AnymailRequestsAPIError):
+                with EmailBatch(batch_size=2) as emails:
+                    self.add_emails(emails, 5, on_sent=sent_numbers.append)
+        self.assertListEqual(sent_numbers, [0, 1])
+        self.assertEqual(emails.sent_count, 2)
+
+    def test_invalid_addresses_skipped(self):
+        sent_numbers = []
+        send_messages = LocMemEmailBackend.send_messages
+        response = mock.Mock(**{'json.return_value': {'message': "'to' parameter is not a valid address."}})
+
+        def reject_third_email(backend, messages):
+            if messages[0].subject == 'Email 2':
+                raise AnymailRequestsAPIError(status_code=400, response=response)
+            return send_messages(backend, messages)
+
+        with mock.patch.object(LocMemEmailBackend, 'send_messages', reject_third_email):
+            with self.assertLogs('mtp', level='WARNING') as logs:
+                with EmailBatch(batch_size=2) as emails:
+                    self.add_emails(emails, 5, on_sent=sent_numbers.append)
+        self.assertTrue(any('not a valid address' in line for line in logs.output))
+        self.assertListEqual([email.subject for email in mail.outbox], ['Email 0', 'Email 1', 'Email 3', 'Email 4'])
+        self.assertListEqual(sent_numbers, [0, 1, 2, 3, 4])
+        self.assertEqual(emails.sent_count, 4)
+
+    @override_settings(ENVIRONMENT='local')
+    def test_test_addresses_not_sent_outside_production(self):
+        with EmailBatch() as emails:
+            emails.add('user@mtp.local', 'mtp_auth/new_account_requests.txt', 'Email', context={
+                'service_name': 'cashbook', 'names': ['Mary Halls'], 'login_url': 'http://localhost/',
+            })
+        self.assertEqual(len(mail.outbox), 0)
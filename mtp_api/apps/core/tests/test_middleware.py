@@ -0,0 +1,42 @@
+import base64
+
+from django.apps import apps
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+class RequestMetricsMiddlewareTestCase(TestCase):
+    fixtures = ['test_prisons.json']
+
+    def get_sample_value(self, name, view='PrisonView'):
+        registry = apps.get_app_config('metrics').metric_registry
+        return registry.get_sample_value(name, {'view': view, 'method': 'GET'}) or 0
+
+    def test_request_metrics_recorded(self):
+        request_count = self.get_sample_value('mtp_api_request_duration_seconds_count')
+        query_count = self.get_sample_value('mtp_api_request_sql_queries_sum')
+
+        response = self.client.get(reverse('prison-list'))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.get_sample_value('mtp_api_request_duration_seconds_count'), request_count + 1)
+        self.assertGreater(self.get_sample_value('mtp_api_request_sql_queries_sum'), query_count)
+
+    @override_settings(REQUEST_METRICS_LOGGING=True)
+    def test_request_metrics_logged(self):
+        with self.assertLogs('mtp', level='INFO') as logs:
+            self.client.get(reverse('prison-list'))
+        self.assertTrue(any('GET PrisonView took' in line for line in logs.output))
+
+    @override_settings(METRICS_USER='prom', METRICS_PASS='prom')
+    def test_metrics_exported(self):
+        self.client.get(reverse('prison-list'))
+        response = self.client.get(
+            reverse('prometheus_metrics'),
+            HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'prom:prom').decode(),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('mtp_api_request_sql_queries_bucket{', response.content.decode())
+
+        response = self.client.get(reverse('prometheus_metrics'))
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,42 @@
+import textwrap
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+
+from credit.models import Credit
+
+
+class Command(BaseCommand):
+    """
+    Repairs the denormalised search text of credits where it is missing or out of date,
+    e.g. if the search text triggers were disabled; each batch of credits is updated in a separate transaction
+    """
+    help = textwrap.dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of credit ids to update at a time')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        batch_size = options['batch_size']
+
+        id_range = Credit.objects_all.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if id_range['min_id'] is None:
+            return
+        updated = 0
+        for start_id in range(id_range['min_id'], id_range['max_id'] + 1, batch_size):
+            with connection.cursor() as cursor:
+                # setting the search text to anything causes the trigger to recalculate it
+                cursor.execute(
+                    """
+                    UPDATE credit_credit SET search_text = NULL
+                    WHERE id >= %s AND id < %s
+                    AND search_text IS DISTINCT FROM credit_search_text(id, prisoner_name, prisoner_number)
+                    """,
+                    (start_id, start_id + batch_size)
+                )
+                updated += cursor.rowcount
+        if verbosity:
+            self.stdout.write('Updated search text for %d credits' % updated)
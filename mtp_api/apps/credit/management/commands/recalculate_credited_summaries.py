@@ -0,0 +1,19 @@
+import textwrap
+
+from django.core.management import BaseCommand
+
+from credit.models import CreditedSummary
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds summaries of credited credits used for cashbook history,
+    e.g. after credited credits were deleted or had their prison or owner changed
+    """
+    help = textwrap.dedent(__doc__).strip()
+
+    def handle(self, *args, **options):
+        verbosity = options.get('verbosity', 1)
+        CreditedSummary.objects.recalculate()
+        if verbosity:
+            self.stdout.write('Recalculated %d credited summaries' % CreditedSummary.objects.count())
@@ -1,18 +1,31 @@
+import datetime
 import textwrap
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 from credit.models import CreditingTime
 
 
 class Command(BaseCommand):
     """
-    Run full re-calculation of times from receipt of a credit to it being credited
+    Re-calculate times from receipt of a credit to it being credited; crediting times are updated in place
     """
     help = textwrap.dedent(__doc__).strip()
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--since', help='Only credits credited since date (inclusive)')
+
     def handle(self, *args, **options):
         verbosity = options.get('verbosity', 1)
-        count = CreditingTime.objects.recalculate_crediting_times()
+        since = options.get('since')
+        if since:
+            since_date = parse_date(since)
+            if not since_date:
+                raise CommandError('Cannot parse date')
+            since = timezone.make_aware(datetime.datetime.combine(since_date, datetime.time.min))
+        count = CreditingTime.objects.recalculate_crediting_times(since=since or None)
         if verbosity:
             self.stdout.write('Recalculated crediting times for %d credits' % count)
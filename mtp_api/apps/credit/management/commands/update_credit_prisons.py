@@ -0,0 +1,16 @@
+import textwrap
+
+from django.core.management import BaseCommand
+
+from credit.models import Credit
+
+
+class Command(BaseCommand):
+    """
+    Matches all pending credits to the active location of their prisoner,
+    e.g. picking up credits missed when updating only those of changed prisoner locations failed
+    """
+    help = textwrap.dedent(__doc__).strip()
+
+    def handle(self, *args, **options):
+        Credit.objects.update_prisons()
@@ -1,6 +1,7 @@
 from django.db import connection, models
-from django.db.models import Q
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
 from django.db.transaction import atomic
+from django.utils import timezone
 
 from credit import InvalidCreditStateException
 from credit.constants import LOG_ACTIONS, CREDIT_STATUS, CREDIT_RESOLUTION
@@ -36,6 +37,20 @@ class CreditQuerySet(models.QuerySet):
             .order_by('received_at_date') \
             .annotate(amount_per_day=models.Sum('amount'))
 
+    def annotate_action_dates(self):
+        """
+        Annotates the latest credited, refunded and marked-for-manual-processing log dates
+        so that `Credit.credited_at` and similar properties do not need a query per credit
+        """
+        from credit.models import Log
+
+        return self.annotate(**{
+            f'{action}_log_created': Subquery(
+                Log.objects.filter(credit=OuterRef('pk'), action=action).order_by('-created').values('created')[:1]
+            )
+            for action in (LOG_ACTIONS.CREDITED, LOG_ACTIONS.REFUNDED, LOG_ACTIONS.MANUAL)
+        })
+
     def monitored_by(self, user):
         return self.filter(
             Q(sender_profile__bank_transfer_details__sender_bank_account__monitoring_users=user) |
@@ -45,23 +60,52 @@ class CreditQuerySet(models.QuerySet):
 
 
 class CreditManager(models.Manager):
-    def update_prisons(self):
+    update_prisons_chunk_size = 5000
+
+    def update_prisons(self, changed_prisoner_keys=None):
+        """
+        Matches pending credits to the active location of their prisoner
+        :param changed_prisoner_keys: if provided, only credits for these (prisoner_number, prisoner_dob) pairs
+            are updated, in chunks each committed in its own transaction so that row locks are held briefly
+            (NB: this only holds if not called inside an outer transaction);
+            otherwise all pending credits are matched
+        """
+        if changed_prisoner_keys is None:
+            self._update_prisons()
+            return
+        changed_prisoner_keys = sorted(changed_prisoner_keys)
+        for start in range(0, len(changed_prisoner_keys), self.update_prisons_chunk_size):
+            chunk = changed_prisoner_keys[start:start + self.update_prisons_chunk_size]
+            with atomic():
+                self._update_prisons(
+                    'JOIN unnest(%s::varchar[], %s::date[]) AS changed (prisoner_number, prisoner_dob) '
+                    'ON c.prisoner_number = changed.prisoner_number AND c.prisoner_dob = changed.prisoner_dob',
+                    [[prisoner_number for prisoner_number, _ in chunk], [prisoner_dob for _, prisoner_dob in chunk]]
+                )
+
+    def _update_prisons(self, changed_prisoner_join='', changed_prisoner_params=()):
         with connection.cursor() as cursor:
             cursor.execute(
                 """
                 UPDATE credit_credit
                 SET prison_id = pl.prison_id, prisoner_name = pl.prisoner_name
                 FROM credit_credit AS c
+                %s
                 LEFT OUTER JOIN prison_prisonerlocation AS pl
                 ON c.prisoner_number = pl.prisoner_number
                 AND c.prisoner_dob = pl.prisoner_dob AND pl.active IS True
                 LEFT OUTER JOIN payment_payment AS p ON p.credit_id=c.id
-                WHERE c.owner_id IS NULL AND c.resolution = %s
+                WHERE c.owner_id IS NULL AND c.resolution = %%s
                 AND c.reconciled is False AND credit_credit.id = c.id
                 -- don't remove a match from a debit card payment
                 AND NOT (pl.prison_id IS NULL AND p.uuid IS NOT NULL)
-                """,
-                (CREDIT_RESOLUTION.PENDING,)
+                -- only lock and write credits whose match changes
+                AND (
+                    c.prison_id IS DISTINCT FROM pl.prison_id
+                    OR c.prisoner_name IS DISTINCT FROM pl.prisoner_name
+                )
+                """ % changed_prisoner_join,
+                (*changed_prisoner_params, CREDIT_RESOLUTION.PENDING)
             )
 
     @atomic
@@ -77,6 +121,44 @@ class CreditManager(models.Manager):
         Log.objects.credits_reconciled(update_set, user)
         update_set.update(reconciled=True)
 
+    @atomic
+    def credit_bulk(self, ids_with_nomis_ids, user):
+        """
+        Credits prisoners for many credits using a fixed number of statements
+        :param ids_with_nomis_ids: iterable of (credit id, NOMIS transaction id or None) pairs
+        :param user: the user crediting
+        :return: ids of credits that were not in a valid state to be credited, in the order given
+        """
+        from credit.models import Log
+
+        ids_with_nomis_ids = list(ids_with_nomis_ids)
+        nomis_ids = dict(ids_with_nomis_ids)
+        to_update = list(
+            self.get_queryset().credit_pending().filter(
+                pk__in=nomis_ids.keys()
+            ).select_for_update().only('pk')
+        )
+        ids_to_update = {c.pk for c in to_update}
+        conflict_ids = [
+            credit_id
+            for credit_id, _ in ids_with_nomis_ids
+            if credit_id not in ids_to_update
+        ]
+        if not to_update:
+            return conflict_ids
+
+        nomis_id_updates = [
+            When(pk=credit_id, then=Value(nomis_ids[credit_id]))
+            for credit_id in ids_to_update
+            if nomis_ids[credit_id]
+        ]
+        updates = dict(resolution=CREDIT_RESOLUTION.CREDITED, owner=user, modified=timezone.now())
+        if nomis_id_updates:
+            updates['nomis_transaction_id'] = Case(*nomis_id_updates, default=F('nomis_transaction_id'))
+        self.get_queryset().filter(pk__in=ids_to_update).update(**updates)
+        Log.objects.credits_credited(to_update, user)
+        return conflict_ids
+
     @atomic
     def set_manual(self, queryset, credit_ids, user):
         from credit.models import Log
@@ -139,14 +221,19 @@ class LogManager(models.Manager):
                 action=action,
                 user=by_user
             ))
-        self.bulk_create(logs)
+        return self.bulk_create(logs)
 
     def credits_created(self, credits, by_user=None):
         self._log_action(LOG_ACTIONS.CREATED, credits, by_user)
 
     def credits_credited(self, credits, by_user, credited=True):
+        from credit.models import CreditedSummary, CreditingTime
+
         action = LOG_ACTIONS.CREDITED if credited else LOG_ACTIONS.UNCREDITED
-        self._log_action(action, credits, by_user)
+        logs = self._log_action(action, credits, by_user)
+        if credited:
+            CreditingTime.objects.recalculate_crediting_times(credit_ids=[credit.pk for credit in credits])
+            CreditedSummary.objects.add_credited_logs([log.pk for log in logs])
 
     def credits_refunded(self, credits, by_user):
         self._log_action(LOG_ACTIONS.REFUNDED, credits, by_user)
@@ -169,33 +256,115 @@ class LogManager(models.Manager):
 
 
 class CreditingTimeManager(models.Manager):
-    @classmethod
-    def recalculate_crediting_times(cls):
+    def recalculate_crediting_times(self, since=None, credit_ids=None):
         """
-        Recalculate all crediting times, the time from receipt until a credited status is logged
+        Recalculate crediting times in place, the time from receipt until a credited status is logged
         NB: crediting does not happen at weekends so an adjustment is needed
+        :param since: only recalculate credits with a credited status logged since this time
+        :param credit_ids: only recalculate these credits
         :return: the number of credits with calculated times
         """
+        credit_filter = ''
+        params = [LOG_ACTIONS.CREDITED]
+        if since is not None:
+            credit_filter = """
+                AND credit_id IN (SELECT credit_id FROM credit_log WHERE action = %s AND created >= %s)
+            """
+            params += [LOG_ACTIONS.CREDITED, since]
+        elif credit_ids is not None:
+            if not credit_ids:
+                return 0
+            credit_filter = 'AND credit_id = ANY(%s)'
+            params.append(list(credit_ids))
+
         with connection.cursor() as cursor:
+            if since is None and credit_ids is None:
+                cursor.execute("""
+                    DELETE FROM credit_creditingtime
+                    WHERE credit_id NOT IN (SELECT credit_id FROM credit_log WHERE action = %s)
+                """, (LOG_ACTIONS.CREDITED,))
             cursor.execute("""
-                TRUNCATE credit_creditingtime;
                 WITH adjustments (day_of_week, adjustment) AS (
                     VALUES (1, INTERVAL '0'), (2, INTERVAL '0'), (3, INTERVAL '0'), (4, INTERVAL '0'),
                         (5, INTERVAL '2 days'), (6, INTERVAL '1 day'), (7, INTERVAL '0')),
                 credited_log AS (
                     SELECT credit_id, MAX(created) AS created
                     FROM credit_log
-                    WHERE credit_log.action = %s
+                    WHERE credit_log.action = %%s %s
                     GROUP BY credit_id)
                 INSERT INTO credit_creditingtime
                 SELECT credited_log.credit_id, credited_log.created - credit_credit.received_at - adjustments.adjustment
                 FROM credited_log
                 JOIN credit_credit ON credit_credit.id = credited_log.credit_id
-                JOIN adjustments ON adjustments.day_of_week = EXTRACT(ISODOW FROM credit_credit.received_at);
-            """, (LOG_ACTIONS.CREDITED,))
+                JOIN adjustments ON adjustments.day_of_week = EXTRACT(ISODOW FROM credit_credit.received_at)
+                ON CONFLICT (credit_id) DO UPDATE SET crediting_time = EXCLUDED.crediting_time;
+            """ % credit_filter, params)
             return cursor.rowcount
 
 
+class CreditedSummaryManager(models.Manager):
+    def add_credited_logs(self, log_ids):
+        """
+        Adds credits to the summaries for the UTC dates of their new credited logs along with their comments
+        """
+        if not log_ids:
+            return
+        self._change_summaries('credit_log.id = ANY(%(log_ids)s)', {'log_ids': list(log_ids)}, count_change=1)
+
+    def change_comment_count(self, credit_id, comment_count_change):
+        """
+        Adds (or removes if negative) comments of a credited credit to the summaries for its credited log dates
+        """
+        self._change_summaries(
+            'credit_log.credit_id = %(credit_id)s', {'credit_id': credit_id},
+            count_change=0, comment_count_change=comment_count_change,
+        )
+
+    @atomic
+    def recalculate(self):
+        """
+        Rebuilds all summaries, e.g. if credited credits were deleted or their prison or owner were changed
+        which is not otherwise reflected
+        """
+        self.all().delete()
+        self._change_summaries('true', {}, count_change=1)
+
+    def _change_summaries(self, log_filter, params, count_change, comment_count_change=None):
+        """
+        Changes the summaries of credited credits for each matching credited log by `count_change` credits
+        and by `comment_count_change` comments or, if not given, by `count_change` times each credit's comments
+        """
+        if comment_count_change is None:
+            comment_count_change = '%(count_change)s * (' \
+                'SELECT COUNT(*) FROM credit_comment WHERE credit_comment.credit_id = credit_credit.id)'
+        else:
+            params['comment_count_change'] = comment_count_change
+            comment_count_change = '%(comment_count_change)s'
+        params.update(
+            count_change=count_change,
+            credited_action=LOG_ACTIONS.CREDITED,
+            credited_resolution=CREDIT_RESOLUTION.CREDITED,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO credit_creditedsummary
+                    (prison_id, date, owner_id, credit_count, credit_total, credit_comment_count)
+                SELECT credit_credit.prison_id, (credit_log.created AT TIME ZONE 'UTC')::date, credit_credit.owner_id,
+                    SUM(%(count_change)s), SUM(%(count_change)s * credit_credit.amount), SUM({comment_count_change})
+                FROM credit_log
+                JOIN credit_credit ON credit_credit.id = credit_log.credit_id
+                WHERE credit_log.action = %(credited_action)s
+                AND credit_credit.resolution = %(credited_resolution)s
+                AND credit_credit.prison_id IS NOT NULL
+                AND {log_filter}
+                GROUP BY credit_credit.prison_id, (credit_log.created AT TIME ZONE 'UTC')::date, credit_credit.owner_id
+                ON CONFLICT (prison_id, date, COALESCE(owner_id, 0)) DO UPDATE
+                SET credit_count = credit_creditedsummary.credit_count + EXCLUDED.credit_count,
+                    credit_total = credit_creditedsummary.credit_total + EXCLUDED.credit_total,
+                    credit_comment_count = credit_creditedsummary.credit_comment_count + EXCLUDED.credit_comment_count
+            """, params)
+
+
 class PrivateEstateBatchManager(models.Manager):
     @atomic
     def create_batches(self, start_date, end_date):
@@ -0,0 +1,117 @@
+import logging
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models, transaction
+from django.db.models import Max
+
+logger = logging.getLogger('mtp')
+
+# fields are separated by new lines so that a search word (which cannot contain whitespace)
+# can only match the document if it matches one field, c.f. `CreditTextSearchFilter`
+CREATE_TRIGGERS = r'''
+CREATE OR REPLACE FUNCTION credit_search_text(
+    _credit_id integer, _prisoner_name varchar, _prisoner_number varchar
+) RETURNS text AS $$
+    SELECT concat_ws(E'\n',
+        _prisoner_name,
+        _prisoner_number,
+        (SELECT sender_name FROM transaction_transaction WHERE credit_id = _credit_id LIMIT 1),
+        payment_payment.cardholder_name,
+        payment_payment.email
+    )
+    FROM (SELECT 1) AS credit
+    LEFT OUTER JOIN payment_payment ON payment_payment.credit_id = _credit_id;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION credit_search_text_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_text := credit_search_text(NEW.id, NEW.prisoner_name, NEW.prisoner_number);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER credit_search_text
+BEFORE INSERT OR UPDATE OF prisoner_name, prisoner_number, search_text ON credit_credit
+FOR EACH ROW EXECUTE PROCEDURE credit_search_text_trigger();
+
+CREATE OR REPLACE FUNCTION credit_related_search_text_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.credit_id IS NOT NULL THEN
+        UPDATE credit_credit SET search_text = NULL WHERE id = OLD.credit_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.credit_id IS NOT NULL THEN
+        UPDATE credit_credit SET search_text = NULL WHERE id = NEW.credit_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER credit_search_text
+AFTER INSERT OR DELETE OR UPDATE OF credit_id, sender_name ON transaction_transaction
+FOR EACH ROW EXECUTE PROCEDURE credit_related_search_text_trigger();
+
+CREATE TRIGGER credit_search_text
+AFTER INSERT OR DELETE OR UPDATE OF credit_id, cardholder_name, email ON payment_payment
+FOR EACH ROW EXECUTE PROCEDURE credit_related_search_text_trigger();
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER IF EXISTS credit_search_text ON payment_payment;
+DROP TRIGGER IF EXISTS credit_search_text ON transaction_transaction;
+DROP TRIGGER IF EXISTS credit_search_text ON credit_credit;
+DROP FUNCTION IF EXISTS credit_related_search_text_trigger();
+DROP FUNCTION IF EXISTS credit_search_text_trigger();
+DROP FUNCTION IF EXISTS credit_search_text(integer, varchar, varchar);
+'''
+
+CREATE_INDEX = '''
+CREATE INDEX CONCURRENTLY credit_credit_search_text_trgm ON credit_credit USING gin (UPPER(search_text) gin_trgm_ops);
+'''
+
+DROP_INDEX = 'DROP INDEX CONCURRENTLY IF EXISTS credit_credit_search_text_trgm;'
+
+
+def populate_search_text(apps, schema_editor):
+    # each batch is updated in a separate transaction so that the whole table is not locked,
+    # c.f. `backfill_credit_search_text` command;
+    # setting the search text to anything causes the trigger to recalculate it
+    credit = apps.get_model('credit', 'Credit')
+
+    batch_size = 5000
+    last_id = credit.objects.aggregate(Max('id'))['id__max'] or 0
+    logger.info('Highest value of credit.id is %s', last_id)
+    range_start = 0
+    for range_end in range(batch_size, last_id + batch_size, batch_size):
+        with transaction.atomic():
+            credit.objects.filter(
+                id__gte=range_start,
+                id__lt=range_end
+            ).update(search_text=None)
+        logger.info('Updated search_text for %s <= credit.id < %s', range_start, range_end)
+        range_start = range_end
+
+
+class Migration(migrations.Migration):
+    """
+    Not atomic so that existing credits are populated in batches without locking the whole table
+    and the index is built without blocking writes
+    """
+    atomic = False
+
+    dependencies = [
+        ('credit', '0040_removed_single_offender_id_from_credit'),
+        ('payment', '0020_auto_20201007_1448'),
+        ('transaction', '0043_auto_20201007_1448'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='credit',
+            name='search_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(sql=CREATE_TRIGGERS, reverse_sql=DROP_TRIGGERS),
+        migrations.RunPython(code=populate_search_text, reverse_code=migrations.RunPython.noop),
+        migrations.RunSQL(sql=CREATE_INDEX, reverse_sql=DROP_INDEX),
+    ]
@@ -0,0 +1,124 @@
+import logging
+
+from django.db import migrations, models, transaction
+from django.db.models import Max
+
+from credit.constants import CREDIT_RESOLUTION, CREDIT_STATUS
+
+logger = logging.getLogger('mtp')
+
+# c.f. `Credit.credit_pending` and similar properties
+CREATE_TRIGGERS = f'''
+CREATE OR REPLACE FUNCTION credit_status(
+    _credit_id integer, _resolution varchar, _prison_id varchar, _blocked boolean
+) RETURNS varchar AS $$
+    SELECT CASE
+        WHEN _resolution IN ('{CREDIT_RESOLUTION.PENDING}', '{CREDIT_RESOLUTION.MANUAL}')
+            AND _prison_id IS NOT NULL AND NOT _blocked
+            THEN '{CREDIT_STATUS.CREDIT_PENDING}'
+        WHEN _resolution = '{CREDIT_RESOLUTION.CREDITED}' THEN '{CREDIT_STATUS.CREDITED}'
+        WHEN _resolution = '{CREDIT_RESOLUTION.REFUNDED}' THEN '{CREDIT_STATUS.REFUNDED}'
+        WHEN _resolution = '{CREDIT_RESOLUTION.PENDING}' AND NOT EXISTS (
+            SELECT 1 FROM transaction_transaction
+            WHERE credit_id = _credit_id AND incomplete_sender_info
+        ) THEN '{CREDIT_STATUS.REFUND_PENDING}'
+        WHEN _resolution = '{CREDIT_RESOLUTION.FAILED}' THEN '{CREDIT_STATUS.FAILED}'
+    END;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION credit_status_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.status := credit_status(NEW.id, NEW.resolution, NEW.prison_id, NEW.blocked);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER credit_status
+BEFORE INSERT OR UPDATE OF resolution, prison_id, blocked, status ON credit_credit
+FOR EACH ROW EXECUTE PROCEDURE credit_status_trigger();
+
+CREATE OR REPLACE FUNCTION credit_related_status_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.credit_id IS NOT NULL THEN
+        UPDATE credit_credit SET status = NULL WHERE id = OLD.credit_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.credit_id IS NOT NULL THEN
+        UPDATE credit_credit SET status = NULL WHERE id = NEW.credit_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER credit_status
+AFTER INSERT OR DELETE OR UPDATE OF credit_id, incomplete_sender_info ON transaction_transaction
+FOR EACH ROW EXECUTE PROCEDURE credit_related_status_trigger();
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER IF EXISTS credit_status ON transaction_transaction;
+DROP TRIGGER IF EXISTS credit_status ON credit_credit;
+DROP FUNCTION IF EXISTS credit_related_status_trigger();
+DROP FUNCTION IF EXISTS credit_status_trigger();
+DROP FUNCTION IF EXISTS credit_status(integer, varchar, varchar, boolean);
+'''
+
+CREATE_INDEX = 'CREATE INDEX CONCURRENTLY credit_cred_status_1c6002_idx ON credit_credit (status, received_at);'
+
+DROP_INDEX = 'DROP INDEX CONCURRENTLY IF EXISTS credit_cred_status_1c6002_idx;'
+
+
+def populate_credit_status(apps, schema_editor):
+    # each batch is updated in a separate transaction so that the whole table is not locked;
+    # setting the status to anything causes the trigger to recalculate it
+    credit = apps.get_model('credit', 'Credit')
+
+    batch_size = 5000
+    last_id = credit.objects.aggregate(Max('id'))['id__max'] or 0
+    logger.info('Highest value of credit.id is %s', last_id)
+    range_start = 0
+    for range_end in range(batch_size, last_id + batch_size, batch_size):
+        with transaction.atomic():
+            credit.objects.filter(
+                id__gte=range_start,
+                id__lt=range_end
+            ).update(status=None)
+        logger.info('Updated status for %s <= credit.id < %s', range_start, range_end)
+        range_start = range_end
+
+
+class Migration(migrations.Migration):
+    """
+    Not atomic so that existing credits are populated in batches without locking the whole table
+    and the index is built without blocking writes
+    """
+    atomic = False
+
+    dependencies = [
+        ('credit', '0041_credit_search_text'),
+        ('transaction', '0043_auto_20201007_1448'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='credit',
+            name='status',
+            field=models.CharField(
+                blank=True, editable=False, max_length=50, null=True,
+                choices=[
+                    ('credit_pending', 'Credit pending'), ('credited', 'Credited'), ('refunded', 'Refunded'),
+                    ('refund_pending', 'Refund pending'), ('failed', 'Failed'),
+                ],
+            ),
+        ),
+        migrations.RunSQL(sql=CREATE_TRIGGERS, reverse_sql=DROP_TRIGGERS),
+        migrations.RunPython(code=populate_credit_status, reverse_code=migrations.RunPython.noop),
+        migrations.RunSQL(
+            sql=CREATE_INDEX, reverse_sql=DROP_INDEX,
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='credit',
+                    index=models.Index(fields=['status', 'received_at'], name='credit_cred_status_1c6002_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from credit.constants import CREDIT_RESOLUTION, LOG_ACTIONS
+
+# owners are unique including null, so upserts conflict on an expression index
+CREATE_INDEX = '''
+CREATE UNIQUE INDEX credit_creditedsummary_unique
+ON credit_creditedsummary (prison_id, date, COALESCE(owner_id, 0));
+'''
+
+DROP_INDEX = 'DROP INDEX IF EXISTS credit_creditedsummary_unique;'
+
+# a summary row includes a credit once for every credited log, c.f. `CreditedSummaryManager`
+POPULATE_SUMMARY = f'''
+INSERT INTO credit_creditedsummary (prison_id, date, owner_id, credit_count, credit_total, credit_comment_count)
+SELECT credit_credit.prison_id, (credit_log.created AT TIME ZONE 'UTC')::date, credit_credit.owner_id,
+    COUNT(*), SUM(credit_credit.amount),
+    SUM((SELECT COUNT(*) FROM credit_comment WHERE credit_comment.credit_id = credit_credit.id))
+FROM credit_credit
+JOIN credit_log ON credit_log.credit_id = credit_credit.id AND credit_log.action = '{LOG_ACTIONS.CREDITED}'
+WHERE credit_credit.resolution = '{CREDIT_RESOLUTION.CREDITED}' AND credit_credit.prison_id IS NOT NULL
+GROUP BY credit_credit.prison_id, (credit_log.created AT TIME ZONE 'UTC')::date, credit_credit.owner_id;
+'''
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('prison', '0023_removed_single_offender_id_from_prisonerlocation'),
+        ('credit', '0042_credit_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditedSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('credit_count', models.IntegerField(default=0)),
+                ('credit_total', models.BigIntegerField(default=0)),
+                ('credit_comment_count', models.IntegerField(default=0)),
+                ('owner', models.ForeignKey(
+                    null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL,
+                )),
+                ('prison', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prison.Prison')),
+            ],
+            options={
+                'verbose_name_plural': 'credited summaries',
+                'ordering': ('-date', 'owner'),
+            },
+        ),
+        migrations.RunSQL(sql=CREATE_INDEX, reverse_sql=DROP_INDEX),
+        migrations.RunSQL(sql=POPULATE_SUMMARY, reverse_sql=migrations.RunSQL.noop),
+    ]
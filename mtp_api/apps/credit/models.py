@@ -4,7 +4,7 @@ import logging
 from django.conf import settings
 from django.db import models
 from django.db.models import Q, Max
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from model_utils.models import TimeStampedModel
@@ -12,6 +12,7 @@ from model_utils.models import TimeStampedModel
 from credit.constants import LOG_ACTIONS, CREDIT_RESOLUTION, CREDIT_STATUS, CREDIT_SOURCE
 from credit.managers import (
     CompletedCreditManager,
+    CreditedSummaryManager,
     CreditingTimeManager,
     CreditManager,
     CreditQuerySet,
@@ -62,33 +63,21 @@ class Credit(TimeStampedModel):
     private_estate_batch = models.ForeignKey('credit.PrivateEstateBatch', null=True, blank=True,
                                              on_delete=models.SET_NULL)
 
+    # prisoner, sender and email details from credit, payment and transaction for indexed text searches;
+    # maintained by database triggers, c.f. migration 0041_credit_search_text
+    search_text = models.TextField(blank=True, null=True, editable=False)
+    # maintained by database triggers from resolution, prison, blocked and transaction sender details,
+    # c.f. migration 0042_credit_status; like other values set by the database, it is read when a credit is loaded
+    # and is not updated on instances that are saved so use `refresh_from_db(fields=['status'])` if it is needed
+    status = models.CharField(max_length=50, choices=CREDIT_STATUS, blank=True, null=True, editable=False)
+
     objects = CompletedCreditManager.from_queryset(CreditQuerySet)()
     objects_all = CreditManager.from_queryset(CreditQuerySet)()
 
     # NB: there are matching boolean fields or properties on the model instance for each
     STATUS_LOOKUP = {
-        CREDIT_STATUS.CREDIT_PENDING: (
-            Q(blocked=False) &
-            Q(prison__isnull=False) &
-            (Q(resolution=CREDIT_RESOLUTION.PENDING) | Q(resolution=CREDIT_RESOLUTION.MANUAL))
-        ),
-        CREDIT_STATUS.CREDITED: (
-            Q(resolution=CREDIT_RESOLUTION.CREDITED)
-        ),
-        CREDIT_STATUS.REFUNDED: (
-            Q(resolution=CREDIT_RESOLUTION.REFUNDED)
-        ),
-        CREDIT_STATUS.REFUND_PENDING: (
-            (Q(prison__isnull=True) | Q(blocked=True)) &
-            Q(resolution=CREDIT_RESOLUTION.PENDING) &
-            (
-                Q(transaction__isnull=True) |
-                Q(transaction__incomplete_sender_info=False)
-            )
-        ),
-        CREDIT_STATUS.FAILED: (
-            Q(resolution=CREDIT_RESOLUTION.FAILED)
-        ),
+        status: Q(status=status)
+        for status in CREDIT_STATUS.values
     }
 
     class Meta:
@@ -108,6 +97,7 @@ class Credit(TimeStampedModel):
             models.Index(fields=['prisoner_number', 'id']),
             models.Index(fields=['-prisoner_number', 'id']),
             models.Index(fields=['owner', 'reconciled', 'resolution']),
+            models.Index(fields=['status', 'received_at']),
         ]
 
     def __str__(self):
@@ -272,19 +262,6 @@ class Credit(TimeStampedModel):
             )
         )
 
-    @property
-    def status(self):
-        if self.credit_pending:
-            return CREDIT_STATUS.CREDIT_PENDING
-        elif self.credited:
-            return CREDIT_STATUS.CREDITED
-        elif self.refund_pending:
-            return CREDIT_STATUS.REFUND_PENDING
-        elif self.refunded:
-            return CREDIT_STATUS.REFUNDED
-        elif self.failed:
-            return CREDIT_STATUS.FAILED
-
     @property
     def owner_name(self):
         return self.owner.get_full_name() if self.owner else None
@@ -346,23 +323,30 @@ class Credit(TimeStampedModel):
     def credited_at(self):
         if not self.resolution == CREDIT_RESOLUTION.CREDITED:
             return None
-        return self.log_set.get_action_date(LOG_ACTIONS.CREDITED)
+        return self.get_action_date(LOG_ACTIONS.CREDITED)
 
     @property
     def refunded_at(self):
         if not self.resolution == CREDIT_RESOLUTION.REFUNDED:
             return None
-        return self.log_set.get_action_date(LOG_ACTIONS.REFUNDED)
+        return self.get_action_date(LOG_ACTIONS.REFUNDED)
 
     @property
     def set_manual_at(self):
-        return self.log_set.get_action_date(LOG_ACTIONS.MANUAL)
+        return self.get_action_date(LOG_ACTIONS.MANUAL)
 
     @property
     def reconciled_at(self):
         if not self.reconciled:
             return None
-        return self.log_set.get_action_date(LOG_ACTIONS.RECONCILED)
+        return self.get_action_date(LOG_ACTIONS.RECONCILED)
+
+    def get_action_date(self, action):
+        annotation = f'{action}_log_created'
+        if hasattr(self, annotation):
+            # c.f. `CreditQuerySet.annotate_action_dates`
+            return getattr(self, annotation)
+        return self.log_set.get_action_date(action)
 
     @property
     def crediting_time(self):
@@ -408,6 +392,29 @@ class CreditingTime(models.Model):
         return 'Credit %s credited in %s' % (self.credit.pk, self.crediting_time)
 
 
+class CreditedSummary(models.Model):
+    """
+    Number, total amount and comments of credits credited at a prison on a UTC date grouped by owner;
+    updated when credited logs are created and when comments are added to or removed from credited credits,
+    c.f. `CreditedSummaryManager`
+    """
+    prison = models.ForeignKey(Prison, on_delete=models.CASCADE)
+    date = models.DateField()
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.CASCADE)
+    credit_count = models.IntegerField(default=0)
+    credit_total = models.BigIntegerField(default=0)
+    credit_comment_count = models.IntegerField(default=0)
+
+    objects = CreditedSummaryManager()
+
+    class Meta:
+        verbose_name_plural = 'credited summaries'
+        ordering = ('-date', 'owner')
+
+    def __str__(self):
+        return '%d credited at %s on %s' % (self.credit_count, self.prison_id, self.date)
+
+
 class Comment(TimeStampedModel):
     credit = models.ForeignKey(
         Credit, on_delete=models.CASCADE, related_name='comments'
@@ -527,6 +534,17 @@ def credit_failed_receiver(credit, **kwargs):
     Log.objects.credits_failed([credit])
 
 
+@receiver(post_save, sender=Comment, dispatch_uid='add_comment_to_credited_summary')
+def add_comment_to_credited_summary(instance, created, **kwargs):
+    if created:
+        CreditedSummary.objects.change_comment_count(instance.credit_id, 1)
+
+
+@receiver(post_delete, sender=Comment, dispatch_uid='remove_comment_from_credited_summary')
+def remove_comment_from_credited_summary(instance, **kwargs):
+    CreditedSummary.objects.change_comment_count(instance.credit_id, -1)
+
+
 @receiver(credit_prisons_need_updating)
-def update_credit_prisons(**kwargs):
-    Credit.objects.update_prisons()
+def update_credit_prisons(changed_prisoner_keys=None, **kwargs):
+    Credit.objects.update_prisons(changed_prisoner_keys)
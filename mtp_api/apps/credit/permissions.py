@@ -1,4 +1,5 @@
 from core.permissions import ActionsBasedPermissions
+from credit.models import Credit
 
 
 class CreditPermissions(ActionsBasedPermissions):
@@ -17,3 +18,11 @@ class PrivateEstateBatchPermissions(ActionsBasedPermissions):
         'list': ['%(app_label)s.view_%(model_name)s'],
         'update': ['%(app_label)s.change_%(model_name)s'],
     })
+
+
+class CreditedSummaryPermissions(CreditPermissions):
+    """
+    Summaries of credited credits require the same permissions as credits themselves
+    """
+    def get_required_permissions(self, action, model_cls):
+        return super().get_required_permissions(action, Credit)
@@ -1,14 +1,11 @@
-from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from credit.models import Credit, Comment, ProcessingBatch, PrivateEstateBatch
 from payment.serializers import BillingAddressSerializer
-from prison.models import Prison, PrisonBankAccount
+from prison.models import PrisonBankAccount
 from prison.serializers import PrisonBankAccountSerializer
 
-User = get_user_model()
-
 
 class CreditedOnlyCreditSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=True)
@@ -143,10 +140,7 @@ class SecurityCreditSerializer(CreditSerializer):
 
     @classmethod
     def get_prison_name(cls, obj):
-        try:
-            return Prison.objects.get(pk=obj.prison_id).name
-        except Prison.DoesNotExist:
-            return None
+        return obj.prison.name if obj.prison else None
 
 
 class CreditCheckSerializer(CreditSerializer):
@@ -196,10 +190,9 @@ class CreditsGroupedByCreditedSerializer(serializers.Serializer):
     comment_count = serializers.IntegerField()
 
     def get_owner_name(self, instance):
-        try:
-            return User.objects.get(pk=instance['owner']).get_full_name()
-        except User.DoesNotExist:
+        if instance['owner'] is None:
             return _('Unknown')
+        return ('%s %s' % (instance['owner__first_name'], instance['owner__last_name'])).strip()
 
 
 class PrivateEstateBatchSerializer(serializers.ModelSerializer):
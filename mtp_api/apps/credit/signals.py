@@ -8,4 +8,4 @@ credit_reviewed = Signal(providing_args=['credit', 'by_user'])
 credit_set_manual = Signal(providing_args=['credit', 'by_user'])
 credit_failed = Signal(providing_args=['credit'])
 
-credit_prisons_need_updating = Signal()
+credit_prisons_need_updating = Signal(providing_args=['changed_prisoner_keys'])
@@ -0,0 +1,99 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from model_mommy import mommy
+
+from credit.constants import CREDIT_RESOLUTION
+from credit.models import Comment, Credit, CreditedSummary
+from credit.views import CreditedSummaryFilter
+from prison.models import Prison
+
+User = get_user_model()
+
+
+class CreditedSummaryTestCase(TestCase):
+    fixtures = ['test_prisons.json']
+
+    def setUp(self):
+        super().setUp()
+        self.prison = Prison.objects.first()
+        self.user = mommy.make(User)
+
+    def get_summary(self):
+        return list(CreditedSummary.objects.filter(credit_count__gt=0).values_list(
+            'prison', 'date', 'owner', 'credit_count', 'credit_total', 'credit_comment_count',
+        ))
+
+    def test_summary_follows_crediting(self):
+        credits = mommy.make(
+            Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=self.prison, amount=1000, _quantity=3,
+        )
+        mommy.make(Comment, credit=credits[0], comment='Seen')
+        self.assertListEqual(self.get_summary(), [])
+
+        today = timezone.now().date()
+        credits[0].credit_prisoner(self.user, 'nomis1')
+        self.assertListEqual(self.get_summary(), [(self.prison.pk, today, self.user.pk, 1, 1000, 1)])
+
+        Credit.objects.credit_bulk([(credits[1].pk, None), (credits[2].pk, 'nomis3')], self.user)
+        self.assertListEqual(self.get_summary(), [(self.prison.pk, today, self.user.pk, 3, 3000, 1)])
+
+        mommy.make(Comment, credit=credits[1], comment='Seen')
+        credits[0].comments.all().delete()
+        self.assertListEqual(self.get_summary(), [(self.prison.pk, today, self.user.pk, 3, 3000, 1)])
+
+        mommy.make(Comment, credit=credits[2], comment='Seen')
+        self.assertListEqual(self.get_summary(), [(self.prison.pk, today, self.user.pk, 3, 3000, 2)])
+
+    def test_comments_on_uncredited_credits_not_summarised(self):
+        credit = mommy.make(Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=self.prison, amount=1000)
+        mommy.make(Comment, credit=credit, comment='Seen')
+        self.assertListEqual(self.get_summary(), [])
+
+    def test_recalculate(self):
+        credits = mommy.make(
+            Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=self.prison, amount=1000, _quantity=3,
+        )
+        mommy.make(Comment, credit=credits[0], comment='Seen')
+        Credit.objects.credit_bulk([(credit.pk, None) for credit in credits], self.user)
+        summary = self.get_summary()
+
+        CreditedSummary.objects.update(credit_count=10, credit_total=0, credit_comment_count=0)
+        call_command('recalculate_credited_summaries', verbosity=0)
+        self.assertListEqual(self.get_summary(), summary)
+
+        # changes not otherwise reflected in summaries
+        other_user = mommy.make(User)
+        Credit.objects.filter(pk=credits[2].pk).update(owner=other_user)
+        credits[1].delete()
+        call_command('recalculate_credited_summaries', verbosity=0)
+        today = timezone.now().date()
+        self.assertListEqual(sorted(self.get_summary()), sorted([
+            (self.prison.pk, today, self.user.pk, 1, 1000, 1),
+            (self.prison.pk, today, other_user.pk, 1, 1000, 0),
+        ]))
+
+    def test_date_filters_compare_utc_dates_during_bst(self):
+        for day in (29, 30):
+            mommy.make(CreditedSummary, prison=self.prison, date=datetime.date(2020, 6, day), credit_count=1)
+
+        def filtered_dates(filters):
+            queryset = CreditedSummaryFilter(filters, queryset=CreditedSummary.objects.all()).qs
+            return sorted(queryset.values_list('date', flat=True))
+
+        # local midnight on 30th June is 23:00 UTC on 29th June so credits logged on 30th June UTC start after it
+        for bound in ('2020-06-30', '2020-06-30T00:00:00+01:00', '2020-06-29T23:00:00Z'):
+            self.assertListEqual(filtered_dates({'logged_at__gte': bound}), [datetime.date(2020, 6, 30)])
+            self.assertListEqual(filtered_dates({'logged_at__lt': bound}), [datetime.date(2020, 6, 29)])
+
+        # UTC midnight bounds are not rounded
+        self.assertListEqual(filtered_dates({'logged_at__gte': '2020-06-30T00:00:00Z'}), [datetime.date(2020, 6, 30)])
+        self.assertListEqual(filtered_dates({'logged_at__lt': '2020-06-30T00:00:00Z'}), [datetime.date(2020, 6, 29)])
+
+        # bounds during a UTC date exclude its summary from the later range
+        bound = '2020-06-29T12:00:00+01:00'
+        self.assertListEqual(filtered_dates({'logged_at__gte': bound}), [datetime.date(2020, 6, 30)])
+        self.assertListEqual(filtered_dates({'logged_at__lt': bound}), [datetime.date(2020, 6, 29)])
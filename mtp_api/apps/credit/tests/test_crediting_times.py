@@ -0,0 +1,53 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from model_mommy import mommy
+
+from credit.constants import CREDIT_RESOLUTION, LOG_ACTIONS
+from credit.models import Credit, CreditingTime, Log
+from prison.models import Prison
+
+User = get_user_model()
+
+
+class CreditingTimeTestCase(TestCase):
+    fixtures = ['test_prisons.json']
+
+    def setUp(self):
+        super().setUp()
+        self.user = mommy.make(User)
+        # a tuesday so that no weekend adjustment is needed
+        self.received_at = timezone.make_aware(datetime.datetime(2020, 10, 6, 12))
+        self.credits = mommy.make(
+            Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=Prison.objects.first(),
+            received_at=self.received_at, _quantity=2,
+        )
+
+    def set_credited_log_created(self, credit, created):
+        Log.objects.filter(credit=credit, action=LOG_ACTIONS.CREDITED).update(created=created)
+
+    def test_crediting_time_written_when_credited(self):
+        self.credits[0].credit_prisoner(self.user)
+        self.assertTrue(CreditingTime.objects.filter(credit=self.credits[0]).exists())
+        self.assertFalse(CreditingTime.objects.filter(credit=self.credits[1]).exists())
+
+        Credit.objects.credit_bulk([(self.credits[1].pk, None)], self.user)
+        self.assertTrue(CreditingTime.objects.filter(credit=self.credits[1]).exists())
+
+    def test_recalculate_since(self):
+        Credit.objects.credit_bulk([(credit.pk, None) for credit in self.credits], self.user)
+        self.set_credited_log_created(self.credits[0], self.received_at + datetime.timedelta(days=1))
+        self.set_credited_log_created(self.credits[1], self.received_at + datetime.timedelta(days=2))
+
+        call_command('recalculate_crediting_times', since='2020-10-08', verbosity=0)
+        crediting_times = dict(CreditingTime.objects.values_list('credit', 'crediting_time'))
+        self.assertNotEqual(crediting_times[self.credits[0].pk], datetime.timedelta(days=1))
+        self.assertEqual(crediting_times[self.credits[1].pk], datetime.timedelta(days=2))
+
+        call_command('recalculate_crediting_times', verbosity=0)
+        crediting_times = dict(CreditingTime.objects.values_list('credit', 'crediting_time'))
+        self.assertEqual(crediting_times[self.credits[0].pk], datetime.timedelta(days=1))
+        self.assertEqual(crediting_times[self.credits[1].pk], datetime.timedelta(days=2))
@@ -1,7 +1,9 @@
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
+from core.models import ScheduledCommand
 from core.tests.utils import make_test_users
 
 from prison.models import Prison, PrisonerLocation
@@ -125,6 +127,74 @@ class UpdatePrisonsOnAvailableCreditsTestMixin:
         self.assertEqual(self.credit.prison.pk, existing_prison.pk)
         self.assertEqual(self.credit.prisoner_name, prisoner_name)
 
+    def test_only_changed_prisoner_locations_update_prisons(self):
+        existing_prison = self.credit.prison
+        new_prison = Prison.objects.exclude(pk=existing_prison.pk).first()
+        other_credit = Credit.objects.create(**self._get_credit_data())
+        for credit in (self.credit, other_credit):
+            PrisonerLocation.objects.create(
+                created_by=User.objects.first(),
+                prisoner_name=random_prisoner_name(),
+                prisoner_number=credit.prisoner_number,
+                prisoner_dob=credit.prisoner_dob,
+                prison=new_prison,
+                active=True
+            )
+
+        credit_prisons_need_updating.send(
+            sender=None,
+            changed_prisoner_keys={(self.credit.prisoner_number, self.credit.prisoner_dob)},
+        )
+
+        self.credit.refresh_from_db()
+        self.assertEqual(self.credit.prison.pk, new_prison.pk)
+        other_credit.refresh_from_db()
+        self.assertEqual(other_credit.prison.pk, existing_prison.pk)
+
+    def test_activating_new_locations_updates_prisons_of_changed_prisoners(self):
+        existing_prison = self.credit.prison
+        new_prison = Prison.objects.exclude(pk=existing_prison.pk).first()
+        unmoved_credit = Credit.objects.create(**self._get_credit_data())
+        for credit, old_prison in ((self.credit, existing_prison), (unmoved_credit, new_prison)):
+            for active, prison in ((True, old_prison), (False, new_prison)):
+                PrisonerLocation.objects.create(
+                    created_by=User.objects.first(),
+                    prisoner_name='JAMES HALLS',
+                    prisoner_number=credit.prisoner_number,
+                    prisoner_dob=credit.prisoner_dob,
+                    prison=prison,
+                    active=active
+                )
+
+        changed_prisoner_keys = PrisonerLocation.objects.activate_new_locations()
+        self.assertSetEqual(changed_prisoner_keys, {(self.credit.prisoner_number, self.credit.prisoner_dob)})
+        credit_prisons_need_updating.send(sender=None, changed_prisoner_keys=changed_prisoner_keys)
+
+        self.credit.refresh_from_db()
+        self.assertEqual(self.credit.prison.pk, new_prison.pk)
+        self.assertEqual(self.credit.prisoner_name, 'JAMES HALLS')
+        # not matched to an active location since the unmoved prisoner's location did not change
+        unmoved_credit.refresh_from_db()
+        self.assertEqual(unmoved_credit.prison.pk, existing_prison.pk)
+
+    def test_scheduled_command_matches_all_pending_credits(self):
+        new_prison = Prison.objects.exclude(pk=self.credit.prison.pk).first()
+        PrisonerLocation.objects.create(
+            created_by=User.objects.first(),
+            prisoner_name='JAMES HALLS',
+            prisoner_number=self.credit.prisoner_number,
+            prisoner_dob=self.credit.prisoner_dob,
+            prison=new_prison,
+            active=True
+        )
+
+        call_command('update_credit_prisons')
+
+        self.credit.refresh_from_db()
+        self.assertEqual(self.credit.prison.pk, new_prison.pk)
+        self.assertEqual(self.credit.prisoner_name, 'JAMES HALLS')
+        self.assertTrue(ScheduledCommand.objects.filter(name='update_credit_prisons').exists())
+
 
 class UpdatePrisonsOnAvailableTransactionsTestCase(
     UpdatePrisonsOnAvailableCreditsTestMixin, BaseUpdatePrisonsForTransactionsTestCase
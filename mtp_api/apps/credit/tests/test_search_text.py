@@ -0,0 +1,76 @@
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from model_mommy import mommy
+
+from credit.constants import CREDIT_RESOLUTION
+from credit.models import Credit
+from payment.models import Payment
+from transaction.models import Transaction
+
+
+class CreditSearchTextTestCase(TestCase):
+    def get_search_text(self, credit):
+        return Credit.objects_all.values_list('search_text', flat=True).get(pk=credit.pk).split('\n')
+
+    def test_search_text_includes_credit_details(self):
+        credit = mommy.make(
+            Credit, resolution=CREDIT_RESOLUTION.PENDING,
+            prisoner_name='JAMES HALLS', prisoner_number='A1409AE',
+        )
+        self.assertListEqual(self.get_search_text(credit), ['JAMES HALLS', 'A1409AE'])
+
+        credit.prisoner_name = 'JILLY HALL'
+        credit.save()
+        self.assertListEqual(self.get_search_text(credit), ['JILLY HALL', 'A1409AE'])
+
+    def test_search_text_kept_current_with_payment(self):
+        credit = mommy.make(
+            Credit, resolution=CREDIT_RESOLUTION.PENDING,
+            prisoner_name='JAMES HALLS', prisoner_number='A1409AE',
+        )
+        payment = mommy.make(Payment, credit=credit, cardholder_name='Mary Halls', email='mary@outside.local')
+        self.assertListEqual(
+            self.get_search_text(credit),
+            ['JAMES HALLS', 'A1409AE', 'Mary Halls', 'mary@outside.local'],
+        )
+
+        payment.email = 'halls@outside.local'
+        payment.save()
+        self.assertListEqual(
+            self.get_search_text(credit),
+            ['JAMES HALLS', 'A1409AE', 'Mary Halls', 'halls@outside.local'],
+        )
+
+        payment.delete()
+        self.assertListEqual(self.get_search_text(credit), ['JAMES HALLS', 'A1409AE'])
+
+    def test_search_text_kept_current_with_transaction(self):
+        credit = mommy.make(
+            Credit, resolution=CREDIT_RESOLUTION.PENDING,
+            prisoner_name='JAMES HALLS', prisoner_number='A1409AE',
+        )
+        transaction = mommy.make(Transaction, credit=credit, sender_name='MARY HALLS')
+        self.assertListEqual(self.get_search_text(credit), ['JAMES HALLS', 'A1409AE', 'MARY HALLS'])
+
+        Transaction.objects.filter(pk=transaction.pk).update(sender_name='M HALLS')
+        self.assertListEqual(self.get_search_text(credit), ['JAMES HALLS', 'A1409AE', 'M HALLS'])
+
+    def test_backfill(self):
+        credit = mommy.make(
+            Credit, resolution=CREDIT_RESOLUTION.PENDING,
+            prisoner_name='JAMES HALLS', prisoner_number='A1409AE',
+        )
+        mommy.make(Payment, credit=credit, cardholder_name='Mary Halls', email='mary@outside.local')
+        # simulates credits whose search text was not maintained
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE credit_credit DISABLE TRIGGER credit_search_text')
+            cursor.execute('UPDATE credit_credit SET search_text = NULL')
+            cursor.execute('ALTER TABLE credit_credit ENABLE TRIGGER credit_search_text')
+        self.assertFalse(Credit.objects_all.filter(search_text__isnull=False).exists())
+
+        call_command('backfill_credit_search_text', batch_size=2, verbosity=0)
+        self.assertListEqual(
+            self.get_search_text(credit),
+            ['JAMES HALLS', 'A1409AE', 'Mary Halls', 'mary@outside.local'],
+        )
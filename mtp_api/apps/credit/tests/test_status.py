@@ -0,0 +1,86 @@
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from model_mommy import mommy
+
+from credit.constants import CREDIT_RESOLUTION, CREDIT_STATUS
+from credit.models import Credit
+from prison.models import Prison
+from transaction.models import Transaction
+
+
+class CreditStatusTestCase(TestCase):
+    fixtures = ['test_prisons.json']
+
+    def setUp(self):
+        super().setUp()
+        self.prison = Prison.objects.first()
+
+    def get_status(self, credit):
+        return Credit.objects_all.values_list('status', flat=True).get(pk=credit.pk)
+
+    def test_status_follows_credit_changes(self):
+        credit = mommy.make(Credit, resolution=CREDIT_RESOLUTION.INITIAL, prison=self.prison)
+        self.assertIsNone(self.get_status(credit))
+
+        credit.resolution = CREDIT_RESOLUTION.PENDING
+        credit.save()
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.CREDIT_PENDING)
+
+        Credit.objects.filter(pk=credit.pk).update(blocked=True)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.REFUND_PENDING)
+
+        Credit.objects.filter(pk=credit.pk).update(blocked=False, prison=None)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.REFUND_PENDING)
+
+        Credit.objects.filter(pk=credit.pk).update(resolution=CREDIT_RESOLUTION.MANUAL, prison=self.prison)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.CREDIT_PENDING)
+
+        Credit.objects.filter(pk=credit.pk).update(resolution=CREDIT_RESOLUTION.CREDITED)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.CREDITED)
+
+        Credit.objects.filter(pk=credit.pk).update(resolution=CREDIT_RESOLUTION.REFUNDED)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.REFUNDED)
+
+        Credit.objects_all.filter(pk=credit.pk).update(resolution=CREDIT_RESOLUTION.FAILED)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.FAILED)
+
+    def test_instance_status_loaded_from_database(self):
+        credit = mommy.make(Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=self.prison)
+        self.assertEqual(Credit.objects.get(pk=credit.pk).status, CREDIT_STATUS.CREDIT_PENDING)
+
+        credit.resolution = CREDIT_RESOLUTION.CREDITED
+        credit.save()
+        credit.refresh_from_db(fields=['status'])
+        self.assertEqual(credit.status, CREDIT_STATUS.CREDITED)
+
+    def test_status_follows_transaction_changes(self):
+        credit = mommy.make(Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=None)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.REFUND_PENDING)
+
+        transaction = mommy.make(Transaction, credit=credit, incomplete_sender_info=True)
+        self.assertIsNone(self.get_status(credit))
+        self.assertFalse(Credit.objects.refund_pending().filter(pk=credit.pk).exists())
+
+        Transaction.objects.filter(pk=transaction.pk).update(incomplete_sender_info=False)
+        self.assertEqual(self.get_status(credit), CREDIT_STATUS.REFUND_PENDING)
+        self.assertTrue(Credit.objects.refund_pending().filter(pk=credit.pk).exists())
+
+    def test_backfill(self):
+        credits = [
+            mommy.make(Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=self.prison),
+            mommy.make(Credit, resolution=CREDIT_RESOLUTION.CREDITED, prison=self.prison),
+            mommy.make(Credit, resolution=CREDIT_RESOLUTION.PENDING, prison=None),
+        ]
+        # simulates credits whose status was not maintained
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE credit_credit DISABLE TRIGGER credit_status')
+            cursor.execute('UPDATE credit_credit SET status = NULL')
+            cursor.execute('ALTER TABLE credit_credit ENABLE TRIGGER credit_status')
+        self.assertFalse(Credit.objects.filter(status__isnull=False).exists())
+
+        call_command('backfill_credit_status', batch_size=2, verbosity=0)
+        self.assertListEqual(
+            [self.get_status(credit) for credit in credits],
+            [CREDIT_STATUS.CREDIT_PENDING, CREDIT_STATUS.CREDITED, CREDIT_STATUS.REFUND_PENDING],
+        )
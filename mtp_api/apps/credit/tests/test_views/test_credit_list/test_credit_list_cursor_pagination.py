@@ -0,0 +1,74 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+
+from credit.models import Credit
+from credit.tests.test_views.test_credit_list import CreditListTestCase
+
+
+class CreditListCursorPaginationTestCase(CreditListTestCase):
+    def _get(self, url, params=None):
+        response = self.client.get(
+            url, params, format='json',
+            HTTP_AUTHORIZATION=self.get_http_authorization_for_user(self._get_authorised_user()),
+        )
+        return response
+
+    def _test_cursor_pagination(self, **params):
+        response = self._get(reverse('credit-list'), dict(params, limit=1000))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected_ids = [credit['id'] for credit in response.data['results']]
+        self.assertTrue(len(expected_ids) > 7)
+
+        ids = []
+        response = self._get(reverse('credit-list'), dict(params, limit=7, cursor=''))
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            self.assertLessEqual(len(response.data['results']), 7)
+            ids.extend(credit['id'] for credit in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self._get(response.data['next'])
+        self.assertListEqual(ids, expected_ids)
+
+    def test_default_ordering(self):
+        self._test_cursor_pagination()
+
+    def test_ordering_by_indexed_fields(self):
+        for ordering in ('received_at', 'amount', 'prisoner_number'):
+            self._test_cursor_pagination(ordering=ordering)
+            self._test_cursor_pagination(ordering=f'-{ordering}')
+
+    def test_ordering_by_field_with_nulls(self):
+        credits = self._get_managed_prison_credits()[::3]
+        Credit.objects.filter(pk__in=[credit.pk for credit in credits]).update(prisoner_number=None)
+        self._test_cursor_pagination(ordering='prisoner_number')
+        self._test_cursor_pagination(ordering='-prisoner_number')
+
+    def test_cursor_bounds_leading_ordering_field(self):
+        for ordering, bound in (('received_at', '>='), ('-received_at', '<=')):
+            response = self._get(reverse('credit-list'), {'limit': 7, 'cursor': '', 'ordering': ordering})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with CaptureQueriesContext(connection) as captured_queries:
+                response = self._get(response.data['next'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # the leading ordering field must be bounded for an index range to be used
+            self.assertTrue(any(
+                f'"credit_credit"."received_at" {bound} ' in query['sql']
+                for query in captured_queries
+            ))
+
+    def test_approximate_count(self):
+        response = self._get(reverse('credit-list'), {'cursor': '', 'count': 'approximate'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(response.data['count'], int)
+
+    def test_unsupported_ordering(self):
+        response = self._get(reverse('credit-list'), {'cursor': '', 'ordering': 'prisoner_name'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_cursor(self):
+        response = self._get(reverse('credit-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
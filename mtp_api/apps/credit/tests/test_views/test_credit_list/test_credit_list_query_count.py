@@ -0,0 +1,39 @@
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+
+from credit.models import Credit
+from credit.tests.test_views.test_credit_list import CreditListTestCase
+
+
+class CreditListQueryCountTestCase(CreditListTestCase):
+    def _get_page(self, user, limit, expected_query_count):
+        authorisation = self.get_http_authorization_for_user(user)
+        with self.assertNumQueries(expected_query_count):
+            response = self.client.get(
+                reverse('credit-list'), {'limit': limit, 'ordering': 'pk'},
+                format='json', HTTP_AUTHORIZATION=authorisation,
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), limit)
+        return response.data['results']
+
+    def _test_query_count_does_not_depend_on_page_size(self, user, expected_query_count):
+        self._get_page(user, 1, expected_query_count)
+        results = self._get_page(user, 10, expected_query_count)
+
+        for response_credit in results:
+            credit = Credit.objects.get(pk=response_credit['id'])
+            for attribute in ('credited_at', 'refunded_at', 'set_manual_at'):
+                self.assertEqual(
+                    response_credit[attribute] and parse_datetime(response_credit[attribute]),
+                    getattr(credit, attribute),
+                )
+
+    def test_cashbook_query_count(self):
+        # access token, user & group permissions, count, page and comments
+        self._test_query_count_does_not_depend_on_page_size(self.prison_clerks[0], 6)
+
+    def test_security_query_count(self):
+        # access token, user & group permissions, count, page and comments
+        self._test_query_count_does_not_depend_on_page_size(self.security_staff[0], 6)
@@ -1,5 +1,7 @@
 import datetime
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.dateparse import parse_date
 from rest_framework import status
@@ -65,6 +67,43 @@ class CreditCreditsTestCase(
             len(to_credit)
         )
 
+    def test_credit_credits_with_conflicts(self):
+        logged_in_user = self.prison_clerks[0]
+        managing_prisons = list(PrisonUserMapping.objects.get_prison_set_for_user(logged_in_user))
+
+        available_qs = self._get_credit_pending_credits_qs(managing_prisons, logged_in_user)
+        to_credit = list(available_qs.values_list('id', flat=True))
+        self.assertTrue(len(to_credit) > 1)
+        already_credited = to_credit[0]
+        Credit.objects.get(pk=already_credited).credit_prisoner(logged_in_user, 'nomis-original')
+        missing_id = Credit.objects_all.order_by('-pk').first().pk + 1
+
+        data = [
+            {'id': c_id, 'credited': True, 'nomis_transaction_id': 'nomis%s' % c_id}
+            for c_id in to_credit + [missing_id]
+        ]
+        with CaptureQueriesContext(connection) as captured_queries:
+            response = self.client.post(
+                self._get_url(), data=data,
+                format='json',
+                HTTP_AUTHORIZATION=self.get_http_authorization_for_user(logged_in_user)
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['errors'][0]['ids'], [already_credited, missing_id])
+        # crediting should not need queries for each credit
+        self.assertLess(len(captured_queries), len(to_credit))
+
+        self.assertEqual(Credit.objects.get(pk=already_credited).nomis_transaction_id, 'nomis-original')
+        self.assertEqual(
+            Log.objects.filter(action=LOG_ACTIONS.CREDITED, credit=already_credited).count(),
+            1
+        )
+        for credit in Credit.objects.filter(pk__in=to_credit[1:]):
+            self.assertEqual(credit.resolution, CREDIT_RESOLUTION.CREDITED)
+            self.assertEqual(credit.owner, logged_in_user)
+            self.assertEqual(credit.nomis_transaction_id, 'nomis%s' % credit.id)
+            self.assertTrue(credit.log_set.filter(action=LOG_ACTIONS.CREDITED, user=logged_in_user).exists())
+
     def test_missing_ids(self):
         logged_in_user = self.prison_clerks[0]
 
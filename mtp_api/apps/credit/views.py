@@ -25,12 +25,14 @@ from core.filters import (
     SafeOrderingFilter,
     SplitTextInMultipleFieldsFilter,
     StatusChoiceFilter,
+    UtcDateFromIsoDateTimeFilter,
 )
 from core.models import TruncUtcDate
+from core.pagination import LimitOffsetOrCursorPagination
 from core.permissions import ActionsBasedPermissions
-from credit.constants import CREDIT_RESOLUTION, CREDIT_STATUS, CREDIT_SOURCE, LOG_ACTIONS
-from credit.models import Credit, Comment, ProcessingBatch, PrivateEstateBatch
-from credit.permissions import CreditPermissions, PrivateEstateBatchPermissions
+from credit.constants import CREDIT_RESOLUTION, CREDIT_STATUS, CREDIT_SOURCE
+from credit.models import Credit, CreditedSummary, Comment, ProcessingBatch, PrivateEstateBatch
+from credit.permissions import CreditPermissions, CreditedSummaryPermissions, PrivateEstateBatchPermissions
 from credit.serializers import (
     CommentSerializer,
     CreditedOnlyCreditSerializer,
@@ -64,7 +66,9 @@ class CreditTextSearchFilter(django_filters.CharFilter):
     - prisoner_number
     - sender_name
     - amount (input is expected as £nn.nn but is reformatted for search)
+    Text fields are first matched using the indexed `Credit.search_text`
     """
+    text_fields = {'prisoner_name', 'prisoner_number', 'sender_name'}
     fields = [
         'prisoner_name', 'prisoner_number', 'sender_name', 'amount',
         'payment__uuid'
@@ -105,10 +109,13 @@ class CreditTextSearchFilter(django_filters.CharFilter):
 
                 return models.Q(**{'%s__icontains' % field: word})
 
+            text_filters = [get_field_filter(field) for field in self.fields if field in self.text_fields]
+            other_filters = [get_field_filter(field) for field in self.fields if field not in self.text_fields]
             qs = qs.filter(
                 reduce(
                     lambda a, b: a | b,
-                    filter(bool, map(get_field_filter, self.fields))
+                    filter(bool, other_filters),
+                    models.Q(search_text__icontains=word) & reduce(lambda a, b: a | b, text_filters),
                 )
             )
         return qs
@@ -171,6 +178,7 @@ class CreditListFilter(BaseFilterSet):
             'payment__email',
             'prisoner_number',
         ),
+        indexed_field_name='search_text',
         lookup_expr='icontains',
     )
     search = CreditTextSearchFilter()
@@ -271,6 +279,8 @@ class GetCredits(CreditViewMixin, mixins.ListModelMixin, viewsets.GenericViewSet
     filter_class = CreditListFilter
     ordering_fields = ('created', 'received_at', 'amount',
                        'prisoner_number', 'prisoner_name')
+    pagination_class = LimitOffsetOrCursorPagination
+    cursor_ordering_fields = ('received_at', 'amount', 'prisoner_number')
     action = 'list'
 
     permission_classes = (
@@ -281,9 +291,17 @@ class GetCredits(CreditViewMixin, mixins.ListModelMixin, viewsets.GenericViewSet
     )
 
     def get_queryset(self, include_checks=False, only_completed=False):
-        q = super().get_queryset().select_related('transaction').select_related('payment__batch')
-        if include_checks:
-            q = q.select_related('security_check')
+        q = super().get_queryset() \
+            .select_related('transaction', 'payment__batch', 'payment__billing_address', 'owner', 'prison') \
+            .prefetch_related(models.Prefetch('comments', queryset=Comment.objects.select_related('user'))) \
+            .annotate_action_dates()
+        if include_checks or self.request.user.has_perm('security.view_check'):
+            # c.f. `get_serializer_class`
+            q = q.select_related(
+                'security_check__actioned_by',
+                'security_check__assigned_to',
+                'security_check__auto_accept_rule_state__added_by',
+            )
         if only_completed:
             if self.root_queryset != Credit.objects_all:
                 logger.warning('only_completed is only meaningful when using Credit.objects_all')
@@ -306,30 +324,39 @@ class GetCredits(CreditViewMixin, mixins.ListModelMixin, viewsets.GenericViewSet
             return CreditSerializer
 
 
-class CreditsGroupedByCreditedList(CreditViewMixin, generics.ListAPIView):
+class CreditedSummaryFilter(BaseFilterSet):
+    logged_at__lt = UtcDateFromIsoDateTimeFilter(field_name='date', lookup_expr='lt')
+    logged_at__gte = UtcDateFromIsoDateTimeFilter(field_name='date', lookup_expr='gte')
+    user = django_filters.ModelChoiceFilter(field_name='owner', queryset=User.objects.all())
+    prison = django_filters.ModelMultipleChoiceFilter(queryset=Prison.objects.all())
+
+    class Meta:
+        model = CreditedSummary
+        fields = ()
+
+
+class CreditsGroupedByCreditedList(generics.ListAPIView):
     serializer_class = CreditsGroupedByCreditedSerializer
     permission_classes = (
         IsAuthenticated, CashbookClientIDPermissions,
-        CreditPermissions
+        CreditedSummaryPermissions
     )
     filter_backends = (DjangoFilterBackend,)
-    filter_class = CreditListFilter
+    filter_class = CreditedSummaryFilter
     action = 'list'
 
     def get_queryset(self):
-        return super().get_queryset().filter(
-            Credit.STATUS_LOOKUP[CREDIT_STATUS.CREDITED],
-            log__action=LOG_ACTIONS.CREDITED
+        return CreditedSummary.objects.filter(
+            prison__in=PrisonUserMapping.objects.get_prison_set_for_user(self.request.user)
         )
 
     def filter_queryset(self, queryset):
         queryset = super().filter_queryset(queryset)
 
-        queryset = queryset.annotate(logged_at=TruncUtcDate('log__created'))
-        queryset = queryset.values('logged_at', 'owner').annotate(
-            count=models.Count('*'), total=models.Sum('amount'),
-            comment_count=models.Count('comments')
-        ).order_by('-logged_at')
+        queryset = queryset.values('date', 'owner', 'owner__first_name', 'owner__last_name').annotate(
+            logged_at=models.F('date'), count=models.Sum('credit_count'), total=models.Sum('credit_total'),
+            comment_count=models.Sum('credit_comment_count'),
+        ).filter(count__gt=0).order_by('-logged_at', 'owner')
 
         return queryset
 
@@ -356,19 +383,14 @@ class CreditCredits(CreditViewMixin, APIView):
         deserialized = self.get_serializer(data=request.data, many=True)
         deserialized.is_valid(raise_exception=True)
 
-        conflict_ids = []
-        with transaction.atomic():
-            for credit_update in deserialized.data:
-                if credit_update['credited']:
-                    credits = Credit.objects.credit_pending().filter(
-                        pk=credit_update['id']
-                    ).select_for_update()
-                    if len(credits):
-                        credits.first().credit_prisoner(
-                            request.user, credit_update.get('nomis_transaction_id')
-                        )
-                    else:
-                        conflict_ids.append(credit_update['id'])
+        conflict_ids = Credit.objects.credit_bulk(
+            (
+                (credit_update['id'], credit_update.get('nomis_transaction_id'))
+                for credit_update in deserialized.data
+                if credit_update['credited']
+            ),
+            request.user,
+        )
 
         if conflict_ids:
             return Response(
@@ -530,9 +552,8 @@ class PrivateEstateBatchView(
             return Response(status=drf_status.HTTP_405_METHOD_NOT_ALLOWED)
         batch = self.get_object()
         if (request.data or {}).get('credited'):
-            with transaction.atomic():
-                for credit in batch.credit_set.credit_pending():
-                    credit.credit_prisoner(self.request.user, nomis_transaction_id=None)
+            credit_ids = batch.credit_set.credit_pending().values_list('pk', flat=True)
+            Credit.objects.credit_bulk(((credit_id, None) for credit_id in credit_ids), self.request.user)
             return Response(status=drf_status.HTTP_204_NO_CONTENT)
         return Response(status=drf_status.HTTP_400_BAD_REQUEST)
 
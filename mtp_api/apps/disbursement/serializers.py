@@ -34,8 +34,7 @@ class PrisonPermittedValidator():
 
     def __call__(self, value):
         if (
-            value not in
-            PrisonUserMapping.objects.get_prison_set_for_user(self.user)
+            not PrisonUserMapping.objects.get_prison_set_for_user(self.user).filter(pk=value.pk).exists()
         ):
             raise serializers.ValidationError(
                 _('Cannot create a disbursement for this prison')
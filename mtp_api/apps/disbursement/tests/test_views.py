@@ -303,6 +303,26 @@ class ListDisbursementsTestCase(AuthTestCaseMixin, APITestCase):
             sorted(Disbursement.objects.values_list('amount', flat=True), reverse=True)
         )
 
+    def test_cursor_pagination(self):
+        fake_disbursement(_quantity=20, prison=self.prison)
+        expected_ids = list(Disbursement.objects.order_by('-amount', 'id').values_list('id', flat=True))
+
+        ids = []
+        response = self.api_request(ordering='-amount', limit=6, cursor='')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(
+                response.data['next'], format='json',
+                HTTP_AUTHORIZATION=self.get_http_authorization_for_user(self.user)
+            )
+        self.assertListEqual(ids, expected_ids)
+
+        response = self.api_request(ordering='method', cursor='')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_filter_companies(self):
         fake_disbursement(_quantity=10, prison=self.prison, recipient_is_company=False)
         disbursement = Disbursement.objects.last()
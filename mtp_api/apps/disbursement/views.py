@@ -16,6 +16,7 @@ from core.filters import (
     SplitTextInMultipleFieldsFilter,
 )
 from core.models import TruncUtcDate
+from core.pagination import LimitOffsetOrCursorPagination
 from core.permissions import ActionsBasedViewPermissions
 from disbursement import InvalidDisbursementStateException
 from disbursement.constants import DISBURSEMENT_RESOLUTION
@@ -128,6 +129,8 @@ class GetDisbursementsView(
     filter_backends = (LogNomsOpsSearchDjangoFilterBackend, SafeOrderingFilter)
     ordering_fields = ('created', 'amount', 'resolution', 'method', 'recipient_name',
                        'prisoner_number', 'prisoner_name')
+    pagination_class = LimitOffsetOrCursorPagination
+    cursor_ordering_fields = ('created', 'amount', 'prisoner_number')
     permission_classes = (
         IsAuthenticated, ActionsBasedViewPermissions, get_client_permissions_class(
             CASHBOOK_OAUTH_CLIENT_ID, NOMS_OPS_OAUTH_CLIENT_ID,
@@ -8,8 +8,8 @@ from django.db.models.functions import Concat
 from django.utils.text import capfirst
 from django.utils.timezone import now
 from django.utils.translation import gettext
-from mtp_common.tasks import send_email
 
+from core.mail import EmailBatch
 from mtp_auth.models import AccountRequest, Role
 from prison.models import Prison
 
@@ -33,19 +33,20 @@ class Command(BaseCommand):
         ).order_by().values('role', 'prison').annotate(
             names=ArrayAgg(Concat('first_name', models.Value(' '), 'last_name'))
         )
-        for group in grouped_requests:
-            if group['prison']:
-                prison = Prison.objects.get(pk=group['prison'])
-            else:
-                prison = None
+        with EmailBatch() as self.emails:
+            for group in grouped_requests:
+                if group['prison']:
+                    prison = Prison.objects.get(pk=group['prison'])
+                else:
+                    prison = None
 
-            role = Role.objects.get(pk=group['role'])
-            names = group['names']
-            admins = self.find_admins(role, prison)
-            if admins:
-                self.email_admins(admins, role, names)
-            else:
-                logger.error('No active user admins for %s in %s' % (role.name, prison.name))
+                role = Role.objects.get(pk=group['role'])
+                names = group['names']
+                admins = self.find_admins(role, prison)
+                if admins:
+                    self.email_admins(admins, role, names)
+                else:
+                    logger.error('No active user admins for %s in %s' % (role.name, prison.name))
 
     def find_admins(self, role, prison):
         admins = role.key_group.user_set.filter(
@@ -60,7 +61,7 @@ class Command(BaseCommand):
 
     def email_admins(self, admins, role, names):
         service_name = role.application.name.lower()
-        send_email(
+        self.emails.add(
             [admin.email for admin in admins],
             'mtp_auth/new_account_requests.txt',
             capfirst(gettext('You have new %(service_name)s users to approve') % {
@@ -29,10 +29,9 @@ class PrisonUserMappingManager(models.Manager):
             mapping.delete()
 
     def get_prison_set_for_user(self, user):
-        try:
-            return self.get_queryset().get(user=user).prisons.all()
-        except PrisonUserMapping.DoesNotExist:
-            return Prison.objects.none()
+        # filters through the mapping rather than loading it so that scoping a queryset adds a subquery
+        # instead of an extra query
+        return Prison.objects.filter(prisonusermapping__user=user)
 
 
 class PrisonUserMapping(TimeStampedModel):
@@ -1,11 +1,12 @@
+import collections
 from urllib.parse import urlencode
 
 from django.conf import settings
 from django.core.management import BaseCommand
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from mtp_common.tasks import send_email
 
+from core.mail import EmailBatch
 from notification.constants import EMAIL_FREQUENCY
 from notification.models import Event, EmailNotificationPreferences
 from notification.rules import ENABLED_RULE_CODES
@@ -41,38 +42,54 @@ class Command(BaseCommand):
 
         today = timezone.now().date()
         preferences = EmailNotificationPreferences.objects.filter(frequency=frequency).exclude(last_sent_at=today)
-        for preference in preferences:
-            user = preference.user
-            event_group = summarise_group(group_events(events, user))
-
-            has_notifications = event_group['transaction_count']
-            is_monitoring = any((
-                model.objects.filter(monitoring_users=user).exists()
-                for model in (PrisonerProfile, DebitCardSenderDetails, BankAccount)
-            ))
-            emails_started = user.flags.filter(name=EMAILS_STARTED_FLAG).exists()
-
-            email_context = dict(
-                base_email_context,
-                user=user,
-                event_group=event_group,
-            )
-            email_sent = False
-            if emails_started and has_notifications:
-                send_email_with_events(email_context)
-                email_sent = True
-            elif not emails_started:
-                if has_notifications:
-                    send_first_email_with_events(email_context)
-                    user.flags.create(name=EMAILS_STARTED_FLAG)
-                    email_sent = True
-                elif not is_monitoring:
-                    send_first_email_not_monitoring(email_context)
-                    user.flags.create(name=EMAILS_STARTED_FLAG)
-                    email_sent = True
-            if email_sent:
-                preference.last_sent_at = today
-                preference.save()
+        preferences = list(preferences.select_related('user'))
+        user_ids = [preference.user_id for preference in preferences]
+        events_by_user = get_events_by_user(events.filter(user__in=user_ids))
+        monitoring_user_ids = get_monitoring_user_ids(user_ids)
+        emails_started_user_ids = set(
+            EmailNotificationPreferences.objects.filter(
+                user__in=user_ids, user__flags__name=EMAILS_STARTED_FLAG,
+            ).values_list('user_id', flat=True)
+        )
+        with EmailBatch() as emails:
+            for preference in preferences:
+                user = preference.user
+                event_group = summarise_group(group_events(events_by_user.get(user.pk, [])))
+
+                has_notifications = event_group['transaction_count']
+                is_monitoring = user.pk in monitoring_user_ids
+                emails_started = user.pk in emails_started_user_ids
+
+                email_context = dict(
+                    base_email_context,
+                    user=user,
+                    event_group=event_group,
+                )
+                if emails_started and has_notifications:
+                    send_email_with_events(emails, email_context, make_sent_callback(preference, today))
+                elif not emails_started:
+                    if has_notifications:
+                        send_first_email_with_events(
+                            emails, email_context, make_sent_callback(preference, today, emails_started=True),
+                        )
+                    elif not is_monitoring:
+                        send_first_email_not_monitoring(
+                            emails, email_context, make_sent_callback(preference, today, emails_started=True),
+                        )
+
+
+def make_sent_callback(preference, today, emails_started=False):
+    """
+    Returns a function that records a user's email as sent, called only once it has been
+    so that a failed batch is retried on the next run
+    """
+    def on_sent():
+        if emails_started:
+            preference.user.flags.create(name=EMAILS_STARTED_FLAG)
+        preference.last_sent_at = today
+        preference.save()
+
+    return on_sent
 
 
 def get_events(period_start, period_end):
@@ -82,10 +99,40 @@ def get_events(period_start, period_end):
     )
 
 
-def group_events(events, user):
+def get_events_by_user(events):
+    """
+    Loads events along with their related records and profiles (including sender names) in a fixed number of queries
+    :return: dict of user id to list of events
+    """
+    events = events.select_related(
+        'credit_event', 'disbursement_event',
+        'sender_profile_event__sender_profile', 'prisoner_profile_event__prisoner_profile',
+    ).prefetch_related(
+        'sender_profile_event__sender_profile__bank_transfer_details',
+        'sender_profile_event__sender_profile__debit_card_details__cardholder_names',
+    )
+    events_by_user = collections.defaultdict(list)
+    for event in events:
+        events_by_user[event.user_id].append(event)
+    return events_by_user
+
+
+def get_monitoring_user_ids(user_ids):
+    """
+    Finds which of the users are monitoring any prisoner, debit card or bank account
+    """
+    monitoring_user_ids = set()
+    for model in (PrisonerProfile, DebitCardSenderDetails, BankAccount):
+        monitoring_user_ids.update(
+            model.monitoring_users.through.objects.filter(user__in=user_ids).values_list('user_id', flat=True)
+        )
+    return monitoring_user_ids
+
+
+def group_events(events):
     senders = {}
     prisoners = {}
-    for event in events.filter(user=user):
+    for event in events:
         if hasattr(event, 'sender_profile_event'):
             profile = event.sender_profile_event.sender_profile
             if profile.id in senders:
@@ -171,31 +218,34 @@ def summarise_group(event_group):
     }
 
 
-def send_email_with_events(email_context):
-    send_email(
+def send_email_with_events(emails, email_context, on_sent=None):
+    emails.add(
         email_context['user'].email, 'notification/notifications.txt',
         _('Your new intelligence tool notifications'),
         context=email_context,
         html_template='notification/notifications.html',
         anymail_tags=['intel-notification', 'intel-notification-daily'],
+        on_sent=on_sent,
     )
 
 
-def send_first_email_with_events(email_context):
-    send_email(
+def send_first_email_with_events(emails, email_context, on_sent=None):
+    emails.add(
         email_context['user'].email, 'notification/notifications-first.txt',
         _('New notification feature added to intelligence tool'),
         context=email_context,
         html_template='notification/notifications-first.html',
         anymail_tags=['intel-notification', 'intel-notification-first'],
+        on_sent=on_sent,
     )
 
 
-def send_first_email_not_monitoring(email_context):
-    send_email(
+def send_first_email_not_monitoring(emails, email_context, on_sent=None):
+    emails.add(
         email_context['user'].email, 'notification/not-monitoring.txt',
         _('New helpful ways to get the best from the intelligence tool'),
         context=email_context,
         html_template='notification/not-monitoring.html',
         anymail_tags=['intel-notification', 'intel-notification-not-monitoring'],
+        on_sent=on_sent,
     )
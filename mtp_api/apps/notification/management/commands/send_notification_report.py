@@ -1,12 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import pathlib
+import queue
 import tempfile
+import threading
 
 from anymail.message import AnymailMessage
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.management import BaseCommand, CommandError
 from django.core.validators import validate_email
+from django.db import connection, connections
 from django.utils import timezone
 from django.utils.dateparse import parse_date
 from mtp_common.tasks import default_from_address
@@ -21,6 +25,9 @@ from disbursement.models import Disbursement, LOG_ACTIONS as DISBURSEMENT_LOG_AC
 from notification.rules import RULES, CountingRule, MonitoredRule, Triggered
 from transaction.utils import format_amount
 
+# maximum number of rows each worker holds before they are written to the workbook
+SHEET_ROW_QUEUE_SIZE = 1000
+
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
@@ -28,6 +35,7 @@ class Command(BaseCommand):
         parser.add_argument('--since', help='Since date (inclusive)')
         parser.add_argument('--until', help='Until date (exclusive)')
         parser.add_argument('--rules', nargs='*', choices=RULES.keys(), help='Notification rule codes')
+        parser.add_argument('--workers', type=int, default=4, help='Number of sheets to generate concurrently')
         parser.add_argument('emails', nargs='+', help='Email addresses to send reports to')
 
     def handle(self, **options):
@@ -38,6 +46,9 @@ class Command(BaseCommand):
             except ValidationError:
                 raise CommandError(f'"{email}" is not valid email address')
 
+        if options['workers'] < 1:
+            raise CommandError('`--workers` must be at least 1')
+
         codes = options['rules'] or RULES.keys()
         rules = [RULES[code] for code in codes]
 
@@ -54,7 +65,7 @@ class Command(BaseCommand):
             temp_path = pathlib.Path(temp_path)
             report_path = temp_path / f'{period_filename}.xlsx'
             workbook = openpyxl.Workbook(write_only=True)
-            generate_report(workbook, period_start, period_end, rules)
+            generate_report(workbook, period_start, period_end, rules, workers=options['workers'])
             workbook.save(report_path)
             send_report(period_description, report_path, emails)
 
@@ -97,7 +108,7 @@ def report_period(period_start, period_end):
     return period_start, period_end
 
 
-def generate_report(workbook, period_start, period_end, rules):
+def generate_report(workbook, period_start, period_end, rules, workers=1):
     candidate_credits = Credit.objects.filter(
         prisoner_profile__isnull=False,
         sender_profile__isnull=False,
@@ -118,30 +129,90 @@ def generate_report(workbook, period_start, period_end, rules):
         Disbursement: candidate_disbursements,
     }
 
+    sheets = []
     for rule in rules:
         for serialised_model, serialiser_cls in Serialiser.serialisers.items():
             if serialised_model not in rule.applies_to_models:
                 continue
-            serialiser = serialiser_cls(rule)
-            worksheet = workbook.create_sheet(
-                title=f'{serialised_model._meta.verbose_name[:4]}-{rule.abbr_description}'
-            )
-            generate_sheet(worksheet, serialiser, rule, records[serialised_model])
+            title = f'{serialised_model._meta.verbose_name[:4]}-{rule.abbr_description}'
+            sheets.append((title, serialiser_cls(rule), records[serialised_model]))
+
+    if workers > 1 and not connection.in_atomic_block:
+        # sheets are independent read-only scans so are generated concurrently, each worker with its own connection;
+        # workers could not see data in an uncommitted transaction so sheets are otherwise generated one at a time
+        row_queues = [queue.Queue(maxsize=SHEET_ROW_QUEUE_SIZE) for _ in sheets]
+        cancelled = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for (_, serialiser, record_set), row_queue in zip(sheets, row_queues):
+                executor.submit(generate_sheet_rows_in_worker, serialiser, record_set, row_queue, cancelled)
+            try:
+                write_sheets(workbook, sheets, map(iterate_row_queue, row_queues))
+            finally:
+                # stops workers that are still generating if writing failed
+                cancelled.set()
+    else:
+        write_sheets(workbook, sheets, (generate_sheet_rows(*sheet[1:]) for sheet in sheets))
+
+
+class EndOfRows:
+    def __init__(self, error=None):
+        self.error = error
 
 
-def generate_sheet(worksheet, serialiser, rule, record_set):
+def write_sheets(workbook, sheets, sheet_rows):
+    for (title, serialiser, _), rows in zip(sheets, sheet_rows):
+        worksheet = workbook.create_sheet(title=title)
+        write_sheet(worksheet, serialiser, rows)
+
+
+def generate_sheet_rows(serialiser, record_set):
+    for record, triggered in serialiser.rule.triggered_records(record_set):
+        yield serialiser.serialise(record, triggered)
+
+
+def generate_sheet_rows_in_worker(serialiser, record_set, row_queue, cancelled):
+    """
+    Streams rows into a bounded queue for the main thread to write, followed by `EndOfRows`;
+    sheets are written in order and workers start in order so the sheet being written always has a running worker
+    """
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                row_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for row in generate_sheet_rows(serialiser, record_set):
+            if not put(row):
+                return
+    except Exception as e:
+        put(EndOfRows(error=e))
+    else:
+        put(EndOfRows())
+    finally:
+        connections.close_all()
+
+
+def iterate_row_queue(row_queue):
+    while True:
+        row = row_queue.get()
+        if isinstance(row, EndOfRows):
+            if row.error:
+                raise row.error
+            return
+        yield row
+
+
+def write_sheet(worksheet, serialiser, rows):
     headers = serialiser.get_headers()
     worksheet.append(headers)
     count = 0
-    for record in record_set:
-        if not rule.applies_to(record):
-            continue
-        triggered = rule.triggered(record)
-        if not triggered:
-            continue
-        row = serialiser.serialise(worksheet, record, triggered)
+    for row in rows:
         worksheet.append([
-            row.get(field, None)
+            make_cell(worksheet, row.get(field, None))
             for field in headers
         ])
         count += 1
@@ -182,6 +253,26 @@ If you have any queries, contact the team at {settings.TEAM_EMAIL}.
     email.send()
 
 
+class Link:
+    """
+    Sheet value that is written as a hyperlink; rows are serialised without reference to a worksheet
+    so that they can be generated in a worker
+    """
+
+    def __init__(self, value, url):
+        self.value = value
+        self.url = url
+
+
+def make_cell(worksheet, value):
+    if isinstance(value, Link):
+        linked_cell = WriteOnlyCell(worksheet, value.value)
+        linked_cell.hyperlink = value.url
+        linked_cell.style = 'Hyperlink'
+        return linked_cell
+    return value
+
+
 class Serialiser:
     serialisers = {}
     additional_headers = {
@@ -209,13 +300,10 @@ class Serialiser:
             headers.insert(1, additional_header['header'])
         return headers
 
-    def serialise(self, worksheet, record, triggered: Triggered):
-        linked_cell = WriteOnlyCell(worksheet, self.get_internal_id(record))
-        linked_cell.hyperlink = self.get_noms_ops_url(record)
-        linked_cell.style = 'Hyperlink'
+    def serialise(self, record, triggered: Triggered):
         row = {
             'Notification rule': self.rule_description,
-            'Internal ID': linked_cell,
+            'Internal ID': Link(self.get_internal_id(record), self.get_noms_ops_url(record)),
         }
         additional_header = self.additional_headers.get(type(self.rule), None)
         if additional_header:
@@ -244,8 +332,8 @@ class CreditSerialiser(Serialiser, serialised_model=Credit):
             'WorldPay order code',
         ]
 
-    def serialise(self, worksheet, record: Credit, triggered: Triggered):
-        row = super().serialise(worksheet, record, triggered)
+    def serialise(self, record: Credit, triggered: Triggered):
+        row = super().serialise(record, triggered)
         status = record.status
         if status:
             status = str(CREDIT_STATUS.for_value(status).display)
@@ -316,8 +404,8 @@ class DisbursementSerialiser(Serialiser, serialised_model=Disbursement):
             'NOMIS transaction', 'SOP invoice number',
         ]
 
-    def serialise(self, worksheet, record: Disbursement, triggered: Triggered):
-        row = super().serialise(worksheet, record, triggered)
+    def serialise(self, record: Disbursement, triggered: Triggered):
+        row = super().serialise(record, triggered)
         row.update({
             'Date entered': local_datetime_for_xlsx(record.created),
             'Date confirmed': local_datetime_for_xlsx(
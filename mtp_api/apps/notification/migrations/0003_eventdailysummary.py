@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# users are unique including null (events visible to all users), so upserts conflict on an expression index;
+# rows are removed once they no longer count any events so that dates can be listed without filtering;
+# dates are local to the time zone set on each connection, c.f. `core.models.set_database_time_zone`
+CREATE_TRIGGERS = '''
+CREATE UNIQUE INDEX notification_eventdailysummary_unique
+ON notification_eventdailysummary (COALESCE(user_id, 0), date, rule);
+
+CREATE OR REPLACE FUNCTION notification_change_event_daily_summary(
+    _user_id integer, _triggered_at timestamp with time zone, _rule varchar, _count integer
+) RETURNS void AS $$
+DECLARE
+    _date date;
+BEGIN
+    IF _triggered_at IS NULL THEN
+        RETURN;
+    END IF;
+    _date := (_triggered_at AT TIME ZONE current_setting('mtp.time_zone'))::date;
+    UPDATE notification_eventdailysummary
+    SET event_count = event_count + _count
+    WHERE COALESCE(user_id, 0) = COALESCE(_user_id, 0) AND date = _date AND rule = _rule;
+    IF NOT FOUND AND _count > 0 THEN
+        INSERT INTO notification_eventdailysummary (user_id, date, rule, event_count)
+        VALUES (_user_id, _date, _rule, _count)
+        ON CONFLICT (COALESCE(user_id, 0), date, rule) DO UPDATE
+        SET event_count = notification_eventdailysummary.event_count + EXCLUDED.event_count;
+    ELSIF _count < 0 THEN
+        DELETE FROM notification_eventdailysummary
+        WHERE COALESCE(user_id, 0) = COALESCE(_user_id, 0) AND date = _date AND rule = _rule
+        AND event_count <= 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notification_event_daily_summary_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM notification_change_event_daily_summary(OLD.user_id, OLD.triggered_at, OLD.rule, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM notification_change_event_daily_summary(NEW.user_id, NEW.triggered_at, NEW.rule, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notification_event_daily_summary
+AFTER INSERT OR DELETE OR UPDATE OF user_id, triggered_at, rule ON notification_event
+FOR EACH ROW EXECUTE PROCEDURE notification_event_daily_summary_trigger();
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER IF EXISTS notification_event_daily_summary ON notification_event;
+DROP FUNCTION IF EXISTS notification_event_daily_summary_trigger();
+DROP FUNCTION IF EXISTS notification_change_event_daily_summary(
+    integer, timestamp with time zone, varchar, integer
+);
+DROP INDEX IF EXISTS notification_eventdailysummary_unique;
+'''
+
+POPULATE_SUMMARY = '''
+INSERT INTO notification_eventdailysummary (user_id, date, rule, event_count)
+SELECT user_id, (triggered_at AT TIME ZONE current_setting('mtp.time_zone'))::date, rule, COUNT(*)
+FROM notification_event
+WHERE triggered_at IS NOT NULL
+GROUP BY user_id, (triggered_at AT TIME ZONE current_setting('mtp.time_zone'))::date, rule;
+'''
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notification', '0002_auto_20201007_1448'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', '-triggered_at'], name='notificatio_user_id_fb30f2_idx'),
+        ),
+        migrations.CreateModel(
+            name='EventDailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('rule', models.CharField(max_length=8)),
+                ('event_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(
+                    null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL,
+                )),
+            ],
+            options={
+                'verbose_name_plural': 'event daily summaries',
+                'ordering': ('-date', 'rule'),
+            },
+        ),
+        migrations.RunSQL(sql=CREATE_TRIGGERS, reverse_sql=DROP_TRIGGERS),
+        migrations.RunSQL(sql=POPULATE_SUMMARY, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -41,9 +41,28 @@ class Event(models.Model):
         indexes = [
             models.Index(fields=['-triggered_at', 'id']),
             models.Index(fields=['rule']),
+            models.Index(fields=['user', '-triggered_at']),
         ]
 
 
+class EventDailySummary(models.Model):
+    """
+    Number of events for a user (or for all users if null) triggered by a rule on a local date;
+    maintained by database triggers, c.f. migration 0003_eventdailysummary
+    """
+    user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
+    date = models.DateField()
+    rule = models.CharField(max_length=8)
+    event_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'event daily summaries'
+        ordering = ('-date', 'rule')
+
+    def __str__(self):
+        return '%d %s events on %s' % (self.event_count, self.rule, self.date)
+
+
 class CreditEvent(models.Model):
     """
     Links a notification to a credit
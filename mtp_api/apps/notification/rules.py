@@ -1,23 +1,50 @@
+import collections
 import datetime
+import itertools
 import unicodedata
 
+from django.contrib.auth import get_user_model
+from django.db.models import Func, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.db.transaction import atomic
 from django.utils import timezone
 from django.utils.functional import cached_property
 
 from core import getattr_path
+from core.models import TruncLocalDate
 from credit.models import Credit
 from disbursement.models import Disbursement
 from notification.models import (
     Event, CreditEvent, DisbursementEvent,
     SenderProfileEvent, RecipientProfileEvent, PrisonerProfileEvent,
 )
-from security.models import SenderProfile, RecipientProfile, PrisonerProfile
+from security.constants import ACTIVITY_RECORD_TYPE
+from security.models import SenderProfile, RecipientProfile, PrisonerProfile, ProfileDailyActivity
 from transaction.utils import format_amount
 
 ENABLED_RULE_CODES = {'MONP', 'MONS'}
 
 
+UnsavedEvent = collections.namedtuple('UnsavedEvent', 'event relations')
+
+
+@atomic
+def save_events(unsaved_events):
+    """
+    Saves events described by rules along with their relations to records and profiles
+    using one INSERT for events and one for each type of relation
+    """
+    events = Event.objects.bulk_create(unsaved_event.event for unsaved_event in unsaved_events)
+    relations_by_model = collections.defaultdict(list)
+    for event, unsaved_event in zip(events, unsaved_events):
+        for event_relation in unsaved_event.relations:
+            event_relation.event = event
+            relations_by_model[type(event_relation)].append(event_relation)
+    for model, event_relations in relations_by_model.items():
+        model.objects.bulk_create(event_relations)
+    return events
+
+
 class Triggered:
     """
     'Truthy' type to indicate whether a notification rule is triggered by a record
@@ -49,46 +76,63 @@ class BaseRule:
     def triggered(self, record) -> Triggered:
         raise NotImplementedError
 
+    def triggered_many(self, records) -> list:
+        """
+        Evaluates the rule for a batch of records it applies to, returning a `Triggered` for each in the same order;
+        rules that query the database override this to do so once for the whole batch
+        """
+        return [self.triggered(record) for record in records]
+
+    def triggered_records(self, record_set, batch_size=500):
+        """
+        Yields records from `record_set` that trigger the rule along with their `Triggered`,
+        evaluating them in batches
+        """
+        records = iter(record_set)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            batch = [record for record in batch if self.applies_to(record)]
+            for record, triggered in zip(batch, self.triggered_many(batch)):
+                if triggered:
+                    yield record, triggered
+
     def get_event_trigger(self, record):
         return record
 
-    def _create_event(self, record, user=None):
-        event_relations = []
-        event = Event(rule=self.code, description=self.description, user=user)
+    def describe_event(self, record, user_id=None):
+        """
+        Returns an unsaved event for the record along with its unsaved relations to the record and trigger
+        or None if the record cannot have events
+        """
+        event = Event(rule=self.code, description=self.description, user_id=user_id)
         if isinstance(record, Credit):
             event.triggered_at = record.received_at
-            event.save()
-            event_relations.append(CreditEvent(event=event, credit=record))
+            event_relations = [CreditEvent(credit=record)]
         elif isinstance(record, Disbursement):
             event.triggered_at = record.created
-            event.save()
-            event_relations.append(DisbursementEvent(event=event, disbursement=record))
+            event_relations = [DisbursementEvent(disbursement=record)]
         else:
             return
 
         trigger = self.get_event_trigger(record)
         if trigger and trigger != record:
             if isinstance(trigger, SenderProfile):
-                event_relations.append(
-                    SenderProfileEvent(event=event, sender_profile=trigger)
-                )
+                event_relations.append(SenderProfileEvent(sender_profile=trigger))
             elif isinstance(trigger, RecipientProfile):
-                event_relations.append(
-                    RecipientProfileEvent(event=event, recipient_profile=trigger)
-                )
+                event_relations.append(RecipientProfileEvent(recipient_profile=trigger))
             elif isinstance(trigger, PrisonerProfile):
-                event_relations.append(
-                    PrisonerProfileEvent(event=event, prisoner_profile=trigger)
-                )
+                event_relations.append(PrisonerProfileEvent(prisoner_profile=trigger))
 
-        for event_relation in event_relations:
-            event_relation.save()
+        return UnsavedEvent(event, event_relations)
 
-        return event
+    def describe_events(self, record, triggered=None):
+        unsaved_event = self.describe_event(record)
+        return [unsaved_event] if unsaved_event else []
 
-    @atomic
     def create_events(self, record):
-        return [self._create_event(record)]
+        return save_events(self.describe_events(record))
 
 
 class NotWholeNumberRule(BaseRule):
@@ -139,14 +183,18 @@ class MonitoredRule(BaseRule):
         kwargs['user_filters'] = user_filters or {}
         super().__init__(*args, **kwargs)
 
-    @atomic
-    def create_events(self, record):
-        profile = self.get_event_trigger(record)
-        user_filters = self.kwargs['user_filters']
-        return [
-            self._create_event(record, user=user)
-            for user in profile.get_monitoring_users().filter(**user_filters)
-        ]
+    def describe_events(self, record, triggered=None):
+        if triggered and 'monitoring_user_ids' in triggered.kwargs:
+            user_ids = triggered.kwargs['monitoring_user_ids']
+        else:
+            profile = self.get_event_trigger(record)
+            user_filters = self.kwargs['user_filters']
+            user_ids = profile.get_monitoring_users().filter(**user_filters).values_list('pk', flat=True)
+        unsaved_events = (
+            self.describe_event(record, user_id=user_id)
+            for user_id in user_ids
+        )
+        return [unsaved_event for unsaved_event in unsaved_events if unsaved_event]
 
     def triggered(self, record) -> Triggered:
         profile = self.get_event_trigger(record)
@@ -156,6 +204,39 @@ class MonitoredRule(BaseRule):
             return Triggered(monitoring_user_count, monitoring_user_count=monitoring_user_count)
         return Triggered(False, monitoring_user_count=0)
 
+    def triggered_many(self, records) -> list:
+        """
+        Finds monitoring users of all the records' profiles together; the user ids are kept
+        so that events can be described without querying again
+        """
+        if not records:
+            return []
+        profile = self.kwargs['profile']
+        profile_model = records[0]._meta.get_field(profile).related_model
+        profile_ids = [getattr(record, f'{profile}_id') for record in records]
+        monitoring_user_ids = profile_model.objects.get_monitoring_user_ids(
+            {profile_id for profile_id in profile_ids if profile_id}
+        )
+        user_filters = self.kwargs['user_filters']
+        if user_filters:
+            filtered_user_ids = set(
+                get_user_model().objects.filter(
+                    pk__in=set().union(*monitoring_user_ids.values()), **user_filters
+                ).values_list('pk', flat=True)
+            )
+            monitoring_user_ids = {
+                profile_id: user_ids & filtered_user_ids
+                for profile_id, user_ids in monitoring_user_ids.items()
+            }
+
+        triggered = []
+        for profile_id in profile_ids:
+            user_ids = sorted(monitoring_user_ids.get(profile_id, ()))
+            triggered.append(Triggered(
+                user_ids, monitoring_user_count=len(user_ids), monitoring_user_ids=user_ids,
+            ))
+        return triggered
+
     def get_event_trigger(self, record):
         return getattr(record, self.kwargs['profile'])
 
@@ -191,30 +272,148 @@ class CountingRule(BaseRule):
         if not profile or profile == self.shared_profile:
             return Triggered(False)
 
-        records_of_same_type = self.get_profile_records_of_same_type(profile, record)
-        field_to_count = self.kwargs['count']
-        count = records_of_same_type.values(field_to_count).distinct().count()
+        count = self.get_count(profile, record)
         return Triggered(count > self.kwargs['limit'], count=count)
 
+    def triggered_many(self, records) -> list:
+        """
+        Reads daily activity covering all the records' counting periods in one query and then counts each period
+        """
+        profile = self.kwargs['profile']
+        shared_profile_id = self.shared_profile.pk if self.shared_profile else None
+        profile_ids = [getattr(record, f'{profile}_id') for record in records]
+        periods = [self.get_period_dates(self.get_record_date(record)) for record in records]
+
+        daily_activity = collections.defaultdict(list)
+        counted_profile_ids = {
+            profile_id
+            for profile_id in profile_ids
+            if profile_id and profile_id != shared_profile_id
+        }
+        if counted_profile_ids:
+            rows = self.get_daily_activity(
+                profile_id__in=counted_profile_ids,
+                record_type__in={self.get_record_type(record) for record in records},
+                date__gte=min(period_start for period_start, _ in periods),
+                date__lt=max(period_end for _, period_end in periods),
+            ).values_list('profile_id', 'record_type', 'date', 'record_count', 'counterparty_ids')
+            for profile_id, record_type, *activity in rows:
+                daily_activity[(profile_id, record_type)].append(activity)
+
+        triggered = []
+        for record, profile_id, (period_start, period_end) in zip(records, profile_ids, periods):
+            if profile_id not in counted_profile_ids:
+                triggered.append(Triggered(False))
+                continue
+            period_activity = [
+                (record_count, counterparty_ids)
+                for date, record_count, counterparty_ids in daily_activity[(profile_id, self.get_record_type(record))]
+                if period_start <= date < period_end
+            ]
+            if self.kwargs['count'] == 'pk':
+                count = sum(record_count for record_count, _ in period_activity)
+            else:
+                count = len(set().union(*(counterparty_ids for _, counterparty_ids in period_activity)))
+            triggered.append(Triggered(count > self.kwargs['limit'], count=count))
+        return triggered
+
     def get_event_trigger(self, record):
         return getattr(record, self.kwargs['profile'])
 
-    def get_profile_records_of_same_type(self, profile, record):
-        if isinstance(record, Credit):
-            period_end = record.received_at
-        elif isinstance(record, Disbursement):
-            period_end = record.created
-        else:
-            raise ValueError('unknown record')
-        # make 4 week period include whole days at the boundaries in local time
-        period_end = timezone.localtime(period_end) + datetime.timedelta(days=1)
-        period_end = period_end.replace(hour=0, minute=0, second=0, microsecond=0)
-        period_start = period_end - datetime.timedelta(days=self.kwargs['days'])
+    def triggered_records(self, record_set):
+        """
+        Yields records from a queryset that trigger the rule along with their `Triggered`,
+        counting and deciding in one query, c.f. `annotate_counts`
+        """
+        record_set = self.annotate_counts(record_set).filter(rule_count__gt=self.kwargs['limit'])
+        for record in record_set:
+            yield record, Triggered(True, count=record.rule_count)
 
+    def annotate_counts(self, queryset):
+        """
+        Annotates each record in the queryset with `rule_count`, equivalent to `get_count`, using a subquery
+        over the profile's daily activity in the record's period; records of shared profiles are excluded
+        """
+        profile = self.kwargs['profile']
+        queryset = queryset.filter(**{f'{profile}__isnull': False})
+        if self.shared_profile:
+            queryset = queryset.exclude(**{profile: self.shared_profile})
+
+        record_type = ACTIVITY_RECORD_TYPE.CREDIT if queryset.model is Credit else ACTIVITY_RECORD_TYPE.DISBURSEMENT
+        queryset = queryset.annotate(rule_record_date=TruncLocalDate(self.get_record_date_field(queryset.model)))
+        period_start, period_end = self.get_period_dates(OuterRef('rule_record_date'))
+        daily_activity = self.get_daily_activity(
+            profile_id=OuterRef(f'{profile}_id'),
+            record_type=record_type,
+            date__gte=period_start,
+            date__lt=period_end,
+        )
+        if self.kwargs['count'] == 'pk':
+            count = Coalesce(Subquery(
+                daily_activity.values('profile_id').annotate(count=Sum('record_count')).values('count'),
+                output_field=IntegerField(),
+            ), 0)
+        else:
+            # NB: unknown counterparties are counted as one distinct value like `get_count`
+            counterparty_ids = daily_activity.annotate(
+                counterparty_id=Func('counterparty_ids', function='UNNEST', output_field=IntegerField()),
+            ).values('counterparty_id').distinct()
+            count = Func(
+                Subquery(counterparty_ids),
+                template='(SELECT COUNT(*) FROM %(expressions)s AS counterparties)',
+                output_field=IntegerField(),
+            )
+        return queryset.annotate(rule_count=count)
+
+    def get_count(self, profile, record):
+        """
+        Counts records of the same type or distinct counterparty profiles from pre-aggregated daily activity
+        so that at most `days` rows are read
+        """
+        period_start, period_end = self.get_period_dates(self.get_record_date(record))
+        daily_activity = self.get_daily_activity(
+            profile_id=profile.pk,
+            record_type=self.get_record_type(record),
+            date__gte=period_start,
+            date__lt=period_end,
+        )
+        if self.kwargs['count'] == 'pk':
+            return daily_activity.aggregate(count=Sum('record_count'))['count'] or 0
+        counterparty_ids = set()
+        for daily_counterparty_ids in daily_activity.values_list('counterparty_ids', flat=True):
+            counterparty_ids.update(daily_counterparty_ids)
+        return len(counterparty_ids)
+
+    def get_daily_activity(self, **filters):
+        return ProfileDailyActivity.objects.filter(
+            profile_type=self.kwargs['profile'][:-len('_profile')],
+            **filters
+        ).order_by()
+
+    def get_record_type(self, record):
         if isinstance(record, Credit):
-            return profile.credits.filter(received_at__gte=period_start, received_at__lt=period_end)
-        if isinstance(record, Disbursement):
-            return profile.disbursements.filter(created__gte=period_start, created__lt=period_end)
+            return ACTIVITY_RECORD_TYPE.CREDIT
+        return ACTIVITY_RECORD_TYPE.DISBURSEMENT
+
+    def get_record_date_field(self, model):
+        if model is Credit:
+            return 'received_at'
+        if model is Disbursement:
+            return 'created'
+        raise ValueError('unknown record')
+
+    def get_record_date(self, record):
+        return timezone.localdate(getattr(record, self.get_record_date_field(type(record))))
+
+    def get_period_dates(self, record_date):
+        """
+        Returns the first and end (exclusive) dates of daily activity counted for a record on a local date,
+        i.e. whole days at the boundaries in local time; `record_date` can be a date or a query expression
+        so that records evaluated individually and in queries are counted over the same period
+        """
+        period_start = record_date - datetime.timedelta(days=self.kwargs['days'] - 1)
+        period_end = record_date + datetime.timedelta(days=1)
+        return period_start, period_end
 
 
 RULES = {
@@ -1,12 +1,15 @@
 from mtp_common.spooling import spoolable
 
-from notification.rules import ENABLED_RULE_CODES, RULES
+from notification.rules import ENABLED_RULE_CODES, RULES, save_events
 
 
 @spoolable(body_params=['records'])
 def create_notification_events(records):
-    for record in records:
-        for code in ENABLED_RULE_CODES:
-            rule = RULES[code]
-            if rule.applies_to(record) and rule.triggered(record):
-                rule.create_events(record)
+    unsaved_events = []
+    for code in ENABLED_RULE_CODES:
+        rule = RULES[code]
+        applicable_records = [record for record in records if rule.applies_to(record)]
+        for record, triggered in zip(applicable_records, rule.triggered_many(applicable_records)):
+            if triggered:
+                unsaved_events.extend(rule.describe_events(record, triggered))
+    save_events(unsaved_events)
@@ -2,9 +2,12 @@ import datetime
 import io
 from unittest import mock
 
+from anymail.exceptions import AnymailRequestsAPIError
 from django.core import mail
 from django.core.management import CommandError, call_command
-from django.test import TestCase, override_settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from model_mommy import mommy
 import openpyxl
@@ -18,7 +21,10 @@ from disbursement.tests.utils import generate_disbursements
 from notification.constants import EMAIL_FREQUENCY
 from notification.management.commands.send_notification_emails import (
     EMAILS_STARTED_FLAG,
-    get_events, group_events, summarise_group,
+    get_events, get_events_by_user, group_events, summarise_group,
+)
+from notification.management.commands.send_notification_report import (
+    generate_report, generate_sheet_rows_in_worker,
 )
 from notification.models import Event, EmailNotificationPreferences
 from notification.rules import RULES
@@ -186,7 +192,7 @@ class SendNotificationEmailsTestCase(NotificationBaseTestCase):
         call_command('update_security_profiles')
 
         events = get_events(period_start, period_end)
-        event_group = summarise_group(group_events(events, user))
+        event_group = summarise_group(group_events(get_events_by_user(events)[user.pk]))
         self.assertEqual(event_group['transaction_count'], 4)
         self.assertEqual(len(event_group['senders']), 2)
         self.assertEqual(len(event_group['prisoners']), 2)
@@ -227,6 +233,48 @@ class SendNotificationEmailsTestCase(NotificationBaseTestCase):
         call_command('send_notification_emails')
         self.assertEqual(len(mail.outbox), 2)
 
+    @override_settings(ENVIRONMENT='prod')
+    def test_does_not_record_email_as_sent_if_sending_fails(self):
+        user = self.security_staff[0]
+        EmailNotificationPreferences(user=user, frequency=EMAIL_FREQUENCY.DAILY).save()
+        call_command('update_security_profiles')
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages') as mocked_send_messages:
+            mocked_send_messages.side_effect = AnymailRequestsAPIError(status_code=500)
+            with self.assertRaises(AnymailRequestsAPIError):
+                call_command('send_notification_emails')
+        self.assertFalse(user.flags.filter(name=EMAILS_STARTED_FLAG).exists())
+        self.assertIsNone(EmailNotificationPreferences.objects.get(user=user).last_sent_at)
+
+        call_command('send_notification_emails')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertTrue(user.flags.filter(name=EMAILS_STARTED_FLAG).exists())
+        self.assertIsNotNone(EmailNotificationPreferences.objects.get(user=user).last_sent_at)
+
+    @override_settings(ENVIRONMENT='prod')
+    def test_query_count_does_not_depend_on_users(self):
+        self.create_profiles_but_unlink_objects()
+        for profile in DebitCardSenderDetails.objects.all():
+            profile.monitoring_users.add(*self.security_staff)
+        call_command('update_security_profiles')
+        for user in self.security_staff:
+            user.flags.create(name=EMAILS_STARTED_FLAG)
+
+        def get_select_query_count():
+            EmailNotificationPreferences.objects.update(last_sent_at=None)
+            with CaptureQueriesContext(connection) as captured_queries:
+                call_command('send_notification_emails')
+            return len([query for query in captured_queries if query['sql'].startswith('SELECT')])
+
+        EmailNotificationPreferences(user=self.security_staff[0], frequency=EMAIL_FREQUENCY.DAILY).save()
+        query_count = get_select_query_count()
+        self.assertEqual(len(mail.outbox), 1)
+
+        for user in self.security_staff[1:]:
+            EmailNotificationPreferences(user=user, frequency=EMAIL_FREQUENCY.DAILY).save()
+        self.assertEqual(get_select_query_count(), query_count)
+        self.assertEqual(len(mail.outbox), 1 + len(self.security_staff))
+
 
 @override_settings(ENVIRONMENT='prod')
 class SendNotificationReportTestCase(NotificationBaseTestCase):
@@ -251,6 +299,8 @@ class SendNotificationReportTestCase(NotificationBaseTestCase):
             call_command('send_notification_report', 'admin@mtp.local', since='2019-08-02', until='2019-08-01')
         with self.assertRaises(CommandError, msg='Date span should be invalid'):
             call_command('send_notification_report', 'admin@mtp.local', since='2019-07-01', until='2019-08-01')
+        with self.assertRaises(CommandError, msg='Number of workers should be invalid'):
+            call_command('send_notification_report', 'admin@mtp.local', workers=0)
         with self.assertRaises((CommandError, KeyError), msg='Rules should be invalid'):
             call_command('send_notification_report', 'admin@mtp.local', rules=['abc'])
         self.assertEqual(len(mail.outbox), 0)
@@ -416,3 +466,54 @@ class SendNotificationReportTestCase(NotificationBaseTestCase):
         rows, _columns = coordinate_to_tuple(dimensions.split(':')[1])
         self.assertEqual(rows, 2)
         self.assertEqual(worksheet['B2'].value, count)
+
+
+@override_settings(ENVIRONMENT='prod')
+class GenerateNotificationReportInWorkersTestCase(TransactionTestCase):
+    # workers use their own connections so data must be committed for them to see it
+    fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
+
+    def setUp(self):
+        super().setUp()
+        make_test_users()
+        load_random_prisoner_locations()
+        generate_payments(payment_batch=20, days_of_history=2)
+        generate_disbursements(disbursement_batch=20, days_of_history=2)
+        call_command('update_security_profiles', verbosity=0)
+        self.period_end = timezone.make_aware(
+            datetime.datetime.combine(timezone.localdate() + datetime.timedelta(days=1), datetime.time.min)
+        )
+        self.period_start = self.period_end - datetime.timedelta(days=7)
+
+    def generate_report_values(self, workers):
+        workbook = openpyxl.Workbook(write_only=True)
+        generate_report(workbook, self.period_start, self.period_end, list(RULES.values()), workers=workers)
+        contents = io.BytesIO()
+        workbook.save(contents)
+        workbook = openpyxl.load_workbook(io.BytesIO(contents.getvalue()))
+        return {
+            title: [[cell.value for cell in row] for row in workbook[title].iter_rows()]
+            for title in workbook.sheetnames
+        }
+
+    @mock.patch('notification.management.commands.send_notification_report.SHEET_ROW_QUEUE_SIZE', 1)
+    def test_workers_generate_same_report(self):
+        serial_report = self.generate_report_values(workers=1)
+        self.assertTrue(any(len(rows) > 2 for rows in serial_report.values()), 'Some sheets should have several rows')
+
+        with mock.patch(
+            'notification.management.commands.send_notification_report.generate_sheet_rows_in_worker',
+            wraps=generate_sheet_rows_in_worker,
+        ) as mocked_generate_sheet_rows_in_worker:
+            concurrent_report = self.generate_report_values(workers=3)
+        self.assertEqual(mocked_generate_sheet_rows_in_worker.call_count, len(serial_report))
+        self.assertListEqual(list(concurrent_report), list(serial_report))
+        self.assertDictEqual(concurrent_report, serial_report)
+
+    def test_worker_errors_raised(self):
+        with mock.patch(
+            'notification.management.commands.send_notification_report.generate_sheet_rows',
+            side_effect=ValueError,
+        ):
+            with self.assertRaises(ValueError):
+                self.generate_report_values(workers=3)
@@ -0,0 +1,68 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from model_mommy import mommy
+
+from notification.models import Event, EventDailySummary
+
+User = get_user_model()
+
+
+class EventDailySummaryTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = mommy.make(User)
+        self.triggered_at = timezone.make_aware(datetime.datetime(2021, 3, 1, 23, 30))
+
+    def get_summary(self):
+        return list(EventDailySummary.objects.order_by('date', 'rule', 'user').values_list(
+            'user', 'date', 'rule', 'event_count',
+        ))
+
+    def test_summary_follows_events(self):
+        event = mommy.make(Event, user=self.user, rule='MONP', triggered_at=self.triggered_at)
+        mommy.make(Event, user=self.user, rule='MONP', triggered_at=self.triggered_at)
+        mommy.make(Event, user=None, rule='MONS', triggered_at=self.triggered_at)
+        date = datetime.date(2021, 3, 1)
+        self.assertListEqual(self.get_summary(), [
+            (self.user.pk, date, 'MONP', 2),
+            (None, date, 'MONS', 1),
+        ])
+
+        event.rule = 'MONS'
+        event.triggered_at += datetime.timedelta(days=1)
+        event.save()
+        self.assertListEqual(self.get_summary(), [
+            (self.user.pk, date, 'MONP', 1),
+            (None, date, 'MONS', 1),
+            (self.user.pk, date + datetime.timedelta(days=1), 'MONS', 1),
+        ])
+
+        Event.objects.filter(user=self.user).delete()
+        self.assertListEqual(self.get_summary(), [
+            (None, date, 'MONS', 1),
+        ])
+
+    def test_summary_follows_bulk_created_events(self):
+        Event.objects.bulk_create(
+            Event(user=self.user, rule='MONP', triggered_at=self.triggered_at - datetime.timedelta(days=days))
+            for days in range(3)
+            for _ in range(2)
+        )
+        self.assertListEqual(self.get_summary(), [
+            (self.user.pk, datetime.date(2021, 2, 27), 'MONP', 2),
+            (self.user.pk, datetime.date(2021, 2, 28), 'MONP', 2),
+            (self.user.pk, datetime.date(2021, 3, 1), 'MONP', 2),
+        ])
+
+    def test_summary_dates_use_current_time_zone(self):
+        triggered_at = datetime.datetime(2021, 6, 30, 23, 30, tzinfo=timezone.utc)
+        mommy.make(Event, user=self.user, rule='MONP', triggered_at=triggered_at)
+        with override_settings(TIME_ZONE='UTC'):
+            mommy.make(Event, user=self.user, rule='MONS', triggered_at=triggered_at)
+        self.assertListEqual(self.get_summary(), [
+            (self.user.pk, datetime.date(2021, 6, 30), 'MONS', 1),
+            (self.user.pk, datetime.date(2021, 7, 1), 'MONP', 1),
+        ])
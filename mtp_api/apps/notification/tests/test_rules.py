@@ -3,10 +3,14 @@ import random
 
 from django.contrib.auth.models import Group
 from django.core.management import call_command
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from model_mommy import mommy
 
 from core.tests.utils import make_test_users
+from credit.constants import CREDIT_RESOLUTION
 from credit.models import Credit
 from disbursement.models import Disbursement
 from disbursement.tests.utils import generate_disbursements
@@ -14,6 +18,7 @@ from notification.models import (
     SenderProfileEvent, RecipientProfileEvent, PrisonerProfileEvent
 )
 from notification.rules import Event, RULES
+from notification.tasks import create_notification_events
 from notification.tests.utils import (
     make_sender, make_recipient, make_prisoner,
     make_csfreq_credits, make_drfreq_disbursements,
@@ -23,7 +28,7 @@ from notification.tests.utils import (
 from payment.models import Payment
 from payment.tests.utils import generate_payments
 from prison.tests.utils import load_random_prisoner_locations
-from security.models import SenderProfile, RecipientProfile, PrisonerProfile
+from security.models import SenderProfile, RecipientProfile, PrisonerProfile, ProfileDailyActivity
 from transaction.models import Transaction
 from transaction.tests.utils import generate_transactions
 
@@ -34,7 +39,8 @@ class RuleTestCase(TestCase):
     def setUp(self):
         super().setUp()
         test_users = make_test_users()
-        self.user = test_users['security_staff'][0]
+        self.security_staff = test_users['security_staff']
+        self.user = self.security_staff[0]
         load_random_prisoner_locations()
         # generate random data which may or may not match amount rules
         generate_transactions(transaction_batch=200, days_of_history=3)
@@ -199,6 +205,27 @@ class RuleTestCase(TestCase):
 
         self.assertEqual(Event.objects.count(), prisoner_profile.disbursements.count())
 
+    def test_create_notification_events_in_bulk(self):
+        call_command('update_security_profiles')
+
+        prisoner_profile = PrisonerProfile.objects.filter(credits__isnull=False).first()
+        monitoring_users = self.security_staff[:2]
+        prisoner_profile.monitoring_users.add(*monitoring_users)
+
+        credits = list(Credit.objects.filter(prisoner_profile=prisoner_profile))
+        with CaptureQueriesContext(connection) as captured_queries:
+            create_notification_events(records=credits)
+        insert_queries = [query for query in captured_queries if query['sql'].startswith('INSERT')]
+        # one for events, credit relations and prisoner profile relations
+        self.assertEqual(len(insert_queries), 3)
+
+        self.assertEqual(Event.objects.count(), len(credits) * 2)
+        for user in monitoring_users:
+            events = Event.objects.filter(user=user)
+            self.assertEqual(events.count(), len(credits))
+            for credit in credits:
+                self.assertEventMatchesRecord(events.filter(credit_event__credit=credit), credit, PrisonerProfile)
+
     def test_create_events_for_mons_debit_card(self):
         call_command('update_security_profiles')
 
@@ -316,6 +343,33 @@ class RuleTestCase(TestCase):
 
         self.assertEqual(Event.objects.count(), prisoner_profile.credits.count())
 
+    def test_triggered_many_matches_triggered(self):
+        call_command('update_security_profiles')
+
+        monitoring_users = self.security_staff
+        PrisonerProfile.objects.filter(credits__isnull=False).first().monitoring_users.add(*monitoring_users)
+        PrisonerProfile.objects.filter(disbursements__isnull=False).last().monitoring_users.add(monitoring_users[0])
+        SenderProfile.objects.filter(
+            debit_card_details__isnull=False,
+        ).first().debit_card_details.first().monitoring_users.add(*monitoring_users)
+        SenderProfile.objects.filter(
+            bank_transfer_details__isnull=False,
+        ).first().bank_transfer_details.first().sender_bank_account.monitoring_users.add(monitoring_users[-1])
+        RecipientProfile.objects.filter(
+            bank_transfer_details__isnull=False,
+        ).first().bank_transfer_details.first().recipient_bank_account.monitoring_users.add(*monitoring_users)
+
+        records = [*Credit.objects.order_by('pk'), *Disbursement.objects.order_by('pk')]
+        for rule in RULES.values():
+            applicable_records = [record for record in records if rule.applies_to(record)]
+            triggered_many = rule.triggered_many(applicable_records)
+            self.assertEqual(len(triggered_many), len(applicable_records))
+            for record, triggered in zip(applicable_records, triggered_many):
+                expected_triggered = rule.triggered(record)
+                self.assertEqual(bool(triggered), bool(expected_triggered), msg=f'{rule.code} for {record}')
+                triggered.kwargs.pop('monitoring_user_ids', None)
+                self.assertDictEqual(triggered.kwargs, expected_triggered.kwargs, msg=f'{rule.code} for {record}')
+
 
 class CountingRuleTestCase(TestCase):
     fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
@@ -527,6 +581,44 @@ class CountingRuleTestCase(TestCase):
         # latest disbursement should still not trigger
         self.assertFalse(rule.triggered(latest_disbursement))
 
+    def test_daily_activity_dates_use_current_time_zone(self):
+        received_at = datetime.datetime(2021, 6, 30, 23, 30, tzinfo=timezone.utc)
+
+        def make_credit_and_get_activity_dates():
+            sender = make_sender()
+            mommy.make(
+                Credit, sender_profile=sender, received_at=received_at,
+                resolution=CREDIT_RESOLUTION.CREDITED, reconciled=True, private_estate_batch=None,
+            )
+            activity = ProfileDailyActivity.objects.filter(profile_type='sender', profile_id=sender.pk)
+            return list(activity.values_list('date', flat=True))
+
+        self.assertListEqual(make_credit_and_get_activity_dates(), [datetime.date(2021, 7, 1)])
+        with override_settings(TIME_ZONE='UTC'):
+            self.assertListEqual(make_credit_and_get_activity_dates(), [datetime.date(2021, 6, 30)])
+
+    def test_counts_only_completed_credits(self):
+        rule = RULES['CSFREQ']
+
+        count = rule.kwargs['limit'] + 1
+        credit_list = make_csfreq_credits(self.today, make_sender(), count)
+        latest_credit = credit_list[0]
+        self.assertTrue(rule.triggered(latest_credit))
+
+        # daily activity is kept up-to-date as records change so failed credits stop counting
+        oldest_credit = credit_list[-1]
+        oldest_credit.resolution = CREDIT_RESOLUTION.FAILED
+        oldest_credit.save()
+        triggered = rule.triggered(latest_credit)
+        self.assertFalse(triggered)
+        self.assertEqual(triggered.kwargs['count'], count - 1)
+
+        Credit.objects_all.filter(pk=oldest_credit.pk).update(resolution=CREDIT_RESOLUTION.CREDITED)
+        self.assertTrue(rule.triggered(latest_credit))
+
+        oldest_credit.delete()
+        self.assertFalse(rule.triggered(latest_credit))
+
     def test_not_triggered_on_shared_profiles(self):
         """
         Anonymous senders and cheque recipients should not trigger counting rules
@@ -556,6 +648,63 @@ class CountingRuleTestCase(TestCase):
         latest_disbursement = disbursement_list[0]
         self.assertFalse(rule.triggered(latest_disbursement))
 
+    def test_triggered_records_match_triggered(self):
+        """
+        Counting in one query for a whole report sheet should match counting records one-by-one
+        """
+        make_csfreq_credits(self.today, make_sender(), RULES['CSFREQ'].kwargs['limit'] + 1)
+        make_csnum_credits(self.today, make_prisoner(), RULES['CSNUM'].kwargs['limit'] + 1)
+        make_cpnum_credits(self.today, make_sender(), RULES['CPNUM'].kwargs['limit'] + 1)
+        make_csfreq_credits(self.today, self.anonymous_sender, RULES['CSFREQ'].kwargs['limit'] + 1)
+        make_drfreq_disbursements(self.today, make_recipient(), RULES['DRFREQ'].kwargs['limit'] + 1)
+        make_drnum_disbursements(self.today, make_prisoner(), RULES['DRNUM'].kwargs['limit'] + 1)
+        make_dpnum_disbursements(self.today, make_recipient(), RULES['DPNUM'].kwargs['limit'] + 1)
+        make_drfreq_disbursements(self.today, self.cheque_recipient, RULES['DRFREQ'].kwargs['limit'] + 1)
+
+        for code in ('CSFREQ', 'CSNUM', 'CPNUM', 'DRFREQ', 'DRNUM', 'DPNUM'):
+            rule = RULES[code]
+            model = rule.applies_to_models[0]
+            expected_triggered_records = {}
+            for record in model.objects.all():
+                triggered = rule.triggered(record)
+                if triggered:
+                    expected_triggered_records[record.pk] = triggered.kwargs['count']
+            self.assertTrue(expected_triggered_records, msg=f'{code} should be triggered')
+            triggered_records = {
+                record.pk: triggered.kwargs['count']
+                for record, triggered in rule.triggered_records(model.objects.all())
+            }
+            self.assertDictEqual(triggered_records, expected_triggered_records, msg=f'{code} sheet')
+
+    def test_counting_methods_agree(self):
+        """
+        Annotated counts in queries, batch evaluation and evaluating records one-by-one should count the same periods
+        """
+        # records spanning more than the counting periods so that the oldest fall at their boundaries
+        make_csfreq_credits(self.today, make_sender(), RULES['CSFREQ'].kwargs['days'] + 2)
+        make_csnum_credits(self.today, make_prisoner(), RULES['CSNUM'].kwargs['days'] + 2)
+        make_cpnum_credits(self.today, make_sender(), RULES['CPNUM'].kwargs['days'] + 2)
+        make_drfreq_disbursements(self.today, make_recipient(), RULES['DRFREQ'].kwargs['days'] + 2)
+        make_drnum_disbursements(self.today, make_prisoner(), RULES['DRNUM'].kwargs['days'] + 2)
+        make_dpnum_disbursements(self.today, make_recipient(), RULES['DPNUM'].kwargs['days'] + 2)
+
+        for code in ('CSFREQ', 'CSNUM', 'CPNUM', 'DRFREQ', 'DRNUM', 'DPNUM'):
+            rule = RULES[code]
+            model = rule.applies_to_models[0]
+            annotated_counts = dict(rule.annotate_counts(model.objects.all()).values_list('pk', 'rule_count'))
+            self.assertTrue(annotated_counts, msg=f'{code} should count records')
+            records = list(model.objects.filter(pk__in=annotated_counts))
+            counts = {
+                record.pk: rule.triggered(record).kwargs['count']
+                for record in records
+            }
+            batch_counts = {
+                record.pk: triggered.kwargs['count']
+                for record, triggered in zip(records, rule.triggered_many(records))
+            }
+            self.assertDictEqual(annotated_counts, counts, msg=f'{code} annotated counts')
+            self.assertDictEqual(batch_counts, counts, msg=f'{code} batch counts')
+
 
 class ContainsSymbolsTestCase(TestCase):
     fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
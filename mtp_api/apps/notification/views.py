@@ -5,11 +5,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from core.filters import IsoDateTimeFilter, SafeOrderingFilter, MultipleValueFilter, BaseFilterSet
-from core.models import TruncLocalDate
 from core.permissions import ActionsBasedPermissions
 from mtp_auth.permissions import NomsOpsClientIDPermissions
 from notification.constants import EMAIL_FREQUENCY
-from notification.models import Event, EmailNotificationPreferences
+from notification.models import Event, EventDailySummary, EmailNotificationPreferences
 from notification.rules import RULES, ENABLED_RULE_CODES
 from notification.serializers import EventSerializer
 
@@ -20,6 +19,7 @@ class EventPagesView(views.APIView):
 
     Currently, noms-ops shows X days worth of notifications per page so needs a
     mechanism to determine what date range to filter by.
+    Dates are read from daily summaries rather than the events themselves.
     """
     permission_classes = (IsAuthenticated, NomsOpsClientIDPermissions)
 
@@ -31,17 +31,16 @@ class EventPagesView(views.APIView):
         offset = int(request.query_params.get('offset', 0))
         limit = int(request.query_params.get('limit', 25))
 
-        queryset = Event.objects \
-            .annotate(triggered_at_date=TruncLocalDate('triggered_at')) \
+        queryset = EventDailySummary.objects \
             .filter(filters) \
-            .values('triggered_at_date') \
-            .order_by('-triggered_at_date') \
+            .values('date') \
+            .order_by('-date') \
             .distinct()
         count = queryset.count()
         results = list(queryset[offset:offset + limit])
         return Response({
-            'newest': results[0]['triggered_at_date'] if results else None,
-            'oldest': results[-1]['triggered_at_date'] if results else None,
+            'newest': results[0]['date'] if results else None,
+            'oldest': results[-1]['date'] if results else None,
             'count': count,
         })
 
@@ -0,0 +1,116 @@
+import datetime
+import math
+import random
+import textwrap
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from oauth2_provider.models import AccessToken, Application
+from rest_framework.test import APIClient
+
+from mtp_auth.constants import SEND_MONEY_CLIENT_ID
+from prison.models import PrisonerLocation
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Times creating and updating payments through the API as send-money does.
+    Updating a payment with card details attaches security profiles and creates a security check
+    so this is the endpoint to compare before and after changes to rules or profiles.
+    All changes are rolled back so this can be run against a copy of production data.
+    """
+    help = textwrap.dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--iterations', type=int, default=100, help='Number of payments to create and update')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed used to choose prisoners and senders')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if iterations < 1:
+            raise CommandError('At least 1 iteration is required')
+        random.seed(options['seed'])
+
+        prisoner_locations = list(
+            PrisonerLocation.objects.filter(active=True).values('prisoner_number', 'prisoner_dob')[:1000]
+        )
+        if not prisoner_locations:
+            raise CommandError('There are no active prisoner locations')
+        user = User.objects.filter(groups__name='SendMoney').first()
+        if not user:
+            raise CommandError('There is no send-money user')
+
+        with transaction.atomic():
+            client = self.get_client(user)
+            create_timings = []
+            update_timings = []
+            for _ in range(iterations):
+                prisoner_location = random.choice(prisoner_locations)
+                start = time.perf_counter()
+                response = client.post(reverse('payment-list'), data={
+                    'amount': random.randint(100, 20000),
+                    'service_charge': 0,
+                    'recipient_name': 'Prisoner',
+                    'prisoner_number': prisoner_location['prisoner_number'],
+                    'prisoner_dob': prisoner_location['prisoner_dob'].isoformat(),
+                    'ip_address': '127.0.0.1',
+                }, format='json')
+                create_timings.append(time.perf_counter() - start)
+                if response.status_code != 201:
+                    raise CommandError(f'Payment could not be created: {response.content}')
+
+                # a small pool of cards means that some senders will match counting rules
+                card_number_last_digits = '%04d' % random.randint(0, 50)
+                start = time.perf_counter()
+                response = client.patch(reverse('payment-detail', args=[response.json()['uuid']]), data={
+                    'email': f'sender-{card_number_last_digits}@outside.local',
+                    'worldpay_id': get_random_string(),
+                    'cardholder_name': 'Sender',
+                    'card_number_first_digits': '111122',
+                    'card_number_last_digits': card_number_last_digits,
+                    'card_expiry_date': '10/29',
+                    'card_brand': 'Visa',
+                    'billing_address': {
+                        'line1': '62 Petty France',
+                        'city': 'London',
+                        'country': 'UK',
+                        'postcode': 'SW1H 9EU',
+                    },
+                }, format='json')
+                update_timings.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f'Payment could not be updated: {response.content}')
+
+            transaction.set_rollback(True)
+
+        self.write_timings('Create payment', create_timings)
+        self.write_timings('Update payment', update_timings)
+
+    def get_client(self, user):
+        access_token = AccessToken.objects.create(
+            token=get_random_string(),
+            application=Application.objects.get(client_id=SEND_MONEY_CLIENT_ID),
+            user=user,
+            expires=timezone.now() + datetime.timedelta(hours=1),
+        )
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token.token}')
+        return client
+
+    def write_timings(self, name, timings):
+        timings = sorted(timings)
+
+        def percentile(p):
+            return timings[max(math.ceil(p / 100 * len(timings)) - 1, 0)] * 1000
+
+        self.stdout.write(
+            f'{name}: median {percentile(50):.1f}ms, p95 {percentile(95):.1f}ms, max {timings[-1] * 1000:.1f}ms'
+        )
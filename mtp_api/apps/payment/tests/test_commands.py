@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from io import StringIO
 from unittest import mock
 
 from django.core.management import CommandError, call_command
@@ -50,3 +51,16 @@ class AbandonedPaymentClearingTestCase(TestCase):
         with self.assertRaises(CommandError):
             call_command('clear_abandoned_payments', age=0, verbosity=0)
         self.assertEqual(self.payment_count, Payment.objects.all().count())
+
+
+class BenchmarkPaymentUpdatesTestCase(TestCase):
+    fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
+
+    def test_payments_rolled_back(self):
+        make_test_users(1)
+        load_random_prisoner_locations(2)
+        payment_count = Payment.objects.count()
+        stdout = StringIO()
+        call_command('benchmark_payment_updates', iterations=3, stdout=stdout)
+        self.assertEqual(Payment.objects.count(), payment_count)
+        self.assertIn('Update payment: median', stdout.getvalue())
@@ -0,0 +1,78 @@
+import csv
+import io
+import itertools
+
+from django.db import connection, models
+from django.utils import timezone
+
+
+class PrisonerLocationManager(models.Manager):
+    copy_columns = (
+        'created', 'modified', 'created_by_id',
+        'prisoner_name', 'prisoner_number', 'prisoner_dob', 'prison_id', 'active',
+    )
+
+    def copy_new_locations(self, locations, batch_size=10000):
+        """
+        Loads new inactive prisoner locations using COPY which is much faster than inserting many rows;
+        rows are streamed in batches so that memory use is bounded.
+        NB: no model instances are created so save signals are not sent
+        :param locations: iterable of validated dicts with prisoner_name, prisoner_number, prisoner_dob,
+            prison_id and optionally created_by
+        :return: number of locations loaded
+        """
+        now = timezone.now().isoformat()
+        # strings are quoted so that blank names are not loaded as nulls, but a missing creator must be
+        sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv, FORCE_NULL (%s))' % (
+            connection.ops.quote_name(self.model._meta.db_table),
+            ', '.join(map(connection.ops.quote_name, self.copy_columns)),
+            connection.ops.quote_name('created_by_id'),
+        )
+        locations = iter(locations)
+        count = 0
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(itertools.islice(locations, batch_size))
+                if not batch:
+                    break
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+                for location in batch:
+                    created_by = location.get('created_by')
+                    writer.writerow((
+                        now, now, created_by.pk if created_by else None,
+                        location['prisoner_name'], location['prisoner_number'],
+                        location['prisoner_dob'].isoformat(), location['prison_id'], 'false',
+                    ))
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                count += len(batch)
+        return count
+
+    def activate_new_locations(self):
+        """
+        Replaces active prisoner locations with the newly-uploaded inactive ones
+        :return: set of (prisoner_number, prisoner_dob) pairs that were added, removed or moved
+            between prisons, or whose name changed
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH active_locations AS (
+                    SELECT prisoner_number, prisoner_dob, prison_id, prisoner_name
+                    FROM prison_prisonerlocation WHERE active IS True
+                ), new_locations AS (
+                    SELECT prisoner_number, prisoner_dob, prison_id, prisoner_name
+                    FROM prison_prisonerlocation WHERE active IS False
+                ), changed_locations AS (
+                    (SELECT * FROM active_locations EXCEPT SELECT * FROM new_locations)
+                    UNION ALL
+                    (SELECT * FROM new_locations EXCEPT SELECT * FROM active_locations)
+                )
+                SELECT DISTINCT prisoner_number, prisoner_dob FROM changed_locations
+                """
+            )
+            changed_prisoner_keys = set(cursor.fetchall())
+        self.filter(active=True).delete()
+        self.filter(active=False).update(active=True)
+        return changed_prisoner_keys
@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def schedule_update_credit_prisons(apps, schema_editor):
+    cls = apps.get_model('core', 'ScheduledCommand')
+    cls.objects.create(
+        name='update_credit_prisons',
+        arg_string='',
+        cron_entry='40 * * * *',
+        next_execution=timezone.now(),
+    )
+
+
+def unschedule_update_credit_prisons(apps, schema_editor):
+    cls = apps.get_model('core', 'ScheduledCommand')
+    cls.objects.filter(name='update_credit_prisons').delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0005_delete_token'),
+        ('prison', '0023_removed_single_offender_id_from_prisonerlocation'),
+    ]
+    operations = [
+        migrations.RunPython(
+            schedule_update_credit_prisons,
+            reverse_code=unschedule_update_credit_prisons,
+        )
+    ]
@@ -7,6 +7,8 @@ from django.utils.translation import gettext_lazy as _
 
 from model_utils.models import TimeStampedModel
 
+from prison.managers import PrisonerLocationManager
+
 validate_prisoner_number = RegexValidator(r'^[A-Z]\d{4}[A-Z]{2}$', message=_('Invalid prisoner number'))
 
 
@@ -108,6 +110,8 @@ class PrisonerLocation(TimeStampedModel):
     prison = models.ForeignKey(Prison, on_delete=models.CASCADE)
     active = models.BooleanField(default=False, db_index=True)
 
+    objects = PrisonerLocationManager()
+
     class Meta:
         index_together = (
             ('prisoner_number', 'prisoner_dob'),
@@ -59,17 +59,36 @@ class PrisonSerializer(serializers.ModelSerializer):
         )
 
 
+class PrisonIdField(serializers.CharField):
+    """
+    Validates a prison id against the set of all ids rather than fetching the prison for every row;
+    the set is loaded once per request as one field instance validates every row of a list
+    """
+    default_error_messages = {
+        'does_not_exist': _('No prison found with code "{pk_value}"'),
+    }
+    nomis_ids = None
+
+    def to_internal_value(self, data):
+        data = super().to_internal_value(data)
+        if self.nomis_ids is None:
+            self.nomis_ids = frozenset(Prison.objects.values_list('pk', flat=True))
+        if data not in self.nomis_ids:
+            self.fail('does_not_exist', pk_value=data)
+        return data
+
+
 class PrisonerLocationListSerializer(serializers.ListSerializer):
     @transaction.atomic
     def create(self, validated_data):
-        locations = [
-            PrisonerLocation(**item) for item in validated_data
-        ]
-        objects = PrisonerLocation.objects.bulk_create(locations)
-        return objects
+        # validated dicts are returned in place of instances as they represent the same fields
+        PrisonerLocation.objects.copy_new_locations(validated_data)
+        return validated_data
 
 
 class PrisonerLocationSerializer(serializers.ModelSerializer):
+    prison = PrisonIdField(source='prison_id')
+
     class Meta:
         model = PrisonerLocation
         list_serializer_class = PrisonerLocationListSerializer
@@ -79,13 +98,6 @@ class PrisonerLocationSerializer(serializers.ModelSerializer):
             'prisoner_dob',
             'prison',
         )
-        extra_kwargs = {
-            'prison': {
-                'error_messages': {
-                    'does_not_exist': _('No prison found with code "{pk_value}"')
-                }
-            }
-        }
 
 
 class PrisonerValiditySerializer(serializers.ModelSerializer):
@@ -4,6 +4,7 @@ from unittest import mock
 
 from django.conf import settings
 from django.core.cache import cache
+from django.db import DatabaseError
 from django.test import override_settings
 from django.urls import reverse
 from django.utils.dateformat import format as format_date
@@ -184,6 +185,60 @@ class PrisonerLocationViewTestCase(AuthTestCaseMixin, APITestCase):
                 0
             )
 
+    def test_create_preserves_blank_and_quoted_names(self):
+        data = [
+            {
+                'prisoner_name': '',
+                'prisoner_number': random_prisoner_number(),
+                'prisoner_dob': random_prisoner_dob(),
+                'prison': self.prisons[0].pk
+            },
+            {
+                'prisoner_name': 'JAMES "JIM" O\'HALLS, JR',
+                'prisoner_number': random_prisoner_number(),
+                'prisoner_dob': random_prisoner_dob(),
+                'prison': self.prisons[1].pk
+            },
+        ]
+        response = self.client.post(
+            self.list_url, data=data, format='json',
+            HTTP_AUTHORIZATION=self.get_http_authorization_for_user(self.prisoner_location_admins[0])
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[1]['prison'], self.prisons[1].pk)
+
+        latest_created = PrisonerLocation.objects.filter(active=False)
+        self.assertEqual(latest_created.count(), 2)
+        for item in data:
+            location = latest_created.get(**item)
+            self.assertEqual(location.created_by, self.prisoner_location_admins[0])
+            self.assertIsNotNone(location.created)
+
+    def test_copy_new_locations_without_creator(self):
+        location = {
+            'prisoner_name': random_prisoner_name(),
+            'prisoner_number': random_prisoner_number(),
+            'prisoner_dob': random_prisoner_dob(),
+            'prison_id': self.prisons[0].pk,
+        }
+        self.assertEqual(PrisonerLocation.objects.copy_new_locations([location]), 1)
+        self.assertIsNone(PrisonerLocation.objects.get(active=False, **location).created_by)
+
+    def test_create_in_new_prison(self):
+        prison = mommy.make(Prison, nomis_id='ZZZ')
+        response = self.client.post(
+            self.list_url, data=[{
+                'prisoner_name': random_prisoner_name(),
+                'prisoner_number': random_prisoner_number(),
+                'prisoner_dob': random_prisoner_dob(),
+                'prison': prison.pk,
+            }], format='json',
+            HTTP_AUTHORIZATION=self.get_http_authorization_for_user(self.prisoner_location_admins[0])
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PrisonerLocation.objects.filter(prison=prison).count(), 1)
+
     def _test_validation_error(self, data, assert_error_msg):
         response = self.client.post(
             self.list_url, data=data, format='json',
@@ -307,16 +362,44 @@ class DeleteOldPrisonerLocationsViewTestCase(AuthTestCaseMixin, APITestCase):
 
     @mock.patch('prison.views.prisoner_profile_current_prisons_need_updating')
     @mock.patch('prison.views.credit_prisons_need_updating')
+    @mock.patch('prison.views.transaction.on_commit')
     def test_delete_old_sends_prisons_need_updating_signals(
-        self, mocked_credit_prisons_need_updating, mocked_prisoner_profiles_need_updating
+        self, mocked_on_commit, mocked_credit_prisons_need_updating, mocked_prisoner_profiles_need_updating
+    ):
+        removed_prisoner_keys = set(PrisonerLocation.objects.values_list('prisoner_number', 'prisoner_dob'))
+        response = self.client.post(
+            self.url, format='json',
+            HTTP_AUTHORIZATION=self.get_http_authorization_for_user(self.prisoner_location_admins[0])
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        # credit prisons are only updated once the transaction commits
+        mocked_credit_prisons_need_updating.send.assert_not_called()
+        mocked_prisoner_profiles_need_updating.send.assert_not_called()
+        self.assertEqual(mocked_on_commit.call_count, 1)
+        mocked_on_commit.call_args[0][0]()
+        mocked_credit_prisons_need_updating.send.assert_called_with(
+            sender=PrisonerLocation, changed_prisoner_keys=removed_prisoner_keys
+        )
+        mocked_prisoner_profiles_need_updating.send.assert_called_with(sender=PrisonerLocation)
+
+    @mock.patch('prison.views.prisoner_profile_current_prisons_need_updating')
+    @mock.patch('prison.views.credit_prisons_need_updating')
+    @mock.patch('prison.views.transaction.on_commit')
+    def test_delete_old_logs_errors_updating_prisons(
+        self, mocked_on_commit, mocked_credit_prisons_need_updating, mocked_prisoner_profiles_need_updating
     ):
+        mocked_credit_prisons_need_updating.send.side_effect = DatabaseError
         response = self.client.post(
             self.url, format='json',
             HTTP_AUTHORIZATION=self.get_http_authorization_for_user(self.prisoner_location_admins[0])
         )
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
-        mocked_credit_prisons_need_updating.send.assert_called_with(sender=PrisonerLocation)
+        # new locations are committed by the time credit prisons are updated so errors are only logged
+        with self.assertLogs('mtp', level='ERROR') as logs:
+            mocked_on_commit.call_args[0][0]()
+        self.assertTrue(any('Could not update credit prisons' in line for line in logs.output))
         mocked_prisoner_profiles_need_updating.send.assert_called_with(sender=PrisonerLocation)
 
 
@@ -63,9 +63,9 @@ class PrisonerLocationView(
 
     def check_object_permissions(self, request, obj):
         super().check_object_permissions(request, obj)
-        if obj.prison not in PrisonUserMapping.objects.get_prison_set_for_user(
+        if not PrisonUserMapping.objects.get_prison_set_for_user(
             self.request.user
-        ):
+        ).filter(pk=obj.prison_id).exists():
             self.permission_denied(
                 request,
                 message=_(
@@ -87,12 +87,23 @@ class DeleteOldPrisonerLocationsView(generics.GenericAPIView):
 
     @transaction.atomic
     def post(self, request, *args, **kwargs):
-        self.get_queryset().filter(active=True).delete()
-        self.get_queryset().filter(active=False).update(active=True)
-        credit_prisons_need_updating.send(sender=PrisonerLocation)
-        prisoner_profile_current_prisons_need_updating.send(sender=PrisonerLocation)
+        changed_prisoner_keys = PrisonerLocation.objects.activate_new_locations()
+        # credits are updated once new locations are committed so that each chunk of credits is locked only briefly
+        transaction.on_commit(lambda: self.locations_changed(changed_prisoner_keys))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def locations_changed(self, changed_prisoner_keys):
+        # new locations are already committed so errors are logged rather than returned to the client;
+        # credits left unmatched are picked up by the scheduled `update_credit_prisons` command
+        try:
+            credit_prisons_need_updating.send(sender=PrisonerLocation, changed_prisoner_keys=changed_prisoner_keys)
+        except Exception:
+            logger.exception('Could not update credit prisons after prisoner locations changed')
+        try:
+            prisoner_profile_current_prisons_need_updating.send(sender=PrisonerLocation)
+        except Exception:
+            logger.exception('Could not schedule updating prisoner profile prisons after prisoner locations changed')
+
 
 class DeleteInactivePrisonerLocationsView(generics.GenericAPIView):
     queryset = PrisonerLocation.objects.filter(active=False)
@@ -7,3 +7,14 @@ CHECK_STATUS = Choices(
     ('ACCEPTED', 'accepted', gettext_lazy('Accepted')),
     ('REJECTED', 'rejected', gettext_lazy('Rejected')),
 )
+
+PROFILE_TYPE = Choices(
+    ('SENDER', 'sender', gettext_lazy('Sender')),
+    ('PRISONER', 'prisoner', gettext_lazy('Prisoner')),
+    ('RECIPIENT', 'recipient', gettext_lazy('Recipient')),
+)
+
+ACTIVITY_RECORD_TYPE = Choices(
+    ('CREDIT', 'credit', gettext_lazy('Credit')),
+    ('DISBURSEMENT', 'disbursement', gettext_lazy('Disbursement')),
+)
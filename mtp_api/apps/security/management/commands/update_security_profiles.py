@@ -1,8 +1,13 @@
+import contextlib
 import logging
+import multiprocessing
 
+from django.db import connection, connections
+from django.db.models.functions import Mod
 from django.db.transaction import atomic
 from django.core.management import BaseCommand, CommandError
 
+from core.models import BatchCheckpoint
 from credit.constants import CREDIT_RESOLUTION
 from credit.models import Credit
 from disbursement.constants import DISBURSEMENT_RESOLUTION
@@ -20,6 +25,10 @@ class Command(BaseCommand):
                             help='Number of objects to process in one atomic transaction')
         parser.add_argument('--recalculate-totals', action='store_true', help='Recalculates the counts and totals only')
         parser.add_argument('--recreate', action='store_true', help='Deletes existing profiles')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes to split profile total updates across')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignores progress recorded by interrupted runs of --recalculate-totals')
 
     def handle(self, **options):
         if options['recalculate_totals'] and options['recreate']:
@@ -28,61 +37,127 @@ class Command(BaseCommand):
         batch_size = options['batch_size']
         if batch_size < 1:
             raise CommandError('Batch size must be at least 1')
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('Number of workers must be at least 1')
 
         if options['recalculate_totals']:
-            self.handle_totals(batch_size=batch_size)
+            self.handle_totals(batch_size=batch_size, restart=options['restart'])
         else:
-            self.handle_update(batch_size=batch_size, recreate=options['recreate'])
+            self.handle_update(batch_size=batch_size, recreate=options['recreate'], workers=workers)
 
-    def handle_update(self, batch_size, recreate):
+    def handle_update(self, batch_size, recreate, workers=1):
         if recreate:
             self.delete_profiles()
 
         try:
-            self.handle_credit_update(batch_size)
-            self.handle_disbursement_update(batch_size)
+            self.handle_credit_update(batch_size, workers)
+            with self.exclusive_step('disbursements') as locked:
+                if locked:
+                    self.handle_disbursement_update(batch_size)
         finally:
             self.stdout.write('Updating prisoner profiles for current locations')
             PrisonerProfile.objects.update_current_prisons()
 
-    def handle_credit_update(self, batch_size):
+    def handle_credit_update(self, batch_size, workers=1):
         # TODO Remove below function once the logs show that it consistently
         # does not operate on any credits, and once bank transfers have been deprecated
-        self.handle_profile_attachment_for_legacy_credits(batch_size)
-        self.handle_credit_update_for_attached_prisoner_profiles(batch_size)
-        self.handle_credit_update_for_attached_sender_profiles(batch_size)
+        with self.exclusive_step('new credits') as locked:
+            if locked:
+                self.handle_profile_attachment_for_legacy_credits(batch_size)
+        if workers > 1:
+            self.handle_credit_update_in_workers(batch_size, workers)
+        else:
+            self.handle_credit_update_for_attached_profiles(batch_size)
+
+    @contextlib.contextmanager
+    def exclusive_step(self, entity_model_name_plural):
+        """
+        Holds a PostgreSQL advisory lock while a step that creates profiles runs so that only one concurrently-running
+        command does it; these steps cannot claim rows individually because different credits or disbursements
+        can create the same profile. Yields whether the lock was obtained, otherwise the step should be skipped
+        and is left to the command already running it.
+        """
+        lock_name = self.get_checkpoint_name(entity_model_name_plural)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(hashtext(%s))', [lock_name])
+            locked = cursor.fetchone()[0]
+        if not locked:
+            self.stdout.write(f'Skipping {entity_model_name_plural} as they are being updated by another process')
+        try:
+            yield locked
+        finally:
+            if locked:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(hashtext(%s))', [lock_name])
+
+    def handle_credit_update_in_workers(self, batch_size, workers):
+        # forked processes must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=self.run_credit_update_worker, args=(batch_size, (worker, workers)))
+            for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        failed_workers = [worker for worker, process in enumerate(processes) if process.exitcode != 0]
+        if failed_workers:
+            raise CommandError(f'Workers {failed_workers} failed to update profile totals')
+
+    def run_credit_update_worker(self, batch_size, shard):
+        try:
+            self.handle_credit_update_for_attached_profiles(batch_size, shard)
+        finally:
+            connections.close_all()
+
+    def handle_credit_update_for_attached_profiles(self, batch_size, shard=None):
+        """
+        Updates prisoner and sender profile totals
+        :param shard: optional (index, count) pair to only process profiles whose id falls in this shard
+        """
+        self.handle_credit_update_for_attached_prisoner_profiles(batch_size, shard)
+        self.handle_credit_update_for_attached_sender_profiles(batch_size, shard)
+
+    def filter_shard(self, profiles, shard):
+        if not shard:
+            return profiles
+        index, count = shard
+        return profiles.annotate(shard=Mod('pk', count)).filter(shard=index)
 
     def handle_profile_attachment_for_legacy_credits(self, batch_size):
         # Implicit filter on resolution not in initial / failed through CompletedCreditManager.get_queryset()
         new_credits = Credit.objects.filter(
             sender_profile__isnull=True
-        ).order_by('pk')
+        )
         self.batch_and_execute_entity_calculation(
             new_credits, 'new credits', self.attach_profiles_for_legacy_credits, batch_size
         )
 
-    def handle_credit_update_for_attached_prisoner_profiles(self, batch_size):
+    def handle_credit_update_for_attached_prisoner_profiles(self, batch_size, shard=None):
         # Now that we have the association between prisoner_profile/prisoner_profile populated, it makes sense to run
         # this job once per prisoner/prisoner profile instead of once per credit
 
         # The reason why we're using is_counted_in_sender_profile_total is because sender_profile will always be able
         # to be associated, therefore if the sender profile is not associated we know it also needs a prisoner profile
-        prisoner_profiles = PrisonerProfile.objects.filter(
+        prisoner_profiles = self.filter_shard(PrisonerProfile.objects.filter(
             credits__is_counted_in_prisoner_profile_total=False,
             credits__resolution=CREDIT_RESOLUTION.CREDITED
-        ).order_by('pk').values_list('pk', flat=True)
+        ), shard)
         self.batch_and_execute_entity_calculation(
             prisoner_profiles, 'prisoner profiles', self.calculate_credit_totals_for_prisoner_profiles, batch_size,
             granular_entity='credits'
         )
 
-    def handle_credit_update_for_attached_sender_profiles(self, batch_size):
+    def handle_credit_update_for_attached_sender_profiles(self, batch_size, shard=None):
         # Now that we have the association between sender_profile/sender_profile populated, it makes sense to run
         # this job once per sender/sender profile instead of once per credit
-        sender_profiles = SenderProfile.objects.filter(
+        sender_profiles = self.filter_shard(SenderProfile.objects.filter(
             credits__is_counted_in_sender_profile_total=False,
             credits__resolution=CREDIT_RESOLUTION.CREDITED
-        ).order_by('pk').values_list('pk', flat=True)
+        ), shard)
         self.batch_and_execute_entity_calculation(
             sender_profiles, 'sender profiles', self.calculate_credit_totals_for_sender_profiles, batch_size,
             granular_entity='credits'
@@ -91,64 +166,82 @@ class Command(BaseCommand):
     def batch_and_execute_entity_calculation(
         self, entities, entity_model_name_plural, calculate_entity_totals_fn, batch_size, granular_entity=None
     ):
-        def chunker(initial, n):
-            """Yield successive n-sized chunks from lst."""
-            for i in range(0, len(initial), n):
-                yield initial[i:i + n]
-
-        entities_count = entities.count()
+        entities_count = entities.values('pk').distinct().count()
         if not entities_count:
             self.stdout.write(self.style.SUCCESS(f'No {entity_model_name_plural} require updating'))
             return
         else:
             self.stdout.write(f'Updating {entities_count} {entity_model_name_plural}')
 
-        # We prefetch the query and load into memory to avoid any infinite loops.
-        for entity_slice in list(chunker(entities, batch_size)):
-            count = calculate_entity_totals_fn(entity_slice)
-            processed_log_msg = f'Processed {batch_size} {entity_model_name_plural}'
+        # Batches are lists of primary keys found by seeking past the previous batch so that entities which stop
+        # matching once processed do not shift later batches; progress is not checkpointed because processed
+        # entities stop matching anyway so the next run (possibly concurrent) picks up whatever remains
+        batches = BatchCheckpoint.objects.iterate(entities, batch_size)
+        for entity_pks in batches:
+            count = calculate_entity_totals_fn(entity_pks)
+            processed_log_msg = f'Processed {len(entity_pks)} {entity_model_name_plural}'
             if granular_entity:
                 processed_log_msg += f' for {count} new {granular_entity}'
             self.stdout.write(processed_log_msg)
 
         self.stdout.write(self.style.SUCCESS(f'Updated all {entity_model_name_plural}'))
 
+    def get_checkpoint_name(self, entity_model_name_plural):
+        return f'update_security_profiles: {entity_model_name_plural}'
+
+    def delete_checkpoints(self):
+        BatchCheckpoint.objects.filter(name__startswith='update_security_profiles: ').delete()
+
     def handle_disbursement_update(self, batch_size):
         new_disbursements = Disbursement.objects.filter(
             recipient_profile__isnull=True,
             resolution=DISBURSEMENT_RESOLUTION.SENT,
-        ).order_by('pk')
+        )
         self.batch_and_execute_entity_calculation(
             new_disbursements, 'disbursements', self.process_disbursement_batch, batch_size
         )
 
     @atomic()
-    def attach_profiles_for_legacy_credits(self, new_credits):
-        for credit in new_credits:
-            credit.attach_profiles()
+    def attach_profiles_for_legacy_credits(self, new_credit_pks):
+        # bulk equivalent of calling `Credit.attach_profiles` on each credit
+        new_credits = list(
+            Credit.objects.filter(pk__in=new_credit_pks).select_related('transaction', 'payment__billing_address')
+        )
+        PrisonerProfile.objects.create_or_update_for_credits([
+            credit for credit in new_credits
+            if not credit.prisoner_profile_id and credit.prison_id and credit.prisoner_name
+        ])
+        SenderProfile.objects.create_or_update_for_credits([
+            credit for credit in new_credits
+            if not credit.sender_profile_id and credit.has_enough_detail_for_sender_profile()
+        ])
+        PrisonerProfile.objects.add_senders_for_credits(new_credits)
         return len(new_credits)
 
     @atomic()
     def calculate_credit_totals_for_prisoner_profiles(self, prisoner_profiles):
         new_credits = PrisonerProfile.objects.filter(
             pk__in=prisoner_profiles
-        ).recalculate_credit_totals()
+        ).update_credit_totals(skip_locked=True)
         return len(new_credits)
 
     @atomic()
     def calculate_credit_totals_for_sender_profiles(self, sender_profiles):
         new_credits = SenderProfile.objects.filter(
             pk__in=sender_profiles
-        ).recalculate_credit_totals()
+        ).update_credit_totals(skip_locked=True)
 
         # The reason why we dispatched notifications on calculation of sender total and not prisoner is because we
         # don't want to duplicate notifications and because we know that a credit will always
         # have a sender, but potentially may not have a prisoner associated.
+        # Credits are claimed with SKIP LOCKED so concurrent workers or pods never both count the same credit and
+        # notification events are created exactly once, in the same transaction that marks the credit as counted.
         create_notification_events(records=new_credits)
         return len(new_credits)
 
     @atomic()
-    def process_disbursement_batch(self, new_disbursements):
+    def process_disbursement_batch(self, new_disbursement_pks):
+        new_disbursements = Disbursement.objects.filter(pk__in=new_disbursement_pks).order_by('pk')
         recipient_profiles = []
         prisoner_profiles = []
         for disbursement in new_disbursements:
@@ -173,30 +266,40 @@ class Command(BaseCommand):
         prisoner_profile = PrisonerProfile.objects.create_or_update_for_disbursement(disbursement)
         prisoner_profile.recipients.add(recipient_profile)
 
-    def handle_totals(self, batch_size):
+    def handle_totals(self, batch_size, restart=False):
         profiles = (
             (SenderProfile, 'sender'),
             (PrisonerProfile, 'prisoner'),
             (RecipientProfile, 'recipient'),
         )
         for model, name in profiles:
-            queryset = model.objects.order_by('pk').all()
-            count = queryset.count()
-            if not count:
-                self.stdout.write(self.style.SUCCESS(f'No {name} profiles to update'))
-                return
-            else:
-                self.stdout.write(f'Updating {count} {name} profile totals')
-
-            processed_count = 0
-            for offset in range(0, count, batch_size):
-                batch = slice(offset, min(offset + batch_size, count))
-                queryset[batch].recalculate_totals()
-                processed_count += batch_size
-                self.stdout.write(f'Processed up to {processed_count} {name} profiles')
+            # the checkpoint is only used by the process holding the lock so a concurrent run cannot resume from it
+            with self.exclusive_step(f'{name} profile totals') as locked:
+                if locked:
+                    self.recalculate_profile_totals(model, name, batch_size, restart)
 
         self.stdout.write(self.style.SUCCESS('Done'))
 
+    def recalculate_profile_totals(self, model, name, batch_size, restart=False):
+        checkpoint_name = self.get_checkpoint_name(f'{name} profile totals')
+        if restart:
+            BatchCheckpoint.objects.filter(name=checkpoint_name).delete()
+
+        queryset = model.objects.all()
+        count = queryset.count()
+        if not count:
+            self.stdout.write(self.style.SUCCESS(f'No {name} profiles to update'))
+            return
+        else:
+            self.stdout.write(f'Updating {count} {name} profile totals')
+
+        processed_count = 0
+        batches = BatchCheckpoint.objects.iterate(queryset, batch_size, name=checkpoint_name)
+        for profile_pks in batches:
+            model.objects.filter(pk__in=profile_pks).recalculate_totals()
+            processed_count += len(profile_pks)
+            self.stdout.write(f'Processed up to {processed_count} {name} profiles')
+
     @atomic()
     def delete_profiles(self):
         from django.apps import apps
@@ -206,6 +309,7 @@ class Command(BaseCommand):
         PrisonerProfile.objects.all().delete()
         SenderProfile.objects.all().delete()
         RecipientProfile.objects.all().delete()
+        self.delete_checkpoints()
 
         security_app = apps.app_configs['security']
         with connection.cursor() as cursor:
@@ -3,6 +3,7 @@ import logging
 from django.db import connection, models, transaction
 from django.db.models import Count, Sum, Subquery, OuterRef, Q
 from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 
 from credit.models import Credit
 
@@ -26,6 +27,18 @@ class PrisonerProfileManager(models.Manager):
                 'WHERE security_prisonerprofile.id = pp.id '
             )
 
+    def get_monitoring_user_ids(self, profile_ids):
+        """
+        Bulk equivalent of `PrisonerProfile.get_monitoring_users`
+        :return: dict of profile id to set of user ids
+        """
+        monitoring_user_ids = {profile_id: set() for profile_id in profile_ids}
+        rows = self.filter(pk__in=profile_ids).order_by().values_list('pk', 'monitoring_users')
+        for profile_id, user_id in rows:
+            if user_id is not None:
+                monitoring_user_ids[profile_id].add(user_id)
+        return monitoring_user_ids
+
     def get_for_credit(self, credit):
         if credit.prisoner_profile:
             return credit.prisoner_profile
@@ -58,6 +71,94 @@ class PrisonerProfileManager(models.Manager):
         logger.info('Attached prisoner profile %s to credit %s', prisoner_profile, credit)
         return prisoner_profile
 
+    def create_or_update_for_credits(self, credits):
+        """
+        Bulk equivalent of `create_or_update_for_credit` which resolves prisoner profiles for a batch of credits
+        using a fixed number of queries regardless of the batch size
+        NB: credits should have their payments selected
+        """
+        from credit.models import Credit
+        from security.models import ProvidedPrisonerName
+
+        assert all(credit.prison_id for credit in credits), 'Credit does not have a known prisoner'
+        if not credits:
+            return
+
+        latest_credits = {}
+        for credit in sorted(credits, key=lambda credit: credit.pk):
+            latest_credits[credit.prisoner_number] = credit
+
+        prisoner_profiles = {}
+        for prisoner_profile in self.filter(prisoner_number__in=latest_credits.keys()).order_by('pk'):
+            prisoner_profiles.setdefault(prisoner_profile.prisoner_number, prisoner_profile)
+        modified = now()
+        for prisoner_number, prisoner_profile in prisoner_profiles.items():
+            credit = latest_credits[prisoner_number]
+            prisoner_profile.prisoner_name = credit.prisoner_name
+            prisoner_profile.prisoner_dob = credit.prisoner_dob
+            prisoner_profile.modified = modified
+        self.bulk_update(prisoner_profiles.values(), ['prisoner_name', 'prisoner_dob', 'modified'])
+        new_prisoner_profiles = self.bulk_create(
+            self.model(
+                prisoner_number=prisoner_number,
+                prisoner_name=credit.prisoner_name,
+                prisoner_dob=credit.prisoner_dob,
+            )
+            for prisoner_number, credit in latest_credits.items()
+            if prisoner_number not in prisoner_profiles
+        )
+        prisoner_profiles.update(
+            (prisoner_profile.prisoner_number, prisoner_profile)
+            for prisoner_profile in new_prisoner_profiles
+        )
+
+        provided_names = set(
+            (prisoner_profiles[credit.prisoner_number].pk, credit.payment.recipient_name)
+            for credit in credits
+            if hasattr(credit, 'payment') and credit.payment.recipient_name
+        )
+        provided_names -= set(ProvidedPrisonerName.objects.filter(
+            prisoner__in=[prisoner_profile.pk for prisoner_profile in prisoner_profiles.values()],
+        ).values_list('prisoner_id', 'name'))
+        ProvidedPrisonerName.objects.bulk_create(
+            ProvidedPrisonerName(prisoner_id=prisoner_id, name=name)
+            for prisoner_id, name in provided_names
+        )
+
+        PrisonerProfilePrisons = self.model.prisons.through
+        PrisonerProfilePrisons.objects.bulk_create(
+            (
+                PrisonerProfilePrisons(prisonerprofile_id=prisonerprofile_id, prison_id=prison_id)
+                for prisonerprofile_id, prison_id in set(
+                    (prisoner_profiles[credit.prisoner_number].pk, credit.prison_id)
+                    for credit in credits
+                )
+            ),
+            ignore_conflicts=True,
+        )
+
+        for credit in credits:
+            credit.prisoner_profile = prisoner_profiles[credit.prisoner_number]
+        Credit.objects_all.bulk_update(credits, ['prisoner_profile'])
+        logger.info('Attached prisoner profiles to %d credits', len(credits))
+
+    def add_senders_for_credits(self, credits):
+        """
+        Bulk equivalent of `PrisonerProfile.add_sender` linking the prisoner and sender profiles of each credit
+        """
+        PrisonerProfileSenders = self.model.senders.through
+        PrisonerProfileSenders.objects.bulk_create(
+            (
+                PrisonerProfileSenders(prisonerprofile_id=prisonerprofile_id, senderprofile_id=senderprofile_id)
+                for prisonerprofile_id, senderprofile_id in set(
+                    (credit.prisoner_profile_id, credit.sender_profile_id)
+                    for credit in credits
+                    if credit.prisoner_profile_id and credit.sender_profile_id
+                )
+            ),
+            ignore_conflicts=True,
+        )
+
     def create_or_update_for_disbursement(self, disbursement):
         from prison.models import PrisonerLocation
 
@@ -103,6 +204,31 @@ class SenderProfileManager(models.Manager):
         except self.model.DoesNotExist:
             return self.create()
 
+    def get_monitoring_user_ids(self, profile_ids):
+        """
+        Bulk equivalent of `SenderProfile.get_monitoring_users`
+        :return: dict of profile id to set of user ids
+        """
+        profiles = self.filter(pk__in=profile_ids)
+        monitoring_user_ids = get_first_details_monitoring_user_ids(
+            profiles.order_by(
+                'pk', 'debit_card_details__created', 'debit_card_details__pk',
+            ).values_list('pk', 'debit_card_details__pk', 'debit_card_details__monitoring_users')
+        )
+        profiles_without_debit_cards = set(profile_ids) - set(monitoring_user_ids)
+        if profiles_without_debit_cards:
+            monitoring_user_ids.update(get_first_details_monitoring_user_ids(
+                profiles.filter(pk__in=profiles_without_debit_cards).order_by(
+                    'pk', 'bank_transfer_details__created', 'bank_transfer_details__pk',
+                ).values_list(
+                    'pk', 'bank_transfer_details__pk', 'bank_transfer_details__sender_bank_account__monitoring_users',
+                )
+            ))
+        return {
+            profile_id: monitoring_user_ids.get(profile_id, set())
+            for profile_id in profile_ids
+        }
+
     def get_for_credit(self, credit):
         if credit.sender_profile:
             return credit.sender_profile
@@ -152,6 +278,180 @@ class SenderProfileManager(models.Manager):
         logger.info('Attached sender profile %s to credit %s', sender_profile, credit)
         return sender_profile
 
+    def create_or_update_for_credits(self, credits):
+        """
+        Bulk equivalent of `create_or_update_for_credit` which resolves sender profiles for a batch of credits
+        using a fixed number of queries regardless of the batch size
+        NB: credits should have their transactions and payments with billing addresses selected
+        """
+        from credit.constants import CREDIT_RESOLUTION
+        from credit.models import Credit
+
+        if not credits:
+            return
+
+        bank_transfer_credits = []
+        debit_card_credits = []
+        sender_profiles = {}
+        for credit in credits:
+            if hasattr(credit, 'transaction'):
+                bank_transfer_credits.append(credit)
+            elif hasattr(credit, 'payment'):
+                debit_card_credits.append(credit)
+            else:
+                logger.error(f'Credit {credit.pk} does not have a payment nor transaction')
+                sender_profiles[credit.pk] = self.get_or_create_anonymous_sender()
+        sender_profiles.update(self._create_or_update_for_bank_transfers(bank_transfer_credits))
+        sender_profiles.update(self._create_or_update_for_debit_cards(debit_card_credits))
+
+        # see `create_or_update_for_credit` regarding failed credits
+        SenderProfilePrisons = self.model.prisons.through
+        SenderProfilePrisons.objects.bulk_create(
+            (
+                SenderProfilePrisons(senderprofile_id=senderprofile_id, prison_id=prison_id)
+                for senderprofile_id, prison_id in set(
+                    (sender_profiles[credit.pk].pk, credit.prison_id)
+                    for credit in credits
+                    if credit.prison_id and credit.resolution != CREDIT_RESOLUTION.FAILED
+                )
+            ),
+            ignore_conflicts=True,
+        )
+
+        for credit in credits:
+            credit.sender_profile = sender_profiles[credit.pk]
+        Credit.objects_all.bulk_update(credits, ['sender_profile'])
+        logger.info('Attached sender profiles to %d credits', len(credits))
+
+    def _create_or_update_for_bank_transfers(self, credits):
+        from security.models import BankAccount, BankTransferSenderDetails
+
+        if not credits:
+            return {}
+
+        def get_bank_account_key(credit):
+            return credit.sender_sort_code, credit.sender_account_number, credit.sender_roll_number or ''
+
+        bank_account_keys = set(map(get_bank_account_key, credits))
+        BankAccount.objects.bulk_create(
+            (
+                BankAccount(sort_code=sort_code, account_number=account_number, roll_number=roll_number)
+                for sort_code, account_number, roll_number in bank_account_keys
+            ),
+            ignore_conflicts=True,
+        )
+        bank_accounts = {
+            (bank_account.sort_code, bank_account.account_number, bank_account.roll_number): bank_account
+            for bank_account in BankAccount.objects.filter(
+                sort_code__in={key[0] for key in bank_account_keys},
+                account_number__in={key[1] for key in bank_account_keys},
+            )
+        }
+
+        def get_sender_key(credit):
+            return credit.sender_name, bank_accounts[get_bank_account_key(credit)].pk
+
+        sender_details = {}
+        for details in BankTransferSenderDetails.objects.filter(
+            sender_bank_account__in=[bank_accounts[key] for key in bank_account_keys],
+        ).select_related('sender').order_by('pk'):
+            sender_details.setdefault((details.sender_name, details.sender_bank_account_id), details)
+        new_sender_keys = set(map(get_sender_key, credits)) - set(sender_details)
+        new_sender_profiles = self.bulk_create(self.model() for _ in new_sender_keys)
+        new_sender_details = BankTransferSenderDetails.objects.bulk_create(
+            BankTransferSenderDetails(
+                sender_name=sender_name,
+                sender_bank_account_id=bank_account_id,
+                sender=sender_profile,
+            )
+            for (sender_name, bank_account_id), sender_profile in zip(new_sender_keys, new_sender_profiles)
+        )
+        sender_details.update(
+            ((details.sender_name, details.sender_bank_account_id), details)
+            for details in new_sender_details
+        )
+
+        return {
+            credit.pk: sender_details[get_sender_key(credit)].sender
+            for credit in credits
+        }
+
+    def _create_or_update_for_debit_cards(self, credits):
+        from payment.models import BillingAddress
+        from security.models import CardholderName, DebitCardSenderDetails, SenderEmail
+
+        if not credits:
+            return {}
+
+        def get_debit_card_key(credit):
+            billing_address = credit.payment.billing_address
+            normalised_postcode = billing_address.normalised_postcode if billing_address else None
+            return credit.card_number_last_digits, credit.card_expiry_date, normalised_postcode
+
+        debit_card_keys = set(map(get_debit_card_key, credits))
+        debit_card_details = {}
+        for details in DebitCardSenderDetails.objects.filter(
+            card_number_last_digits__in={key[0] for key in debit_card_keys},
+        ).select_related('sender').order_by('pk'):
+            key = (details.card_number_last_digits, details.card_expiry_date, details.postcode)
+            if key in debit_card_keys:
+                debit_card_details.setdefault(key, details)
+        new_debit_card_keys = debit_card_keys - set(debit_card_details)
+        new_sender_profiles = self.bulk_create(self.model() for _ in new_debit_card_keys)
+        new_debit_card_details = DebitCardSenderDetails.objects.bulk_create(
+            DebitCardSenderDetails(
+                card_number_last_digits=card_number_last_digits,
+                card_expiry_date=card_expiry_date,
+                postcode=postcode,
+                sender=sender_profile,
+            )
+            for (card_number_last_digits, card_expiry_date, postcode), sender_profile
+            in zip(new_debit_card_keys, new_sender_profiles)
+        )
+        debit_card_details.update(
+            ((details.card_number_last_digits, details.card_expiry_date, details.postcode), details)
+            for details in new_debit_card_details
+        )
+
+        debit_card_details_ids = [details.pk for details in debit_card_details.values()]
+        cardholder_names = set(
+            (debit_card_details[get_debit_card_key(credit)].pk, credit.payment.cardholder_name)
+            for credit in credits
+            if credit.payment.cardholder_name
+        )
+        cardholder_names -= set(CardholderName.objects.filter(
+            debit_card_sender_details__in=debit_card_details_ids,
+        ).values_list('debit_card_sender_details_id', 'name'))
+        CardholderName.objects.bulk_create(
+            CardholderName(debit_card_sender_details_id=details_id, name=name)
+            for details_id, name in cardholder_names
+        )
+        sender_emails = set(
+            (debit_card_details[get_debit_card_key(credit)].pk, credit.payment.email)
+            for credit in credits
+            if credit.payment.email
+        )
+        sender_emails -= set(SenderEmail.objects.filter(
+            debit_card_sender_details__in=debit_card_details_ids,
+        ).values_list('debit_card_sender_details_id', 'email'))
+        SenderEmail.objects.bulk_create(
+            SenderEmail(debit_card_sender_details_id=details_id, email=email)
+            for details_id, email in sender_emails
+        )
+
+        billing_addresses = []
+        for credit in credits:
+            billing_address = credit.payment.billing_address
+            if billing_address:
+                billing_address.debit_card_sender_details = debit_card_details[get_debit_card_key(credit)]
+                billing_addresses.append(billing_address)
+        BillingAddress.objects.bulk_update(billing_addresses, ['debit_card_sender_details'])
+
+        return {
+            credit.pk: debit_card_details[get_debit_card_key(credit)].sender
+            for credit in credits
+        }
+
     def _create_or_update_for_bank_transfer(self, credit):
         from security.models import BankAccount
 
@@ -217,6 +517,23 @@ class RecipientProfileManager(models.Manager):
         except self.model.DoesNotExist:
             return self.create()
 
+    def get_monitoring_user_ids(self, profile_ids):
+        """
+        Bulk equivalent of `RecipientProfile.get_monitoring_users`
+        :return: dict of profile id to set of user ids
+        """
+        monitoring_user_ids = get_first_details_monitoring_user_ids(
+            self.filter(pk__in=profile_ids).order_by(
+                'pk', 'bank_transfer_details__created', 'bank_transfer_details__pk',
+            ).values_list(
+                'pk', 'bank_transfer_details__pk', 'bank_transfer_details__recipient_bank_account__monitoring_users',
+            )
+        )
+        return {
+            profile_id: monitoring_user_ids.get(profile_id, set())
+            for profile_id in profile_ids
+        }
+
     def get_for_disbursement(self, disbursement):
         if disbursement.recipient_profile:
             return disbursement.recipient_profile
@@ -254,6 +571,73 @@ class RecipientProfileManager(models.Manager):
         return recipient_profile
 
 
+def get_first_details_monitoring_user_ids(rows):
+    """
+    Collects monitoring user ids from (profile id, details id, user id) rows ordered by profile and then details
+    keeping only each profile's first details, c.f. `get_monitoring_users` on profile models
+    :return: dict of profile id to set of user ids; profiles without details are absent
+    """
+    first_details_ids = {}
+    monitoring_user_ids = {}
+    for profile_id, details_id, user_id in rows:
+        if details_id is None:
+            continue
+        if first_details_ids.setdefault(profile_id, details_id) != details_id:
+            continue
+        user_ids = monitoring_user_ids.setdefault(profile_id, set())
+        if user_id is not None:
+            user_ids.add(user_id)
+    return monitoring_user_ids
+
+
+def add_uncounted_credits_to_totals(profiles, profile_table, profile_column, counted_column, skip_locked=False):
+    """
+    Adds the count and sum of credited credits not yet counted towards the given profiles' totals
+    and marks those credits as counted in one statement; the row locks taken on the credits
+    ensure that concurrent runs cannot count a credit twice
+    :param skip_locked: leave credits locked by another transaction to a later run instead of waiting
+    :return: queryset of newly-counted credits
+    """
+    from credit.constants import CREDIT_RESOLUTION
+    from credit.models import Credit
+
+    profile_ids = list(profiles.values_list('pk', flat=True))
+    if not profile_ids:
+        return Credit.objects.none()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH claimed_credits AS (
+                SELECT id
+                FROM credit_credit
+                WHERE {profile_column} = ANY(%s) AND resolution = %s AND {counted_column} = false
+                FOR UPDATE {'SKIP LOCKED' if skip_locked else ''}
+            ), new_credits AS (
+                UPDATE credit_credit
+                SET {counted_column} = true
+                FROM claimed_credits
+                WHERE credit_credit.id = claimed_credits.id
+                RETURNING credit_credit.id, credit_credit.{profile_column} AS profile_id, credit_credit.amount
+            ), totals AS (
+                SELECT profile_id, COUNT(*) AS credit_count, SUM(amount) AS credit_total
+                FROM new_credits
+                GROUP BY profile_id
+            ), updated_profiles AS (
+                UPDATE {profile_table}
+                SET credit_count = {profile_table}.credit_count + totals.credit_count,
+                    credit_total = {profile_table}.credit_total + totals.credit_total
+                FROM totals
+                WHERE {profile_table}.id = totals.profile_id
+            )
+            SELECT id FROM new_credits
+            """,
+            (profile_ids, CREDIT_RESOLUTION.CREDITED)
+        )
+        new_credits_ids = [row[0] for row in cursor.fetchall()]
+    return Credit.objects.filter(id__in=new_credits_ids)
+
+
 class PrisonerProfileQuerySet(models.QuerySet):
     def recalculate_totals(self):
         self.recalculate_credit_totals()
@@ -298,6 +682,21 @@ class PrisonerProfileQuerySet(models.QuerySet):
         # objects. If anyone can think of a nicer way to do these please feel free to refactor
         return Credit.objects.filter(id__in=new_credits_ids)
 
+    def update_credit_totals(self, skip_locked=False):
+        """
+        Adds credits not yet counted towards these profiles' totals
+        NB: unlike `recalculate_credit_totals`, this does not rescan each profile's credit history
+        so it relies on existing totals being correct
+        :return: queryset of newly-counted credits
+        """
+        return add_uncounted_credits_to_totals(
+            self,
+            profile_table='security_prisonerprofile',
+            profile_column='prisoner_profile_id',
+            counted_column='is_counted_in_prisoner_profile_total',
+            skip_locked=skip_locked,
+        )
+
     def recalculate_disbursement_totals(self):
         from security.models import PrisonerProfile
 
@@ -362,6 +761,21 @@ class SenderProfileQuerySet(models.QuerySet):
         # objects. If anyone can think of a nicer way to do these please feel free to refactor
         return Credit.objects.filter(id__in=new_credits_ids)
 
+    def update_credit_totals(self, skip_locked=False):
+        """
+        Adds credits not yet counted towards these profiles' totals
+        NB: unlike `recalculate_credit_totals`, this does not rescan each profile's credit history
+        so it relies on existing totals being correct
+        :return: queryset of newly-counted credits
+        """
+        return add_uncounted_credits_to_totals(
+            self,
+            profile_table='security_senderprofile',
+            profile_column='sender_profile_id',
+            counted_column='is_counted_in_sender_profile_total',
+            skip_locked=skip_locked,
+        )
+
 
 class RecipientProfileQuerySet(models.QuerySet):
     def recalculate_totals(self):
@@ -425,12 +839,16 @@ class CheckManager(models.Manager):
         )
 
     def _get_matching_rules(self, credit):
+        """
+        Evaluates enabled rules using their batch implementations, which work from the credit's profile ids
+        without loading each profile, because checks are created synchronously while send-money updates a payment
+        """
         from notification.rules import RULES
 
         matched_rule_codes = []
         for rule_code in self.ENABLED_RULE_CODES:
             rule = RULES[rule_code]
-            if rule.applies_to(credit) and rule.triggered(credit):
+            if rule.applies_to(credit) and rule.triggered_many([credit])[0]:
                 matched_rule_codes.append(rule_code)
         return matched_rule_codes
 
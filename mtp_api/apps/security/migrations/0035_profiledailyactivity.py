@@ -0,0 +1,234 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+from credit.constants import CREDIT_RESOLUTION
+
+# only completed credits are counted, c.f. `CompletedCreditManager`
+INCOMPLETE_CREDIT_RESOLUTIONS = ', '.join(
+    f"'{resolution}'"
+    for resolution in (CREDIT_RESOLUTION.INITIAL, CREDIT_RESOLUTION.FAILED)
+)
+
+# dates are local to the time zone set on each connection, c.f. `core.models.set_database_time_zone`
+CREATE_TRIGGERS = f'''
+CREATE OR REPLACE FUNCTION security_save_profile_activity(
+    _profile_type varchar, _profile_id integer, _record_type varchar, _date date,
+    _record_count integer, _counterparty_ids integer[]
+) RETURNS void AS $$
+BEGIN
+    IF _record_count = 0 THEN
+        DELETE FROM security_profiledailyactivity
+        WHERE profile_type = _profile_type AND profile_id = _profile_id
+        AND record_type = _record_type AND date = _date;
+    ELSE
+        INSERT INTO security_profiledailyactivity
+            (profile_type, profile_id, record_type, date, record_count, counterparty_ids)
+        VALUES (_profile_type, _profile_id, _record_type, _date, _record_count, _counterparty_ids)
+        ON CONFLICT (profile_type, profile_id, record_type, date)
+        DO UPDATE SET record_count = EXCLUDED.record_count, counterparty_ids = EXCLUDED.counterparty_ids;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION security_refresh_credit_activity(
+    _profile_type varchar, _profile_id integer, _received_at timestamp with time zone
+) RETURNS void AS $$
+DECLARE
+    _time_zone text := current_setting('mtp.time_zone');
+    _date date := (_received_at AT TIME ZONE _time_zone)::date;
+    _period_start timestamp with time zone := _date::timestamp AT TIME ZONE _time_zone;
+    _period_end timestamp with time zone := (_date + 1)::timestamp AT TIME ZONE _time_zone;
+    _record_count integer;
+    _counterparty_ids integer[];
+BEGIN
+    IF _profile_id IS NULL OR _received_at IS NULL THEN
+        RETURN;
+    END IF;
+    IF _profile_type = 'sender' THEN
+        SELECT COUNT(*), ARRAY_AGG(DISTINCT prisoner_profile_id) INTO _record_count, _counterparty_ids
+        FROM credit_credit
+        WHERE sender_profile_id = _profile_id
+        AND received_at >= _period_start AND received_at < _period_end
+        AND resolution NOT IN ({INCOMPLETE_CREDIT_RESOLUTIONS});
+    ELSE
+        SELECT COUNT(*), ARRAY_AGG(DISTINCT sender_profile_id) INTO _record_count, _counterparty_ids
+        FROM credit_credit
+        WHERE prisoner_profile_id = _profile_id
+        AND received_at >= _period_start AND received_at < _period_end
+        AND resolution NOT IN ({INCOMPLETE_CREDIT_RESOLUTIONS});
+    END IF;
+    PERFORM security_save_profile_activity(
+        _profile_type, _profile_id, 'credit', _date, _record_count, _counterparty_ids
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION security_refresh_disbursement_activity(
+    _profile_type varchar, _profile_id integer, _created timestamp with time zone
+) RETURNS void AS $$
+DECLARE
+    _time_zone text := current_setting('mtp.time_zone');
+    _date date := (_created AT TIME ZONE _time_zone)::date;
+    _period_start timestamp with time zone := _date::timestamp AT TIME ZONE _time_zone;
+    _period_end timestamp with time zone := (_date + 1)::timestamp AT TIME ZONE _time_zone;
+    _record_count integer;
+    _counterparty_ids integer[];
+BEGIN
+    IF _profile_id IS NULL OR _created IS NULL THEN
+        RETURN;
+    END IF;
+    IF _profile_type = 'recipient' THEN
+        SELECT COUNT(*), ARRAY_AGG(DISTINCT prisoner_profile_id) INTO _record_count, _counterparty_ids
+        FROM disbursement_disbursement
+        WHERE recipient_profile_id = _profile_id
+        AND created >= _period_start AND created < _period_end;
+    ELSE
+        SELECT COUNT(*), ARRAY_AGG(DISTINCT recipient_profile_id) INTO _record_count, _counterparty_ids
+        FROM disbursement_disbursement
+        WHERE prisoner_profile_id = _profile_id
+        AND created >= _period_start AND created < _period_end;
+    END IF;
+    PERFORM security_save_profile_activity(
+        _profile_type, _profile_id, 'disbursement', _date, _record_count, _counterparty_ids
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION security_credit_activity_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM security_refresh_credit_activity('sender', OLD.sender_profile_id, OLD.received_at);
+        PERFORM security_refresh_credit_activity('prisoner', OLD.prisoner_profile_id, OLD.received_at);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM security_refresh_credit_activity('sender', NEW.sender_profile_id, NEW.received_at);
+        PERFORM security_refresh_credit_activity('prisoner', NEW.prisoner_profile_id, NEW.received_at);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION security_disbursement_activity_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM security_refresh_disbursement_activity('recipient', OLD.recipient_profile_id, OLD.created);
+        PERFORM security_refresh_disbursement_activity('prisoner', OLD.prisoner_profile_id, OLD.created);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM security_refresh_disbursement_activity('recipient', NEW.recipient_profile_id, NEW.created);
+        PERFORM security_refresh_disbursement_activity('prisoner', NEW.prisoner_profile_id, NEW.created);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER security_credit_activity
+AFTER INSERT OR DELETE ON credit_credit
+FOR EACH ROW EXECUTE PROCEDURE security_credit_activity_trigger();
+
+CREATE TRIGGER security_credit_activity_update
+AFTER UPDATE OF sender_profile_id, prisoner_profile_id, received_at, resolution ON credit_credit
+FOR EACH ROW WHEN (
+    OLD.sender_profile_id IS DISTINCT FROM NEW.sender_profile_id
+    OR OLD.prisoner_profile_id IS DISTINCT FROM NEW.prisoner_profile_id
+    OR OLD.received_at IS DISTINCT FROM NEW.received_at
+    OR OLD.resolution IS DISTINCT FROM NEW.resolution
+)
+EXECUTE PROCEDURE security_credit_activity_trigger();
+
+CREATE TRIGGER security_disbursement_activity
+AFTER INSERT OR DELETE ON disbursement_disbursement
+FOR EACH ROW EXECUTE PROCEDURE security_disbursement_activity_trigger();
+
+CREATE TRIGGER security_disbursement_activity_update
+AFTER UPDATE OF recipient_profile_id, prisoner_profile_id, created ON disbursement_disbursement
+FOR EACH ROW WHEN (
+    OLD.recipient_profile_id IS DISTINCT FROM NEW.recipient_profile_id
+    OR OLD.prisoner_profile_id IS DISTINCT FROM NEW.prisoner_profile_id
+    OR OLD.created IS DISTINCT FROM NEW.created
+)
+EXECUTE PROCEDURE security_disbursement_activity_trigger();
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER IF EXISTS security_credit_activity ON credit_credit;
+DROP TRIGGER IF EXISTS security_credit_activity_update ON credit_credit;
+DROP TRIGGER IF EXISTS security_disbursement_activity ON disbursement_disbursement;
+DROP TRIGGER IF EXISTS security_disbursement_activity_update ON disbursement_disbursement;
+DROP FUNCTION IF EXISTS security_credit_activity_trigger();
+DROP FUNCTION IF EXISTS security_disbursement_activity_trigger();
+DROP FUNCTION IF EXISTS security_refresh_credit_activity(varchar, integer, timestamp with time zone);
+DROP FUNCTION IF EXISTS security_refresh_disbursement_activity(varchar, integer, timestamp with time zone);
+DROP FUNCTION IF EXISTS security_save_profile_activity(varchar, integer, varchar, date, integer, integer[]);
+'''
+
+POPULATE_ACTIVITY = f'''
+INSERT INTO security_profiledailyactivity
+    (profile_type, profile_id, record_type, date, record_count, counterparty_ids)
+SELECT 'sender', sender_profile_id, 'credit', (received_at AT TIME ZONE current_setting('mtp.time_zone'))::date,
+    COUNT(*), ARRAY_AGG(DISTINCT prisoner_profile_id)
+FROM credit_credit
+WHERE sender_profile_id IS NOT NULL AND received_at IS NOT NULL
+AND resolution NOT IN ({INCOMPLETE_CREDIT_RESOLUTIONS})
+GROUP BY sender_profile_id, (received_at AT TIME ZONE current_setting('mtp.time_zone'))::date;
+
+INSERT INTO security_profiledailyactivity
+    (profile_type, profile_id, record_type, date, record_count, counterparty_ids)
+SELECT 'prisoner', prisoner_profile_id, 'credit', (received_at AT TIME ZONE current_setting('mtp.time_zone'))::date,
+    COUNT(*), ARRAY_AGG(DISTINCT sender_profile_id)
+FROM credit_credit
+WHERE prisoner_profile_id IS NOT NULL AND received_at IS NOT NULL
+AND resolution NOT IN ({INCOMPLETE_CREDIT_RESOLUTIONS})
+GROUP BY prisoner_profile_id, (received_at AT TIME ZONE current_setting('mtp.time_zone'))::date;
+
+INSERT INTO security_profiledailyactivity
+    (profile_type, profile_id, record_type, date, record_count, counterparty_ids)
+SELECT 'recipient', recipient_profile_id, 'disbursement', (created AT TIME ZONE current_setting('mtp.time_zone'))::date,
+    COUNT(*), ARRAY_AGG(DISTINCT prisoner_profile_id)
+FROM disbursement_disbursement
+WHERE recipient_profile_id IS NOT NULL
+GROUP BY recipient_profile_id, (created AT TIME ZONE current_setting('mtp.time_zone'))::date;
+
+INSERT INTO security_profiledailyactivity
+    (profile_type, profile_id, record_type, date, record_count, counterparty_ids)
+SELECT 'prisoner', prisoner_profile_id, 'disbursement', (created AT TIME ZONE current_setting('mtp.time_zone'))::date,
+    COUNT(*), ARRAY_AGG(DISTINCT recipient_profile_id)
+FROM disbursement_disbursement
+WHERE prisoner_profile_id IS NOT NULL
+GROUP BY prisoner_profile_id, (created AT TIME ZONE current_setting('mtp.time_zone'))::date;
+'''
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('credit', '0040_removed_single_offender_id_from_credit'),
+        ('disbursement', '0020_auto_20201007_1448'),
+        ('security', '0034_auto_20210111_1709'),
+    ]
+    operations = [
+        migrations.CreateModel(
+            name='ProfileDailyActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile_type', models.CharField(
+                    choices=[('sender', 'Sender'), ('prisoner', 'Prisoner'), ('recipient', 'Recipient')], max_length=20,
+                )),
+                ('profile_id', models.IntegerField()),
+                ('record_type', models.CharField(
+                    choices=[('credit', 'Credit'), ('disbursement', 'Disbursement')], max_length=20,
+                )),
+                ('date', models.DateField()),
+                ('record_count', models.IntegerField()),
+                ('counterparty_ids', django.contrib.postgres.fields.ArrayField(
+                    base_field=models.IntegerField(null=True), size=None,
+                )),
+            ],
+            options={
+                'verbose_name_plural': 'profile daily activity',
+                'ordering': ('date',),
+                'unique_together': {('profile_type', 'profile_id', 'record_type', 'date')},
+            },
+        ),
+        migrations.RunSQL(sql=CREATE_TRIGGERS, reverse_sql=DROP_TRIGGERS),
+        migrations.RunSQL(sql=POPULATE_ACTIVITY, reverse_sql=migrations.RunSQL.noop),
+    ]
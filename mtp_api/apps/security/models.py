@@ -12,7 +12,7 @@ from model_utils.models import TimeStampedModel
 
 from core.models import ScheduledCommand
 from prison.models import Prison
-from security.constants import CHECK_STATUS
+from security.constants import ACTIVITY_RECORD_TYPE, CHECK_STATUS, PROFILE_TYPE
 from security.managers import (
     PrisonerProfileManager, SenderProfileManager, RecipientProfileManager,
     CheckManager, CheckAutoAcceptRuleManager
@@ -261,6 +261,31 @@ class ProvidedPrisonerName(models.Model):
         return self.name
 
 
+class ProfileDailyActivity(models.Model):
+    """
+    Number of credits or disbursements linked to a profile on a local date along with the distinct counterparty
+    profiles (e.g. senders for a prisoner's credits) involved; used by counting notification rules.
+    NB: rows are maintained by database triggers on credits and disbursements so that they cannot drift
+    regardless of how those records are saved or updated; only completed credits are counted
+    """
+    profile_type = models.CharField(max_length=20, choices=PROFILE_TYPE)
+    profile_id = models.IntegerField()
+    record_type = models.CharField(max_length=20, choices=ACTIVITY_RECORD_TYPE)
+    date = models.DateField()
+    record_count = models.IntegerField()
+    counterparty_ids = ArrayField(models.IntegerField(null=True))
+
+    class Meta:
+        ordering = ('date',)
+        unique_together = (
+            ('profile_type', 'profile_id', 'record_type', 'date'),
+        )
+        verbose_name_plural = 'profile daily activity'
+
+    def __str__(self):
+        return f'{self.profile_type} {self.profile_id} {self.record_type} activity on {self.date}'
+
+
 class SavedSearch(TimeStampedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     description = models.CharField(max_length=255)
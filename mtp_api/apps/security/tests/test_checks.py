@@ -448,6 +448,24 @@ class CreditCheckTestCase(TestCase):
         # credits matching CPNUM will always CSFREQ currently
         self.assertListEqual(sorted(check.rules), ['CPNUM', 'CSFREQ'])
 
+    def test_matching_rules_agree_with_rules_triggered(self):
+        rule = RULES['CSNUM']
+        count = rule.kwargs['limit'] + 1
+        credit_list = make_csnum_credits(timezone.now(), make_prisoner(), count)
+        fiu_user = Group.objects.get(name='FIU').user_set.first()
+        credit_list[-1].prisoner_profile.monitoring_users.add(fiu_user)
+        credit_list[-1].sender_profile.debit_card_details.first().monitoring_users.add(fiu_user)
+
+        for credit in credit_list:
+            expected_rule_codes = [
+                rule_code
+                for rule_code in Check.objects.ENABLED_RULE_CODES
+                if RULES[rule_code].triggered(credit)
+            ]
+            self.assertListEqual(Check.objects._get_matching_rules(credit), expected_rule_codes)
+        self.assertIn('FIUMONP', expected_rule_codes)
+        self.assertIn('CSNUM', expected_rule_codes)
+
 
 class AutomaticCreditCheckTestCase(APITestCase, AuthTestCaseMixin):
     fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
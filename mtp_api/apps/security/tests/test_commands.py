@@ -1,10 +1,14 @@
+from unittest import mock
+
 from django.core.management import call_command
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.utils import timezone
 from django.test.utils import captured_stdout
 
 from mtp_common.test_utils import silence_logger
 
+from core.models import BatchCheckpoint
 from credit.constants import CREDIT_RESOLUTION
 from credit.models import Credit
 from core.tests.utils import make_test_users, delete_non_related_nullable_fields
@@ -21,6 +25,7 @@ from payment.tests.utils import (
 )
 from prison.models import PrisonerLocation, Prison
 from prison.tests.utils import load_random_prisoner_locations
+from security.management.commands.update_security_profiles import Command as UpdateSecurityProfilesCommand
 from security.models import SenderProfile, PrisonerProfile, RecipientProfile
 from transaction.tests.utils import (
     create_transactions, generate_initial_transactions_data, generate_transactions
@@ -28,16 +33,7 @@ from transaction.tests.utils import (
 from transaction.models import Transaction
 
 
-class UpdateSecurityProfilesTestCase(TestCase):
-    fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
-
-    def setUp(self):
-        super().setUp()
-        test_users = make_test_users()
-        self.prison_clerks = test_users['prison_clerks']
-        self.security_staff = test_users['security_staff']
-        load_random_prisoner_locations()
-
+class ProfileCountsTestMixin:
     def _assert_counts(self):
         for sender_profile in SenderProfile.objects.all():
             self.assertEqual(
@@ -103,6 +99,17 @@ class UpdateSecurityProfilesTestCase(TestCase):
             0
         )
 
+
+class UpdateSecurityProfilesTestCase(ProfileCountsTestMixin, TestCase):
+    fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
+
+    def setUp(self):
+        super().setUp()
+        test_users = make_test_users()
+        self.prison_clerks = test_users['prison_clerks']
+        self.security_staff = test_users['security_staff']
+        load_random_prisoner_locations()
+
     @captured_stdout()
     @silence_logger()
     def test_update_security_profiles_initial(self):
@@ -377,6 +384,246 @@ class UpdateSecurityProfilesTestCase(TestCase):
 
         self._assert_counts()
 
+    @captured_stdout()
+    @silence_logger()
+    def test_update_security_profiles_for_legacy_credits(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5, attach_profiles_to_individual_credits=False)
+        self.assertFalse(Credit.objects.filter(sender_profile__isnull=False).exists())
+
+        call_command('update_security_profiles', batch_size=20, verbosity=0)
+        self._assert_counts()
+
+        for credit in Credit.objects.filter(sender_profile__isnull=False):
+            sender_profile = credit.sender_profile
+            if hasattr(credit, 'payment'):
+                debit_card_details = sender_profile.debit_card_details.get()
+                self.assertEqual(debit_card_details.card_number_last_digits, credit.card_number_last_digits)
+                self.assertEqual(debit_card_details.card_expiry_date, credit.card_expiry_date)
+                self.assertEqual(debit_card_details.postcode, credit.billing_address.normalised_postcode)
+                self.assertIn(
+                    credit.payment.cardholder_name,
+                    debit_card_details.cardholder_names.values_list('name', flat=True),
+                )
+                self.assertIn(credit.payment.email, debit_card_details.sender_emails.values_list('email', flat=True))
+                self.assertEqual(credit.billing_address.debit_card_sender_details, debit_card_details)
+            else:
+                bank_transfer_details = sender_profile.bank_transfer_details.get()
+                self.assertEqual(bank_transfer_details.sender_name, credit.sender_name)
+                self.assertEqual(bank_transfer_details.sender_bank_account.sort_code, credit.sender_sort_code)
+                self.assertEqual(
+                    bank_transfer_details.sender_bank_account.account_number, credit.sender_account_number
+                )
+            if credit.prisoner_profile:
+                self.assertEqual(credit.prisoner_profile.prisoner_number, credit.prisoner_number)
+                self.assertIn(credit.prison, credit.prisoner_profile.prisons.all())
+                self.assertIn(sender_profile, credit.prisoner_profile.senders.all())
+                self.assertIn(credit.prison, sender_profile.prisons.all())
+
+    @captured_stdout()
+    @silence_logger()
+    def test_update_security_profiles_only_counts_new_credits(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+        call_command('update_security_profiles', verbosity=0)
+        self._assert_counts()
+
+        # totals are only incremented with credits not yet counted so a second run changes nothing
+        sender_totals = dict(SenderProfile.objects.values_list('pk', 'credit_total'))
+        prisoner_totals = dict(PrisonerProfile.objects.values_list('pk', 'credit_total'))
+        call_command('update_security_profiles', verbosity=0)
+        self.assertDictEqual(dict(SenderProfile.objects.values_list('pk', 'credit_total')), sender_totals)
+        self.assertDictEqual(dict(PrisonerProfile.objects.values_list('pk', 'credit_total')), prisoner_totals)
+
+    @captured_stdout()
+    @silence_logger()
+    def test_recalculate_totals_reconciles_profile_totals(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+        generate_disbursements(disbursement_batch=50, days_of_history=5)
+        call_command('update_security_profiles', verbosity=0)
+
+        SenderProfile.objects.update(credit_count=0, credit_total=0)
+        PrisonerProfile.objects.update(credit_count=0, credit_total=0, disbursement_count=0, disbursement_total=0)
+        RecipientProfile.objects.update(disbursement_count=0, disbursement_total=0)
+
+        call_command('update_security_profiles', recalculate_totals=True, batch_size=7, verbosity=0)
+        self._assert_counts()
+
+    @captured_stdout()
+    @silence_logger()
+    def test_update_security_profiles_in_shards(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+
+        # workers run in forked processes which cannot see this test's transaction, so run each shard in turn
+        command = UpdateSecurityProfilesCommand()
+        command.handle_profile_attachment_for_legacy_credits(batch_size=20)
+        with mock.patch('security.management.commands.update_security_profiles.create_notification_events') as \
+                mocked_create_notification_events:
+            for worker in range(3):
+                command.handle_credit_update_for_attached_profiles(batch_size=20, shard=(worker, 3))
+        self._assert_counts()
+
+        notified_credit_ids = [
+            credit.id
+            for call in mocked_create_notification_events.call_args_list
+            for credit in call[1]['records']
+        ]
+        self.assertEqual(len(notified_credit_ids), len(set(notified_credit_ids)))
+        self.assertEqual(
+            set(notified_credit_ids),
+            set(Credit.objects.filter(
+                resolution=CREDIT_RESOLUTION.CREDITED,
+                sender_profile__isnull=False,
+            ).values_list('id', flat=True))
+        )
+
+    @captured_stdout()
+    @silence_logger()
+    def test_update_security_profiles_skips_steps_locked_by_another_process(self):
+        generate_payments(payment_batch=20, days_of_history=5, attach_profiles_to_individual_credits=False)
+        generate_disbursements(disbursement_batch=20, days_of_history=5)
+        self.assertTrue(Disbursement.objects.filter(
+            recipient_profile__isnull=True, resolution=DISBURSEMENT_RESOLUTION.SENT,
+        ).exists())
+
+        other_connection = connection.copy()
+        try:
+            with other_connection.cursor() as cursor:
+                for step in ('new credits', 'disbursements'):
+                    cursor.execute(
+                        'SELECT pg_advisory_lock(hashtext(%s))', [f'update_security_profiles: {step}']
+                    )
+            call_command('update_security_profiles', verbosity=0)
+        finally:
+            other_connection.close()
+
+        self.assertFalse(Credit.objects.filter(sender_profile__isnull=False).exists())
+        self.assertFalse(Disbursement.objects.filter(recipient_profile__isnull=False).exists())
+
+        call_command('update_security_profiles', verbosity=0)
+        self._assert_counts()
+        self.assertFalse(Disbursement.objects.filter(
+            recipient_profile__isnull=True, resolution=DISBURSEMENT_RESOLUTION.SENT,
+        ).exists())
+
+    @captured_stdout()
+    @silence_logger()
+    def test_recalculate_totals_resumes_from_checkpoint(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+        call_command('update_security_profiles', verbosity=0)
+
+        sender_totals = dict(SenderProfile.objects.values_list('pk', 'credit_total'))
+        SenderProfile.objects.update(credit_count=0, credit_total=0)
+        sender_profile_pks = sorted(sender_totals.keys())
+        last_pk = sender_profile_pks[len(sender_profile_pks) // 2]
+        BatchCheckpoint.objects.create(name='update_security_profiles: sender profile totals', last_pk=last_pk)
+
+        call_command('update_security_profiles', recalculate_totals=True, batch_size=5, verbosity=0)
+
+        for pk, credit_total in SenderProfile.objects.values_list('pk', 'credit_total'):
+            if pk <= last_pk:
+                self.assertEqual(credit_total, 0)
+            else:
+                self.assertEqual(credit_total, sender_totals[pk])
+        self.assertFalse(BatchCheckpoint.objects.exists())
+
+        call_command('update_security_profiles', recalculate_totals=True, batch_size=5, verbosity=0)
+        self.assertDictEqual(dict(SenderProfile.objects.values_list('pk', 'credit_total')), sender_totals)
+
+    @captured_stdout()
+    @silence_logger()
+    def test_recalculate_totals_restart_ignores_checkpoint(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+        call_command('update_security_profiles', verbosity=0)
+
+        sender_totals = dict(SenderProfile.objects.values_list('pk', 'credit_total'))
+        SenderProfile.objects.update(credit_count=0, credit_total=0)
+        BatchCheckpoint.objects.create(
+            name='update_security_profiles: sender profile totals', last_pk=max(sender_totals.keys()),
+        )
+
+        call_command('update_security_profiles', recalculate_totals=True, restart=True, batch_size=5, verbosity=0)
+        self.assertDictEqual(dict(SenderProfile.objects.values_list('pk', 'credit_total')), sender_totals)
+        self.assertFalse(BatchCheckpoint.objects.exists())
+
+    @captured_stdout()
+    @silence_logger()
+    def test_recalculate_totals_skips_profiles_locked_by_another_process(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+        call_command('update_security_profiles', verbosity=0)
+
+        prisoner_totals = dict(PrisonerProfile.objects.values_list('pk', 'credit_total'))
+        SenderProfile.objects.update(credit_count=0, credit_total=0)
+        PrisonerProfile.objects.update(credit_count=0, credit_total=0)
+
+        other_connection = connection.copy()
+        try:
+            with other_connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_lock(hashtext(%s))', ['update_security_profiles: sender profile totals']
+                )
+            call_command('update_security_profiles', recalculate_totals=True, batch_size=5, verbosity=0)
+        finally:
+            other_connection.close()
+
+        self.assertFalse(SenderProfile.objects.filter(credit_total__gt=0).exists())
+        self.assertDictEqual(dict(PrisonerProfile.objects.values_list('pk', 'credit_total')), prisoner_totals)
+
+    @captured_stdout()
+    @silence_logger()
+    def test_update_security_profiles_ignores_checkpoints(self):
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+        # a checkpoint left by an older version or another process must not cause profiles to be skipped
+        BatchCheckpoint.objects.create(name='update_security_profiles: sender profiles', last_pk=2 ** 62)
+        BatchCheckpoint.objects.create(name='update_security_profiles: prisoner profiles', last_pk=2 ** 62)
+
+        call_command('update_security_profiles', verbosity=0)
+        self._assert_counts()
+
+
+class UpdateSecurityProfilesInWorkersTestCase(ProfileCountsTestMixin, TransactionTestCase):
+    # workers use their own connections so data must be committed for them to see it
+    fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
+
+    def setUp(self):
+        super().setUp()
+        make_test_users()
+        load_random_prisoner_locations()
+        generate_transactions(transaction_batch=50, days_of_history=5)
+        generate_payments(payment_batch=50, days_of_history=5)
+        generate_disbursements(disbursement_batch=50, days_of_history=5)
+
+    def mock_step(self, method_name):
+        method = getattr(UpdateSecurityProfilesCommand, method_name)
+        return mock.patch.object(UpdateSecurityProfilesCommand, method_name, autospec=True, side_effect=method)
+
+    @captured_stdout()
+    @silence_logger()
+    def test_update_security_profiles_in_workers(self):
+        with self.mock_step('handle_profile_attachment_for_legacy_credits') as mocked_legacy_credit_step, \
+                self.mock_step('handle_disbursement_update') as mocked_disbursement_step:
+            call_command('update_security_profiles', workers=2, verbosity=0)
+        self._assert_counts()
+        self.assertEqual(mocked_legacy_credit_step.call_count, 1)
+        self.assertEqual(mocked_disbursement_step.call_count, 1)
+
+        # advisory locks are released so that later runs can take the steps
+        with connection.cursor() as cursor:
+            for step in ('new credits', 'disbursements'):
+                cursor.execute(
+                    'SELECT pg_try_advisory_lock(hashtext(%s))', [f'update_security_profiles: {step}']
+                )
+                self.assertTrue(cursor.fetchone()[0])
+                cursor.execute(
+                    'SELECT pg_advisory_unlock(hashtext(%s))', [f'update_security_profiles: {step}']
+                )
+
 
 class UpdateCurrentPrisonsTestCase(TestCase):
     fixtures = ['initial_types.json', 'test_prisons.json', 'initial_groups.json']
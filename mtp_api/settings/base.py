@@ -93,6 +93,7 @@ INSTALLED_APPS = (
 WSGI_APPLICATION = 'mtp_api.wsgi.application'
 ROOT_URLCONF = 'mtp_api.urls'
 MIDDLEWARE = (
+    'core.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -108,6 +109,7 @@ AUTODISCOVER_HEALTHCHECKS = True
 
 METRICS_USER = os.environ.get('METRICS_USER', 'prom')
 METRICS_PASS = os.environ.get('METRICS_PASS', 'prom')
+REQUEST_METRICS_LOGGING = os.environ.get('REQUEST_METRICS_LOGGING') == 'True'
 
 # security tightening
 # some overridden in prod/docker settings where SSL is ensured